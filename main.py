@@ -4,17 +4,34 @@ load_dotenv("api_key.env")
 import asyncio
 from rich.panel import Panel
 from rich.markdown import Markdown
+from rich.live import Live
 from langchain_core.messages import HumanMessage
 
 
 # Import interni
 from src.graph_agent import build_graph
+from src.config import (mcp_session, rolling_store, intent_fast_path_stats, llm_cache, stream_stats,
+                        SESSION_TARGETS_TTL_S, SESSION_CONFIG_TTL_S, SESSION_METRICS_TTL_S,
+                        TS_STORE_ENABLED, TS_STORE_POLL_S)
+from src.nodes.setup import qos_config_cache
+from src.nodes.retrieval import sample_cluster
+from src.nodes.reporting import pending_summaries
+from src.query_executor import query_executor
+from src.timeseries_store import RollingSampler
 # Setup del logger e Console UI
 from src.logger import console, setup_logger
+from src.session import SessionStore
 
 # Configura il logger globale (Backend)
 log = setup_logger()
 
+# Nodi che producono la risposta finale: titolo e colore del pannello
+FINAL_PANELS = {
+    "allocation_advisor": ("🚀 Allocation Advice", "green"),
+    "synthesizer": ("📋 Capability & Status Report", "blue"),
+    "report_summary": ("📝 Sintesi", "cyan"),
+}
+
 async def main():
     # 1. Header UI
     console.print(Panel.fit(
@@ -30,8 +47,20 @@ async def main():
         log.critical(f"❌ Impossibile avviare il grafo: {e}")
         return
     
+    # Stato di sessione condiviso tra i turni (follow-up senza ripetere il setup)
+    session = SessionStore(
+        targets_ttl=SESSION_TARGETS_TTL_S,
+        config_ttl=SESSION_CONFIG_TTL_S,
+        metrics_ttl=SESSION_METRICS_TTL_S
+    )
+
+    # Campionatore opzionale in background per lo store locale delle serie temporali
+    sampler = RollingSampler(sample_cluster, rolling_store, TS_STORE_POLL_S if TS_STORE_ENABLED else 0)
+    sampler.start()
+
     # 3. Loop Principale
     while True:
+        live = None
         try:
             # Input Utente (UI)
             # Usiamo console.input per mantenere lo stile
@@ -40,60 +69,121 @@ async def main():
             if query.lower() in ['q', 'quit', 'exit', 'esci']: 
                 console.print("[bold blue]👋 Terminazione sessione. A presto![/bold blue]")
                 break
+
+            # Ricarica su richiesta del config QoS (rivalidazione forzata al prossimo turno)
+            if query.lower() in ['reload', '/reload']:
+                qos_config_cache.invalidate()
+                session.clear()
+                console.print("[bold blue]🔄 Config QoS: rivalidazione forzata al prossimo turno.[/bold blue]")
+                continue
             
-            # Stato iniziale
+            # Stato iniziale (arricchito con lo stato di sessione ancora fresco)
             initial_state = {
+                **session.seed(),
                 "messages": [HumanMessage(content=query)],
-                "sanity_check_ok": True,
-                "profile_results": [] 
+                "sanity_check_ok": True
             }
             
             # Separatore visivo: Da qui iniziano i log tecnici
             console.rule("[bold yellow]Elaborazione Agente[/bold yellow]")
             
-            # Esecuzione Grafo (Streaming)     
-            async for output in app.astream(initial_state):
+            # Risposta finale in streaming: pannello Markdown aggiornato token per token
+            streamed = {}   # { nodo: testo ricevuto finora }
+
+            # Esecuzione Grafo (Streaming: aggiornamenti di stato + token delle risposte finali)
+            async for mode, output in app.astream(initial_state, stream_mode=["updates", "custom"]):
+
+                if mode == "custom":
+                    node_name = output.get("node")
+                    if node_name not in FINAL_PANELS:
+                        continue
+                    title, color = FINAL_PANELS[node_name]
+                    if node_name not in streamed:
+                        # Separatore visivo
+                        console.rule(f"[bold {color}]Risposta Finale[/bold {color}]")
+                        console.print("\n")
+                        streamed[node_name] = ""
+                        live = Live(console=console, refresh_per_second=12, vertical_overflow="visible")
+                        live.start()
+                    streamed[node_name] += output.get("token", "")
+                    live.update(Panel(Markdown(streamed[node_name]), title=title, border_style=color))
+                    continue
+
                 for node_name, state_update in output.items():
+
+                    # Aggiornamento dello stato di sessione per i turni successivi
+                    session.record(node_name, state_update)
                     
                     # Intercettiamo la risposta finale per visualizzarla in un bel pannello UI
                     # (Solitamente arriva dal nodo 'allocation_advisor' o 'synthesizer')
-                    if node_name in ["allocation_advisor", "synthesizer"]:
+                    if node_name in FINAL_PANELS:
                         
                         # Recuperiamo l'ultimo messaggio generato
-                        if "messages" in state_update and state_update["messages"]:
+                        if state_update and state_update.get("messages"):
                             final_msg = state_update["messages"][-1].content
                             
                             # Titolo e Colore in base al nodo
-                            if node_name == "allocation_advisor":
-                                title = "🚀 Allocation Advice"
-                                color = "green"
+                            title, color = FINAL_PANELS[node_name]
+                            panel = Panel(Markdown(final_msg), title=title, border_style=color)
+
+                            if node_name in streamed and live is not None:
+                                # Risposta già mostrata in streaming: ultimo rendering completo e chiusura
+                                live.update(panel)
+                                live.stop()
+                                live = None
                             else:
-                                title = "📋 Capability & Status Report"
-                                color = "blue"
-                            
-                            # Separatore visivo
-                            console.rule(f"[bold {color}]Risposta Finale[/bold {color}]")
-                            console.print("\n")
-                            
-                            # Stampa formattata Markdown
-                            console.print(Panel(
-                                Markdown(final_msg), 
-                                title=title, 
-                                border_style=color
-                            ))
+                                # Separatore visivo
+                                console.rule(f"[bold {color}]Risposta Finale[/bold {color}]")
+                                console.print("\n")
+                                
+                                # Stampa formattata Markdown
+                                console.print(panel)
                             
                     # Se in futuro avrai altri nodi finali (es. conversational), gestiscili qui
                     elif node_name == "conversational":
                          # logica simile...
                          pass
 
+            if live is not None:
+                live.stop()
+                live = None
+
+            # Sintesi LLM del fast report: generata in background, l'esecuzione del grafo è già terminata
+            while pending_summaries:
+                summary = pending_summaries.pop(0)
+                title, color = FINAL_PANELS[summary.node]
+                text = ""
+                live = Live(console=console, refresh_per_second=12, vertical_overflow="visible")
+                live.start()
+                try:
+                    async for token in summary.tokens():
+                        text += token
+                        live.update(Panel(Markdown(text), title=title, border_style=color))
+                    message = await summary.result()
+                    live.update(Panel(Markdown(message.content), title=title, border_style=color))
+                except Exception as e:
+                    log.warning(f"Sintesi LLM del report non disponibile: {e}")
+                live.stop()
+                live = None
+
             console.print("\n[dim]--- Turno completato ---[/dim]")
 
         except Exception as e:
+            if live is not None:
+                live.stop()
             # Gestione errori robusta con stack trace nel logger
             console.rule("[bold red]ERRORE[/bold red]")
             log.error(f"Errore durante l'elaborazione: {e}", exc_info=True)
             console.print("[red]Si è verificato un errore imprevisto. Controlla i log sopra.[/red]")
 
+    # 4. Chiusura del campionatore e della sessione MCP persistente
+    await sampler.stop()
+    query_executor.log_stats()      # Include hit/miss/coalesced della cache PromQL
+    intent_fast_path_stats.log_stats()
+    llm_cache.log_stats()
+    llm_cache.flush()
+    stream_stats.log_stats()
+    await mcp_session.close()
+
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
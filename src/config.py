@@ -1,18 +1,29 @@
 import os
+import math
 from langchain_groq import ChatGroq
 from langchain_mcp_adapters.client import MultiServerMCPClient
 from rich.console import Console
 
+from src.mcp_session import MCPSessionManager
+from src.query_cache import QueryCache
+from src.timeseries_store import RollingStore
+from src.promql import parse_duration
+from src.recording_rules import RecordingRules
+from src.intent_rules import FastPathStats
+from src.llm_cache import LLMResponseCache
+from src.streaming import StreamStats
+
 
 console = Console()
 
 
 llm = ChatGroq(model="llama-3.3-70b-versatile",temperature=0.1, max_tokens=4096, api_key=os.getenv("GROQ_API_KEY"))
 
+MCP_SERVER_NAME = "mcp-prometheus"
 MCP_SERVER_PATH = "C:\\Users\\signo\\Desktop\\Università\\Tesi\\prometheus-mcp-server-main\\src\\prometheus_mcp_server\\main.py"
 client = MultiServerMCPClient(
     {
-        "mcp-prometheus": {
+        MCP_SERVER_NAME: {
             "command": "python",
             "args": [MCP_SERVER_PATH],
             "transport": "stdio",
@@ -20,3 +31,144 @@ client = MultiServerMCPClient(
     }
 )
 
+# Cache del config QoS: intervallo di rivalidazione (s), timeout del download (s) e copia locale di fallback
+QOS_CONFIG_REVALIDATE_S = float(os.getenv("QOS_CONFIG_REVALIDATE_S", "300"))
+QOS_CONFIG_FETCH_TIMEOUT_S = float(os.getenv("QOS_CONFIG_FETCH_TIMEOUT_S", "5"))
+QOS_CONFIG_FALLBACK_PATH = os.getenv("QOS_CONFIG_FALLBACK_PATH", "qos_config.cache.json")
+
+# Sessione tra turni: TTL di freschezza (s) di target, config QoS e snapshot metriche
+SESSION_TARGETS_TTL_S = float(os.getenv("SESSION_TARGETS_TTL_S", "60"))
+SESSION_CONFIG_TTL_S = float(os.getenv("SESSION_CONFIG_TTL_S", "300"))
+SESSION_METRICS_TTL_S = float(os.getenv("SESSION_METRICS_TTL_S", "15"))
+
+# Retrieval batch: fusione delle query delle metriche in poche richieste PromQL
+PROMQL_BATCH_MODE = os.getenv("PROMQL_BATCH_MODE", "1") == "1"
+PROMQL_BATCH_MAX_CHARS = int(os.getenv("PROMQL_BATCH_MAX_CHARS", "6000"))
+
+# Push-down del filtro nodo nelle query PromQL (label che identifica il nodo nelle serie)
+PROMQL_PUSHDOWN = os.getenv("PROMQL_PUSHDOWN", "1") == "1"
+PROMQL_NODE_LABEL = os.getenv("PROMQL_NODE_LABEL", "name")
+
+# Cache dei risultati PromQL: scadenza allineata all'intervallo di scrape (s), LRU oltre N voci
+PROMQL_CACHE_TTL_S = float(os.getenv("PROMQL_CACHE_TTL_S", "15"))
+PROMQL_CACHE_MAX_ENTRIES = int(os.getenv("PROMQL_CACHE_MAX_ENTRIES", "512"))
+
+# Esecutore query PromQL: concorrenza massima, deadline per query (s), retry con backoff (s)
+# e hedging opzionale delle query lente oltre il percentile di latenza indicato
+PROMQL_MAX_CONCURRENCY = int(os.getenv("PROMQL_MAX_CONCURRENCY", "8"))
+PROMQL_QUERY_TIMEOUT_S = float(os.getenv("PROMQL_QUERY_TIMEOUT_S", "10"))
+PROMQL_RETRIES = int(os.getenv("PROMQL_RETRIES", "2"))
+PROMQL_RETRY_BACKOFF_S = float(os.getenv("PROMQL_RETRY_BACKOFF_S", "0.2"))
+PROMQL_HEDGE = os.getenv("PROMQL_HEDGE", "0") == "1"
+PROMQL_HEDGE_PERCENTILE = float(os.getenv("PROMQL_HEDGE_PERCENTILE", "95"))
+
+# Retrieval demand-driven: sul ramo allocation scarica solo le metriche usate dai profili selezionati
+METRICS_DEMAND_DRIVEN = os.getenv("METRICS_DEMAND_DRIVEN", "1") == "1"
+
+# Analisi di stabilità multi-finestra (es. "1h,24h,7d"): tutte le finestre derivano da un'unica range query.
+# Campioni minimi per la finestra più corta (fissano la risoluzione del fetch) e massimi per finestra
+# (le finestre lunghe vengono sottocampionate: mai più campioni di quanti ne servano alle statistiche)
+STABILITY_WINDOWS_S = sorted(parse_duration(w) for w in os.getenv("STABILITY_WINDOWS", "1h,24h,7d").split(",") if w.strip())
+STABILITY_MIN_POINTS = int(os.getenv("STABILITY_MIN_POINTS", "12"))
+STABILITY_MAX_POINTS = int(os.getenv("STABILITY_MAX_POINTS", "300"))
+PROMQL_MAX_RANGE_POINTS = 11000     # Limite di Prometheus sui punti per serie di una range query
+
+# Retrieval a finestra sul ramo allocation (opt-in): per le metriche pesate dai profili una range query
+# alimenta sia lo snapshot sia le statistiche di stabilità (finestra e risoluzione in secondi).
+# Il fetch avviene prima del filtro dei candidati, quindi copre tutti i nodi: di default l'analisi di
+# stabilità scarica lo storico da sola, limitato ai candidati.
+# Default: la finestra più lunga, alla risoluzione più grossolana che garantisce STABILITY_MIN_POINTS
+# campioni alla finestra più corta
+METRICS_RANGE_MODE = os.getenv("METRICS_RANGE_MODE", "0") == "1"
+METRICS_RANGE_WINDOW_S = int(os.getenv("METRICS_RANGE_WINDOW_S", str(STABILITY_WINDOWS_S[-1])))
+METRICS_RANGE_STEP_S = int(os.getenv("METRICS_RANGE_STEP_S", str(max(
+    STABILITY_WINDOWS_S[0] // STABILITY_MIN_POINTS,
+    math.ceil(METRICS_RANGE_WINDOW_S / PROMQL_MAX_RANGE_POINTS),
+    1
+))))
+
+# Store locale delle serie temporali (ring buffer per nodo/metrica con statistiche incrementali):
+# finestra (s), campioni massimi per serie, distanza minima tra campioni (s), copertura minima (s e campioni)
+# per usarlo al posto dello storico PromQL, e intervallo del campionatore in background (0 = disattivo).
+# Di default la distanza minima è finestra / capacità, così il ring buffer può contenere l'intera finestra;
+# le statistiche locali sostituiscono lo storico solo quando i campioni coprono davvero la finestra
+TS_STORE_ENABLED = os.getenv("TS_STORE_ENABLED", "1") == "1"
+TS_STORE_WINDOW_S = float(os.getenv("TS_STORE_WINDOW_S", "86400"))
+TS_STORE_CAPACITY = int(os.getenv("TS_STORE_CAPACITY", "1440"))
+TS_STORE_MIN_INTERVAL_S = float(os.getenv("TS_STORE_MIN_INTERVAL_S", str(TS_STORE_WINDOW_S / TS_STORE_CAPACITY)))
+TS_STORE_MIN_WINDOW_S = float(os.getenv("TS_STORE_MIN_WINDOW_S", "3600"))
+TS_STORE_MIN_SAMPLES = int(os.getenv("TS_STORE_MIN_SAMPLES", "30"))
+TS_STORE_EWMA_ALPHA = float(os.getenv("TS_STORE_EWMA_ALPHA", "0.1"))
+TS_STORE_POLL_S = float(os.getenv("TS_STORE_POLL_S", "0"))
+
+# Recording rules Prometheus generate dal config QoS (python -m src.recording_rules):
+# se il file è indicato, le query delle metriche vengono riscritte sulle serie precalcolate
+RECORDING_RULES_FILE = os.getenv("RECORDING_RULES_FILE", "")
+RECORDING_RULES_REWRITE = os.getenv("RECORDING_RULES_REWRITE", "1") == "1"
+# Dopo quanti secondi una serie registrata trovata vuota viene riprovata (es. regole appena caricate)
+RECORDING_RULES_RECHECK_S = float(os.getenv("RECORDING_RULES_RECHECK_S", "300"))
+
+# Fast path della classificazione intento: regole lessicali + match dei nodi attivi, LLM solo se incerto
+INTENT_FAST_PATH = os.getenv("INTENT_FAST_PATH", "1") == "1"
+INTENT_FAST_PATH_MIN_CONFIDENCE = float(os.getenv("INTENT_FAST_PATH_MIN_CONFIDENCE", "0.75"))
+
+# Comprensione della richiesta in un'unica chiamata LLM (intento + profili + vincoli):
+# i nodi task_classifier e constraint_extractor vengono saltati quando il loro output è già nello stato
+REQUEST_UNDERSTANDING = os.getenv("REQUEST_UNDERSTANDING", "1") == "1"
+
+# Parser deterministico dei vincoli numerici (quantità con unità + confronto + sinonimi delle metriche):
+# l'LLM estrae i vincoli solo se restano frammenti numerici non interpretati
+CONSTRAINT_PARSER = os.getenv("CONSTRAINT_PARSER", "1") == "1"
+
+# Streaming dei token delle risposte finali (advisor e synthesizer) verso il loop principale
+LLM_STREAMING = os.getenv("LLM_STREAMING", "1") == "1"
+
+# Report di stato: "fast" = Markdown deterministico dalla matrice del valutatore (nessuna chiamata LLM),
+# "llm" = report scritto dall'LLM. Con REPORT_LLM_SUMMARY il report veloce è seguito da una breve sintesi LLM
+REPORT_MODE = os.getenv("REPORT_MODE", "fast").lower()
+REPORT_LLM_SUMMARY = os.getenv("REPORT_LLM_SUMMARY", "0") == "1"
+
+# Budget (token stimati) della parte dati dei prompt LLM: oltre il budget l'audit viene compresso
+# (prima i controlli falliti, nodi idonei aggregati) e i candidati ridotti ai più rilevanti
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", "6000"))
+PROMPT_TOP_K_CANDIDATES = int(os.getenv("PROMPT_TOP_K_CANDIDATES", "10"))
+
+# Cache persistente delle risposte strutturate dell'LLM (classificatori ed estrattori):
+# chiave = input normalizzato + hash del contesto del prompt, LRU su `max_entries`, copia su file
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH", "llm_cache.json")
+LLM_CACHE_MAX_ENTRIES = int(os.getenv("LLM_CACHE_MAX_ENTRIES", "512"))
+LLM_CACHE_FLUSH_S = float(os.getenv("LLM_CACHE_FLUSH_S", "2"))      # Raggruppamento delle scritture su file
+
+# Sessione MCP persistente: trasporto stdio aperto una volta per processo + registry dei tool in cache
+mcp_session = MCPSessionManager(client, MCP_SERVER_NAME)
+
+# Cache condivisa delle query PromQL (hit/miss esposti via query_cache.stats())
+query_cache = QueryCache(scrape_interval=PROMQL_CACHE_TTL_S, max_entries=PROMQL_CACHE_MAX_ENTRIES)
+
+# Store locale condiviso delle serie temporali (alimentato dal Metrics Engine e dal campionatore)
+rolling_store = RollingStore(
+    window_s=TS_STORE_WINDOW_S,
+    capacity=TS_STORE_CAPACITY,
+    min_interval_s=TS_STORE_MIN_INTERVAL_S,
+    min_window_s=TS_STORE_MIN_WINDOW_S,
+    min_samples=TS_STORE_MIN_SAMPLES,
+    ewma_alpha=TS_STORE_EWMA_ALPHA
+)
+
+# Indice delle recording rules disponibili (vuoto se nessun file è configurato)
+recording_rules = RecordingRules.load(RECORDING_RULES_FILE if RECORDING_RULES_REWRITE else "",
+                                       recheck_s=RECORDING_RULES_RECHECK_S)
+
+# Contatori del fast path della classificazione intento (regole vs. LLM)
+intent_fast_path_stats = FastPathStats()
+
+# Cache condivisa delle risposte strutturate dell'LLM (disattivata = nessuna voce conservata)
+llm_cache = LLMResponseCache(
+    path=LLM_CACHE_PATH if LLM_CACHE_ENABLED else None,
+    max_entries=LLM_CACHE_MAX_ENTRIES if LLM_CACHE_ENABLED else 0,
+    flush_delay=LLM_CACHE_FLUSH_S
+)
+
+# Tempo al primo token e durata delle risposte in streaming (per nodo)
+stream_stats = StreamStats()
@@ -0,0 +1,126 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+
+from src.logger import log
+
+
+class QoSConfigCache:
+    """
+    Cache in memoria della configurazione QoS (metrics + profiles).
+    1. Mantiene il config già parsato tra un turno e l'altro.
+    2. Lo rivalida contro lo SHA-256 del contenuto ogni `revalidate_interval` secondi (o su richiesta):
+       il json.loads viene rifatto SOLO se il contenuto è cambiato.
+    3. Salva l'ultima copia valida su file: se l'endpoint è lento o giù, si riparte da lì.
+    """
+
+    def __init__(self, fetch_text, revalidate_interval: float = 300.0,
+                 fallback_path: str | None = None, fetch_timeout: float = 5.0):
+        self.fetch_text = fetch_text                  # Coroutine che scarica il testo grezzo del config
+        self.revalidate_interval = revalidate_interval
+        self.fallback_path = fallback_path
+        self.fetch_timeout = fetch_timeout
+
+        self._config = None
+        self._hash = None
+        self._checked_at = 0.0
+        self._refresh_task = None
+        self._lock = asyncio.Lock()
+
+    @property
+    def version(self) -> str | None:
+        """Versione corrente: campo 'version' del config se presente, altrimenti l'hash del contenuto."""
+        if self._config is None:
+            return None
+        return str(self._config.get("version") or self._hash[:12])
+
+    @property
+    def digest(self) -> str | None:
+        """SHA-256 del contenuto del config corrente (chiave dei modelli compilati)."""
+        return self._hash
+
+    def invalidate(self):
+        """Forza la rivalidazione alla prossima get()."""
+        self._checked_at = 0.0
+
+    def _is_fresh(self) -> bool:
+        return (time.monotonic() - self._checked_at) < self.revalidate_interval
+
+    def _store(self, text: str, digest: str, source: str):
+        self._config = json.loads(text)
+        self._hash = digest
+        self._checked_at = time.monotonic()
+        log.info(f"Config QoS caricata da {source} (versione {self.version}).")
+
+    def _write_fallback(self, text: str):
+        if not self.fallback_path:
+            return
+        try:
+            tmp_path = f"{self.fallback_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.fallback_path)
+        except OSError as e:
+            log.warning(f"Impossibile salvare la copia locale del config QoS: {e}")
+
+    def _load_fallback(self) -> bool:
+        if not self.fallback_path or not os.path.exists(self.fallback_path):
+            return False
+        try:
+            with open(self.fallback_path, "r", encoding="utf-8") as f:
+                text = f.read()
+            self._store(text, hashlib.sha256(text.encode("utf-8")).hexdigest(), f"file ({self.fallback_path})")
+            # La copia su file va comunque rivalidata al prossimo giro utile
+            self._checked_at = 0.0
+            return True
+        except (OSError, json.JSONDecodeError) as e:
+            log.warning(f"Copia locale del config QoS non utilizzabile: {e}")
+            return False
+
+    async def _revalidate(self):
+        text = await asyncio.wait_for(self.fetch_text(), timeout=self.fetch_timeout)
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+        if digest == self._hash:
+            # Contenuto invariato: nessun re-parsing
+            self._checked_at = time.monotonic()
+            log.info(f"Config QoS invariata (versione {self.version}).")
+            return
+
+        self._store(text, digest, "resource MCP")
+        self._write_fallback(text)
+
+    async def _background_refresh(self):
+        try:
+            async with self._lock:
+                await self._revalidate()
+        except Exception as e:
+            log.warning(f"Refresh in background del config QoS fallito: {e}")
+
+    async def get(self, force: bool = False) -> dict:
+        """
+        Restituisce il config QoS parsato.
+        - Cache fresca: nessun round-trip.
+        - Cache scaduta (o force): rivalidazione via hash; in caso di errore si serve l'ultima copia valida.
+        - Avvio a freddo con copia su file: si risponde subito col file e si rivalida in background.
+        """
+        async with self._lock:
+            if self._config is not None and not force and self._is_fresh():
+                return self._config
+
+            if self._config is None and not force and self._load_fallback():
+                self._refresh_task = asyncio.create_task(self._background_refresh())
+                return self._config
+
+            try:
+                await self._revalidate()
+            except Exception as e:
+                if self._config is None and not self._load_fallback():
+                    raise
+                log.warning(f"Rivalidazione config QoS fallita ({e!r}): uso la copia in cache (versione {self.version}).")
+                # Evitiamo di martellare un endpoint lento: riproviamo al prossimo intervallo
+                self._checked_at = time.monotonic()
+
+            return self._config
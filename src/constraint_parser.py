@@ -0,0 +1,198 @@
+import re
+from dataclasses import dataclass, field
+
+from src.schemas import RequirementExtraction, UserConstraint
+
+
+# --- QUANTITÀ CON UNITÀ ---
+
+# Fattori di conversione (stesse regole del prompt: 1KB = 1024, 1MB = 1024^2, ...)
+_SIZE_FACTORS = {
+    "b": 1, "byte": 1, "bytes": 1,
+    "kb": 1024, "kib": 1024,
+    "mb": 1024 ** 2, "mib": 1024 ** 2,
+    "gb": 1024 ** 3, "gib": 1024 ** 3,
+    "tb": 1024 ** 4, "tib": 1024 ** 4,
+}
+_PERCENT_UNITS = {"%", "percento", "per cento", "percent"}
+_RATE_UNITS = {"ops/s", "op/s", "iops", "req/s", "operazioni al secondo", "operations per second"}
+
+_UNIT_PATTERN = "|".join(sorted(
+    (re.escape(u) for u in list(_SIZE_FACTORS) + list(_PERCENT_UNITS) + list(_RATE_UNITS)),
+    key=len, reverse=True
+))
+_QUANTITY = re.compile(rf"(?<![\w.,])(\d+(?:[.,]\d+)?)\s*({_UNIT_PATTERN})(?![\w/])", re.IGNORECASE)
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+
+# --- PAROLE DI CONFRONTO (italiano + inglese), le più lunghe per prime ---
+
+_COMPARATORS = [
+    (">=", ("almeno", "minimo", "non meno di", "at least", "minimum", "no less than", ">=", "≥")),
+    ("<=", ("al massimo", "al più", "al piu", "massimo", "non più di", "non piu di", "fino a", "at most",
+            "up to", "maximum", "no more than", "<=", "≤")),
+    (">", ("più di", "piu di", "oltre", "sopra", "superiore a", "superiore al", "maggiore di", "more than",
+           "over", "above", "greater than", "higher than", ">")),
+    ("<", ("meno di", "sotto", "inferiore a", "inferiore al", "minore di", "less than", "under", "below",
+           "lower than", "<")),
+]
+_COMPARATOR_LOOKUP = {phrase: op for op, phrases in _COMPARATORS for phrase in phrases}
+_COMPARATOR = re.compile(
+    "|".join(rf"(?<!\w){re.escape(p)}(?!\w)" if p[0].isalpha() else re.escape(p)
+             for p in sorted(_COMPARATOR_LOOKUP, key=len, reverse=True)),
+    re.IGNORECASE
+)
+# Suffissi dopo la quantità: "8GB o più", "20% or less"
+_SUFFIX_COMPARATOR = re.compile(r"^\s*(o più|o piu|or more|o meno|or less)\b", re.IGNORECASE)
+_SUFFIX_OPS = {"o più": ">=", "o piu": ">=", "or more": ">=", "o meno": "<=", "or less": "<="}
+
+# Separatori di clausola: ogni vincolo vive nella sua clausola ("almeno 8GB di RAM e CPU sotto il 20%")
+_CLAUSE_SEPARATOR = re.compile(r"(?<!\d),|,(?!\d)|;|(?<!\w)(?:e|ed|and|con|with|ma|but)(?!\w)", re.IGNORECASE)
+
+# --- SINONIMI DELLE METRICHE (prefissi, per coprire le flessioni italiane) ---
+
+_SYNONYMS = {
+    "memory": ("ram", "memori", "memory", "mem"),
+    "cpu": ("cpu", "processor", "core", "calcol"),
+    # Niente "io": in italiano è il pronome ("io vorrei ..."), il caso tasso è già coperto da "iops"
+    "disk": ("disk", "disco", "dischi", "storage", "iops"),
+    "network": ("rete", "network", "net", "banda", "bandwidth", "traffic"),
+    "available": ("liber", "free", "availab", "disponib", "avail"),
+    "used": ("usat", "used", "usage", "occupat", "utilizz", "uso", "carico", "load"),
+}
+_WORD = re.compile(r"[a-zà-ù0-9/]+")
+
+
+def _matches(word: str, synonym: str) -> bool:
+    return word == synonym or (len(synonym) >= 4 and word.startswith(synonym))
+
+
+def _groups(words) -> set:
+    """Gruppi di sinonimi evocati da un insieme di parole."""
+    return {g for g, synonyms in _SYNONYMS.items() if any(_matches(w, s) for w in words for s in synonyms)}
+
+
+def metric_kind(name: str, definition: dict) -> str | None:
+    """Famiglia di unità della metrica: 'bytes', 'percent', 'rate' (None se non confrontabile)."""
+    unit = str(definition.get("unit", "")).lower()
+    lowered = name.lower()
+    if "byte" in unit:
+        return "bytes"
+    if "percent" in unit or "pct" in unit or unit in ("ratio", "fraction") or lowered.endswith(("_pct", "_percent")):
+        return "percent"
+    if unit in ("rate", "ops", "iops") or "/s" in unit or "per_second" in unit or lowered.endswith("_rate"):
+        return "rate"
+    return None
+
+
+def _percent_scale(definition: dict) -> float:
+    """Le metriche espresse come frazione (0-1) vogliono il valore percentuale diviso per 100."""
+    unit = str(definition.get("unit", "")).lower()
+    return 0.01 if unit in ("ratio", "fraction", "percentage_1") else 1.0
+
+
+@dataclass(slots=True)
+class ParseResult:
+    extraction: RequirementExtraction
+    unparsed: list = field(default_factory=list)   # Frammenti con numeri non interpretati (servono all'LLM)
+
+    @property
+    def complete(self) -> bool:
+        return not self.unparsed
+
+
+class ConstraintParser:
+    """
+    Estrattore deterministico dei vincoli numerici:
+    quantità con unità (KB..TB, %, ops/s) + parola di confronto + metrica individuata per famiglia di unità
+    e sinonimi (nome e descrizione delle metriche del config QoS).
+    """
+
+    def __init__(self, metrics: dict):
+        self.metrics = {}   # { famiglia: [(nome, definizione, gruppi di sinonimi)] }
+        for name, definition in (metrics or {}).items():
+            if not isinstance(definition, dict):
+                continue
+            kind = metric_kind(name, definition)
+            if kind is None:
+                continue
+            words = _WORD.findall(f"{name.replace('_', ' ')} {definition.get('description', '')}".lower())
+            self.metrics.setdefault(kind, []).append((name, definition, _groups(words)))
+
+    def _resolve_metric(self, kind: str, context: str):
+        candidates = self.metrics.get(kind, [])
+        if not candidates:
+            return None
+        context_groups = _groups(_WORD.findall(context.lower()))
+        scored = sorted(((len(groups & context_groups), name, definition) for name, definition, groups in candidates),
+                        key=lambda item: item[0], reverse=True)
+        best = scored[0]
+        if best[0] > 0 and (len(scored) == 1 or scored[1][0] < best[0]):
+            return best[1], best[2]
+        if len(candidates) == 1 and not context_groups - _groups(_WORD.findall(candidates[0][0].replace("_", " "))):
+            # Unica metrica della famiglia e nessun riferimento esplicito ad altre risorse
+            return candidates[0][0], candidates[0][1]
+        return None
+
+    @staticmethod
+    def _comparator(prefix: str, suffix: str) -> str | None:
+        found = None
+        for match in _COMPARATOR.finditer(prefix):
+            found = _COMPARATOR_LOOKUP[match.group(0).lower()]
+        suffix_match = _SUFFIX_COMPARATOR.match(suffix)
+        if suffix_match:
+            return _SUFFIX_OPS[suffix_match.group(1).lower()]
+        return found
+
+    def parse(self, text: str) -> ParseResult:
+        constraints, unparsed = [], []
+        separators = list(_CLAUSE_SEPARATOR.finditer(text))
+        starts = [0] + [m.end() for m in separators]
+        ends = [m.start() for m in separators] + [len(text)]
+
+        for start, end in zip(starts, ends):
+            clause = text[start:end]
+            quantities = list(_QUANTITY.finditer(clause))
+            covered = set()
+
+            for k, q in enumerate(quantities):
+                covered.update(range(q.start(), q.end()))
+                # Contesto del vincolo: dalla quantità precedente alla successiva (all'interno della clausola)
+                ctx_start = quantities[k - 1].end() if k else 0
+                ctx_end = quantities[k + 1].start() if k + 1 < len(quantities) else len(clause)
+                prefix, suffix = clause[ctx_start:q.start()], clause[q.end():ctx_end]
+
+                number = float(q.group(1).replace(",", "."))
+                unit = q.group(2).lower()
+                if unit in _SIZE_FACTORS:
+                    kind, value = "bytes", number * _SIZE_FACTORS[unit]
+                elif unit in _PERCENT_UNITS:
+                    kind, value = "percent", number
+                else:
+                    kind, value = "rate", number
+
+                op = self._comparator(prefix, suffix)
+                if op is None and kind == "bytes":
+                    op = ">="   # "8GB di RAM": una dimensione senza confronto è un requisito minimo
+                resolved = self._resolve_metric(kind, prefix + " " + suffix)
+                if op is None or resolved is None:
+                    unparsed.append(clause.strip())
+                    continue
+
+                metric_name, definition = resolved
+                if kind == "percent":
+                    value *= _percent_scale(definition)
+                constraints.append(UserConstraint(
+                    metric_name=metric_name, operator=op, value=value,
+                    original_text=" ".join((prefix + q.group(0) + suffix).split()).rstrip("?!.")
+                ))
+
+            # Numeri senza unità riconosciuta (es. "4 core", "10ms"): li lasciamo all'LLM
+            for n in _NUMBER.finditer(clause):
+                if n.start() not in covered and clause.strip() not in unparsed:
+                    unparsed.append(clause.strip())
+
+        return ParseResult(RequirementExtraction(constraints=constraints), unparsed)
+
+
+def parse_constraints(text: str, metrics: dict) -> ParseResult:
+    return ConstraintParser(metrics).parse(text)
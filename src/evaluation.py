@@ -0,0 +1,172 @@
+import math
+import operator
+import numpy as np
+
+from src.snapshot import MetricsSnapshot
+
+
+# Operatori supportati nei required_conditions: codice compatto -> (simbolo, funzione scalare, ufunc NumPy)
+_OPERATORS = [
+    ("<", operator.lt, np.less),
+    ("<=", operator.le, np.less_equal),
+    (">", operator.gt, np.greater),
+    (">=", operator.ge, np.greater_equal),
+    ("==", operator.eq, np.equal),
+    ("!=", operator.ne, np.not_equal),
+]
+_OP_CODES = {symbol: code for code, (symbol, _, _) in enumerate(_OPERATORS)}
+_NO_OP = -1     # Operatore sconosciuto: il requisito non viene verificato (come nel valutatore per profilo)
+_BAD_THRESHOLD = -2     # Soglia non numerica: il requisito fallisce sempre ("Type Error")
+
+
+class CompiledProfiles:
+    """
+    Requisiti di tutti i profili compilati in array paralleli (uno per requisito):
+    profilo di appartenenza, metrica, codice operatore e soglia.
+    La valutazione di N nodi x R requisiti diventa un'unica operazione vettoriale.
+    """
+
+    __slots__ = ("profiles", "req_profile", "req_metric", "req_op", "req_threshold", "membership")
+
+    def __init__(self, profiles: list):
+        self.profiles = [p.get("profile_name", "Unknown") for p in profiles]
+
+        req_profile, req_metric, req_op, req_threshold = [], [], [], []
+        for p_idx, profile in enumerate(profiles):
+            for req in profile.get("required_conditions", []):
+                code = _OP_CODES.get(req.get("operator"), _NO_OP)
+                try:
+                    threshold = float(req.get("threshold"))
+                except (TypeError, ValueError):
+                    threshold = math.nan
+                    if code != _NO_OP:
+                        code = _BAD_THRESHOLD
+                req_profile.append(p_idx)
+                req_metric.append(req.get("metric"))
+                req_op.append(code)
+                req_threshold.append(threshold)
+
+        self.req_profile = np.array(req_profile, dtype=np.int64)
+        self.req_metric = req_metric
+        self.req_op = np.array(req_op, dtype=np.int64)
+        self.req_threshold = np.array(req_threshold, dtype=np.float64)
+
+        # Matrice di appartenenza requisiti x profili (per aggregare i fallimenti con un prodotto matriciale)
+        self.membership = np.zeros((len(req_profile), len(self.profiles)), dtype=np.float64)
+        self.membership[np.arange(len(req_profile)), self.req_profile] = 1.0
+
+    def __len__(self) -> int:
+        return len(self.req_metric)
+
+
+class ProfileEvaluation:
+    """
+    Risultato della valutazione: matrice profili x nodi di idoneità (bool).
+    Le righe di audit per nodo vengono costruite solo su richiesta (report, debug).
+    """
+
+    __slots__ = ("compiled", "snapshot", "nodes", "passed")
+
+    def __init__(self, compiled: CompiledProfiles, snapshot: MetricsSnapshot, nodes: list, passed: np.ndarray):
+        self.compiled = compiled
+        self.snapshot = snapshot
+        self.nodes = nodes
+        self.passed = passed
+
+    @property
+    def profiles(self) -> list:
+        return self.compiled.profiles
+
+    def qualified_nodes(self, profile_name: str) -> list:
+        """Nodi idonei al profilo (lista vuota se il profilo non è stato valutato)."""
+        if profile_name not in self.compiled.profiles:
+            return []
+        row = self.passed[self.compiled.profiles.index(profile_name)]
+        return [node for node, ok in zip(self.nodes, row) if ok]
+
+    def qualification_map(self) -> dict:
+        """{ profilo: set(nodi idonei) }"""
+        return {p: set(self.qualified_nodes(p)) for p in self.compiled.profiles}
+
+    def audit_lines(self, profile_name: str, node: str) -> list:
+        """Righe di audit del nodo per il profilo, nello stesso formato del valutatore per profilo."""
+        compiled = self.compiled
+        p_idx = compiled.profiles.index(profile_name)
+        lines = []
+        for r in np.flatnonzero(compiled.req_profile == p_idx):
+            metric_key = compiled.req_metric[r]
+            code = int(compiled.req_op[r])
+            val = self.snapshot.get(node, metric_key)
+
+            if val is None:
+                lines.append(f"{metric_key}: N/A (FAIL)")
+                break
+            if code == _NO_OP:
+                continue
+            if code == _BAD_THRESHOLD:
+                lines.append(f"{metric_key}: Type Error (FAIL)")
+                continue
+
+            op_sym, op_func, _ = _OPERATORS[code]
+            thresh = float(compiled.req_threshold[r])
+            if op_func(val, thresh):
+                lines.append(f"{metric_key}: {val} {op_sym} {thresh} (PASS)")
+            else:
+                lines.append(f"{metric_key}: {val} not {op_sym} {thresh} (FAIL)")
+        return lines
+
+    def analysis_lines(self, profile_name: str) -> dict:
+        """{ nodo: [righe di audit] } per tutti i nodi valutati."""
+        return {node: self.audit_lines(profile_name, node) for node in self.nodes}
+
+
+def normalize_profiles(raw_profiles) -> list:
+    """Profili del config QoS (dict o lista) come lista di dict con 'profile_name'."""
+    profiles = []
+    if isinstance(raw_profiles, dict):
+        for name, data in raw_profiles.items():
+            if isinstance(data, dict):
+                enriched_profile = data.copy()
+                if "profile_name" not in enriched_profile:
+                    enriched_profile["profile_name"] = name
+                profiles.append(enriched_profile)
+    elif isinstance(raw_profiles, list):
+        profiles = raw_profiles
+    return profiles
+
+
+def evaluate_profiles(profiles: list | CompiledProfiles, snapshot: MetricsSnapshot,
+                      target_filter: str | None = None) -> ProfileEvaluation:
+    """
+    Valuta tutti i profili su tutti i nodi in un'unica passata vettoriale.
+    1. Valori dei requisiti: matrice nodi x requisiti estratta dallo snapshot (NaN se manca il dato).
+    2. Confronto per codice operatore (una ufunc per operatore, non per nodo).
+    3. Fallimenti aggregati per profilo con un prodotto matriciale (nodi x requisiti) @ (requisiti x profili).
+    """
+    compiled = profiles if isinstance(profiles, CompiledProfiles) else CompiledProfiles(profiles)
+
+    if target_filter:
+        snapshot = snapshot.subset([target_filter])
+    nodes = list(snapshot.nodes)
+
+    # 1. Colonne dello snapshot richieste dai requisiti (-1 = metrica assente)
+    cols = np.array([snapshot.metric_index.get(m, -1) for m in compiled.req_metric], dtype=np.int64)
+    values = np.full((len(nodes), len(cols)), np.nan)
+    present = cols >= 0
+    if len(nodes) and present.any():
+        values[:, present] = snapshot.values[:, cols[present]]
+
+    # 2. Esito per requisito: un dato mancante fa fallire il requisito
+    ok = np.ones_like(values, dtype=bool)
+    for code, (_, _, ufunc) in enumerate(_OPERATORS):
+        mask = compiled.req_op == code
+        if mask.any():
+            ok[:, mask] = ufunc(values[:, mask], compiled.req_threshold[mask])
+    ok[:, compiled.req_op == _BAD_THRESHOLD] = False
+    ok &= ~np.isnan(values)
+
+    # 3. Un profilo è soddisfatto se nessuno dei suoi requisiti fallisce
+    failures = (~ok).astype(np.float64) @ compiled.membership
+    passed = (failures == 0).T
+
+    return ProfileEvaluation(compiled, snapshot, nodes, passed)
@@ -1,63 +1,11 @@
 from langgraph.graph import StateGraph, END
-from langgraph.types import Send
 
 from .state import AgentState
 from .nodes import setup, retrieval, analysis, decision, reporting
+from .config import METRICS_DEMAND_DRIVEN, REQUEST_UNDERSTANDING
+from .logger import log
 
 
-def map_profiles(state: AgentState):
-    """
-    Mappa i profili QoS in nodi di valutazione.
-    OTTIMIZZAZIONE (Early Binding): 
-    Se abbiamo già identificato i profili target (es. cpu-bound), valutiamo SOLO quelli.
-    Se l'intento è generico ("status") o non chiaro, valutiamo TUTTO (Fallback).
-    """
-
-    config = state.get("qos_config", {})
-    raw_profiles = config.get("profiles", [])
-    metrics = state.get("metrics_report")
-    
-    # 1. Recupero contesto decisionale (già popolato dall'task_classifier a monte)
-    target_profiles = state.get("target_profiles", [])
-    intent = state.get("intent", "status") 
-
-    # 2. Normalizzazione Profili
-    all_profiles_list = []
-    if isinstance(raw_profiles, dict):
-        for name, data in raw_profiles.items():
-            if isinstance(data, dict):
-                enriched_profile = data.copy()
-                if "profile_name" not in enriched_profile:
-                    enriched_profile["profile_name"] = name
-                all_profiles_list.append(enriched_profile)
-    elif isinstance(raw_profiles, list):
-        all_profiles_list = raw_profiles
-    
-    # --- FILTRO ARCHITETTURALE ---
-    profiles_to_scan = []
-    
-    # Se siamo in allocazione e abbiamo capito cosa vuole l'utente, filtriamo.
-    if intent == "allocation" and target_profiles:
-        profiles_to_scan = [p for p in all_profiles_list if p['profile_name'] in target_profiles]
-        # Fallback di sicurezza: se il filtro svuota tutto (es. nome profilo errato), scansiona tutto
-        if not profiles_to_scan:
-            profiles_to_scan = all_profiles_list
-    else:
-        # Status Report o Intento generico: Scansione completa.
-        profiles_to_scan = all_profiles_list
-
-    # Debug
-    # print(f"DEBUG: Dispatching evaluation for {len(profiles_to_scan)} profiles (Target: {target_profiles})")
-
-    return [
-        Send("single_profile_evaluator", {
-            "profile": p, 
-            "metrics": metrics,
-            "target_filter": state.get("target_filter")
-        }) 
-        for p in profiles_to_scan
-    ]
-
 # 1. Definiamo la funzione di routing iniziale
 def route_initial_intent(state):
     """
@@ -74,24 +22,62 @@ def route_initial_intent(state):
 def route_after_metrics(state: AgentState):
     """
     Decide il percorso dopo aver scaricato le metriche.
-    - Se l'intento è 'allocation', passiamo all'Intent Classifier per affinare il target.
-    - Se l'intento è 'status', saltiamo il classifier e lanciamo subito il Map-Reduce su tutto.
+    - Se l'intento è 'allocation' e i profili non sono ancora noti, passiamo all'Intent Classifier per affinare il target.
+    - Altrimenti (status, oppure profili già selezionati) lanciamo subito la valutazione dei profili.
     """
     intent = state.get("intent", "status")
     
-    if intent == "allocation":
+    if intent == "allocation" and not state.get("target_profiles"):
         # Andiamo al nodo di classificazione tecnica
         return "task_classifier"
     else:
-        # SHORTCUT: Saltiamo il classifier e avviamo direttamente i worker (Map-Reduce)
-        # Nota: Qui chiamiamo direttamente la funzione map_profiles per generare i Send()
-        return map_profiles(state)
+        # SHORTCUT: Saltiamo il classifier e avviamo direttamente la valutazione vettoriale dei profili
+        return "profile_evaluator"
+
+
+def route_session_entry(state: AgentState):
+    """
+    Ingresso del grafo con stato di sessione.
+    Se target e config QoS sono arrivati freschi dal turno precedente, saltiamo il setup.
+    """
+    if state.get("active_targets") and state.get("qos_config"):
+        log.info("Sessione: contesto fresco, salto il Context Manager.")
+        return "classifier"
+    return "context"
+
+
+def route_after_classifier(state: AgentState):
+    """
+    Riusa lo snapshot metriche del turno precedente se ancora fresco e compatibile:
+    uno snapshot dell'intero cluster copre anche le domande su un singolo nodo.
+    OTTIMIZZAZIONE (Demand-Driven): sul ramo allocation classifichiamo prima il task,
+    così il Metrics Engine scarica solo le metriche dei profili selezionati.
+    """
+    if state.get("intent") == "allocation" and METRICS_DEMAND_DRIVEN:
+        # Profili già selezionati dalla chiamata combinata: niente Task Classifier
+        return route_after_task(state) if state.get("target_profiles") else "task_classifier"
+    if not retrieval.missing_metrics(state):
+        log.info("Sessione: snapshot metriche fresco, salto il Metrics Engine.")
+        return route_after_metrics(state)
+    return "metrics_engine"
+
+
+def route_after_task(state: AgentState):
+    """Dopo la classificazione del task: scarichiamo solo le metriche mancanti, poi valutiamo i profili."""
+    missing = retrieval.missing_metrics(state)
+    if missing:
+        return "metrics_engine"
+    log.info("Snapshot metriche già completo per i profili selezionati, salto il Metrics Engine.")
+    return "profile_evaluator"
 
 
 # --- ROUTING ---
 def route_after_evaluation(state):
         match state["intent"]:
             case "allocation":
+                # Vincoli già estratti dalla chiamata combinata: direttamente al filtro candidati
+                if state.get("explicit_constraints") is not None:
+                    return ["candidate_filter"]
                 return ["constraint_extractor"]
             case "status":
                 return ["synthesizer"]
@@ -107,7 +93,9 @@ async def build_graph():
     
     # --- 1. REGISTRAZIONE NODI ---
     workflow.add_node("context", setup.context_manager_node)
-    workflow.add_node("classifier", decision.classify_intent_node) 
+    # Classificatore: chiamata combinata (intento + profili + vincoli) oppure solo intento
+    workflow.add_node("classifier", decision.understand_request_node if REQUEST_UNDERSTANDING
+                      else decision.classify_intent_node)
     workflow.add_node("metrics_engine", retrieval.metrics_engine_node)
     workflow.add_node("task_classifier", decision.classify_task_node) 
 
@@ -115,7 +103,8 @@ async def build_graph():
     #workflow.add_node("conversational", decision.conversational_node)
     
     # Nodi Ramo Status
-    workflow.add_node("single_profile_evaluator", analysis.single_profile_evaluator_node)
+    # Valutazione vettoriale di tutti i profili in un solo nodo (niente fan-out di un worker per profilo)
+    workflow.add_node("profile_evaluator", analysis.profile_evaluator_node)
     workflow.add_node("synthesizer", reporting.report_synthesizer_node)
     
     # Nodi Ramo Allocation
@@ -128,9 +117,17 @@ async def build_graph():
     
     # Setup Iniziale
 
-    workflow.set_entry_point("context")
+    # L'ingresso dipende dallo stato di sessione: gli stadi con input ancora freschi vengono saltati
+    workflow.set_conditional_entry_point(
+        route_session_entry,
+        ["context", "classifier"]
+    )
     workflow.add_edge("context", "classifier")
-    workflow.add_edge("classifier", "metrics_engine")
+    workflow.add_conditional_edges(
+        "classifier",
+        route_after_classifier,
+        ["metrics_engine", "task_classifier", "profile_evaluator"]
+    )
 
     #workflow.set_entry_point("classifier")
     # workflow.add_conditional_edges(
@@ -149,27 +146,29 @@ async def build_graph():
     
     # --- BIVIO STRATEGICO (La correzione) ---
     # Dopo le metriche, controlliamo l'intento.
-    # Possiamo andare al nodo "task_classifier" OPPURE direttamente ai nodi "single_profile_evaluator" (via Send)
+    # Possiamo andare al nodo "task_classifier" OPPURE direttamente al nodo "profile_evaluator"
     workflow.add_conditional_edges(
         "metrics_engine",
         route_after_metrics, 
-        ["task_classifier", "single_profile_evaluator"]
+        ["task_classifier", "profile_evaluator"]
     )
     
     # --- RAMO ALLOCATION (Step intermedio) ---
-    # Se siamo passati dall'task_classifier, ORA lanciamo il Map-Reduce (filtrato)
+    # Se siamo passati dall'task_classifier, scarichiamo le sole metriche dei profili scelti
+    # (se mancano) e ORA lanciamo la valutazione (filtrata)
     workflow.add_conditional_edges(
         "task_classifier",
-        map_profiles, 
-        ["single_profile_evaluator"]
+        route_after_task, 
+        ["metrics_engine", "profile_evaluator"]
     )
     
     # --- POST-VALUTAZIONE (Convergenza) ---
     workflow.add_conditional_edges(
-        "single_profile_evaluator",
+        "profile_evaluator",
         route_after_evaluation,
         {
             "constraint_extractor": "constraint_extractor",
+            "candidate_filter": "candidate_filter",
             "synthesizer": "synthesizer"
         }
     )
@@ -180,6 +179,7 @@ async def build_graph():
     workflow.add_edge("stability_analyzer", "allocation_advisor")
 
     # --- CHIUSURA ---
+    # Fast report: la sintesi LLM opzionale parte in background dal synthesizer (il grafo non la aspetta)
     workflow.add_edge("synthesizer", END)
     workflow.add_edge("allocation_advisor", END)
     
@@ -0,0 +1,180 @@
+import math
+import warnings
+from array import array
+import numpy as np
+
+from src.snapshot import MetricsSnapshot
+
+
+def _window_stats(samples: np.ndarray) -> dict:
+    """
+    Statistiche di finestra calcolate in un'unica passata vettoriale sull'asse temporale.
+    samples: tensore nodi x metriche x istanti (NaN dove il campione manca).
+    """
+    valid = ~np.isnan(samples)
+    count = valid.sum(axis=2)
+
+    with warnings.catch_warnings():
+        # Serie senza campioni: nanmean/nanstd restituiscono NaN (ed emettono RuntimeWarning)
+        warnings.simplefilter("ignore", category=RuntimeWarning)
+        mean = np.nanmean(samples, axis=2)
+        std = np.nanstd(samples, axis=2)   # Deviazione standard di popolazione, come stddev_over_time
+        low = np.nanmin(samples, axis=2)
+        high = np.nanmax(samples, axis=2)
+
+    # Valore corrente: ultimo campione valido della serie
+    n_points = samples.shape[2]
+    if n_points:
+        last = n_points - 1 - np.argmax(valid[:, :, ::-1], axis=2)
+        current = np.take_along_axis(samples, last[:, :, None], axis=2)[:, :, 0]
+    else:
+        current = np.full(count.shape, np.nan)
+
+    return {
+        "current": current,
+        "mean": mean,
+        "std": std,
+        "min": low,
+        "max": high,
+        "count": count.astype(np.float64),
+    }
+
+
+class MetricsHistory:
+    """
+    Storico colonnare delle metriche su una finestra temporale (una range query per metrica).
+    - samples: tensore float64 nodi x metriche x istanti allineati alla griglia start + k * step
+    - stats: { statistica: matrice nodi x metriche } (current, mean, std, min, max, count)
+    Alimenta sia lo snapshot corrente sia l'analisi di stabilità, senza subquery lato server.
+    """
+
+    __slots__ = ("nodes", "metrics", "node_index", "metric_index", "start", "step", "samples", "stats",
+                 "_window_cache")
+
+    def __init__(self, nodes: list, metrics: list, start: float, step: float, samples: np.ndarray):
+        self.nodes = list(nodes)
+        self.metrics = list(metrics)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+        self.start = start
+        self.step = step
+        self.samples = samples
+        self.stats = _window_stats(samples)
+        self._window_cache = {}
+
+    @classmethod
+    def empty(cls, metrics: list | None = None, start: float = 0.0, step: float = 1.0) -> "MetricsHistory":
+        metrics = metrics or []
+        return cls([], metrics, start, step, np.full((0, len(metrics), 0), np.nan))
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __bool__(self) -> bool:
+        return len(self.nodes) > 0
+
+    @property
+    def span(self) -> float:
+        """Ampiezza temporale coperta dalla griglia (s)."""
+        return max(0, self.samples.shape[2] - 1) * self.step
+
+    def covers(self, window_s: float) -> bool:
+        return self.span + self.step >= window_s
+
+    def window_stats(self, window_s: float, max_points: int | None = None) -> dict:
+        """
+        Statistiche sulla sola coda della griglia lunga `window_s` (finestre più corte derivate per slicing).
+        Risoluzione adattiva: oltre `max_points` campioni la finestra viene sottocampionata
+        (passo multiplo di quello del fetch, ancorato all'ultimo campione).
+        """
+        key = (window_s, max_points)
+        if key not in self._window_cache:
+            n_total = self.samples.shape[2]
+            n_points = min(n_total, int(window_s // self.step) + 1)
+            stride = self._stride(n_points, max_points)
+            idx = np.arange(n_total - 1, n_total - 1 - n_points, -stride)[::-1]
+            self._window_cache[key] = _window_stats(self.samples[:, :, idx])
+        return self._window_cache[key]
+
+    @staticmethod
+    def _stride(n_points: int, max_points: int | None) -> int:
+        return max(1, math.ceil(n_points / max_points)) if max_points else 1
+
+    def window_step(self, window_s: float, max_points: int | None = None) -> float:
+        """Risoluzione effettiva (s) usata da window_stats per la finestra indicata."""
+        n_points = min(self.samples.shape[2], int(window_s // self.step) + 1)
+        return self.step * self._stride(n_points, max_points)
+
+    def get(self, node: str, metric: str, stat: str = "mean", default=None):
+        """Statistica di finestra (float) della metrica per il nodo, oppure `default` se mancante."""
+        i = self.node_index.get(node)
+        j = self.metric_index.get(metric)
+        if i is None or j is None:
+            return default
+        value = self.stats[stat][i, j]
+        return default if math.isnan(value) else float(value)
+
+    def snapshot(self, decimals: int | None = 3) -> MetricsSnapshot:
+        """Snapshot istantaneo (ultimo campione di ogni serie) nel formato usato dal resto del grafo."""
+        current = self.stats["current"]
+        if decimals is not None:
+            current = np.round(current, decimals)
+        return MetricsSnapshot(self.nodes, self.metrics, current)
+
+    def __repr__(self) -> str:
+        return (f"MetricsHistory(nodes={len(self.nodes)}, metrics={len(self.metrics)}, "
+                f"points={self.samples.shape[2]}, step={self.step:g}s)")
+
+
+class HistoryBuilder:
+    """
+    Accumulatore usato dal decoder per le range query: riceve le serie (metrica, nodo, campioni)
+    e le allinea sulla griglia temporale comune in un'unica assegnazione vettoriale.
+    """
+
+    def __init__(self, metrics: list, start: float, step: float, points: int, node_filter: str | None = None):
+        self.metrics = list(metrics)
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+        self.start = start
+        self.step = step
+        self.points = points
+        self.node_filter = node_filter
+
+        self.node_index = {}
+        self._rows = array("q")
+        self._cols = array("q")
+        self._series = []   # [(timestamps, valori)] nello stesso ordine di _rows/_cols
+
+    def add_series(self, metric: str, node: str, timestamps: np.ndarray, values: np.ndarray):
+        if self.node_filter and node != self.node_filter:
+            return
+        j = self.metric_index.get(metric)
+        if j is None:
+            return
+        i = self.node_index.setdefault(node, len(self.node_index))
+        self._rows.append(i)
+        self._cols.append(j)
+        self._series.append((timestamps, values))
+
+    def filled_metrics(self) -> set:
+        """Metriche per cui è arrivata almeno una serie."""
+        return {self.metrics[j] for j in set(self._cols)}
+
+    def build(self) -> MetricsHistory:
+        samples = np.full((len(self.node_index), len(self.metrics), self.points), np.nan)
+        if self._series:
+            rows = np.frombuffer(self._rows, dtype=np.int64)
+            cols = np.frombuffer(self._cols, dtype=np.int64)
+            lengths = np.fromiter((len(ts) for ts, _ in self._series), dtype=np.int64, count=len(self._series))
+
+            # Tutte le serie concatenate: un solo calcolo degli indici temporali per l'intero risultato
+            timestamps = np.concatenate([ts for ts, _ in self._series])
+            values = np.concatenate([vals for _, vals in self._series])
+            slots = np.rint((timestamps - self.start) / self.step).astype(np.int64)
+            in_window = (slots >= 0) & (slots < self.points)
+
+            series_rows = np.repeat(rows, lengths)[in_window]
+            series_cols = np.repeat(cols, lengths)[in_window]
+            samples[series_rows, series_cols, slots[in_window]] = values[in_window]
+
+        return MetricsHistory(list(self.node_index.keys()), self.metrics, self.start, self.step, samples)
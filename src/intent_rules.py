@@ -0,0 +1,146 @@
+import re
+import difflib
+from dataclasses import dataclass
+
+from src.logger import log
+
+
+# Pattern lessicali (italiano + inglese) per i casi evidenti: nessuna chiamata LLM se l'esito è netto.
+# L'allocazione richiede un verbo/costrutto di piazzamento INSIEME a un sostantivo di carico di lavoro:
+# da soli sono troppo generici ("quale host è più carico?", "lancia un report").
+_ALLOCATION_PATTERNS = [re.compile(p) for p in (
+    r"\balloc", r"\bdeploy", r"\bschedul", r"\bpiazz", r"\blanci", r"\besegui", r"\bhostar",
+    r"\bdove (posso|conviene|dovrei|mett|esegu|lanc|far)", r"\b(migliore|miglior) nodo\b",
+    r"\bnodo (migliore|più adatto|piu adatto)\b", r"\bbest node\b", r"\bwhere (should|can|could) i\b",
+    r"\bplace\b", r"\brun\b",
+)]
+_WORKLOAD_PATTERNS = [re.compile(p) for p in (
+    r"\bjobs?\b", r"\bpods?\b", r"\bworkloads?\b", r"\btasks?\b", r"\bcontainers?\b",
+    r"\bcaric(o|hi) di lavoro\b",
+)]
+_STATUS_PATTERNS = [re.compile(p) for p in (
+    r"\bstat(o|us)\b", r"\bcome sta", r"\bcome va", r"\bsalute\b", r"\bhealth", r"\bsituazione\b",
+    r"\bpanoramica\b", r"\boverview\b", r"\bmetriche\b", r"\butilizzo\b", r"\busage\b", r"\breport\b",
+    r"\bmonitor", r"\bidone[io]\b", r"\bcapacit[àa]\b", r"\bquali profili\b",
+)]
+
+_TOKEN = re.compile(r"[\w.:-]+")
+_NON_ALNUM = re.compile(r"[^a-z0-9]")
+_NO_TARGET = object()   # Target ambiguo: più nodi possibili, la decisione passa all'LLM
+
+FUZZY_CUTOFF = 0.85
+FUZZY_PENALTY = 0.15
+
+
+@dataclass(frozen=True, slots=True)
+class IntentGuess:
+    intent: str | None
+    target_filter: str | None
+    confidence: float
+    reason: str
+
+
+def _compact(text: str) -> str:
+    return _NON_ALNUM.sub("", text.lower())
+
+
+def match_target(text: str, targets: list) -> tuple:
+    """
+    Nodo menzionato nel testo tra quelli attivi: (nodo | None | _NO_TARGET, esatto).
+    1. Match esatto del nome (case-insensitive, come parola intera)
+    2. Match a meno di separatori (worker1 ~ worker-1)
+    3. Match fuzzy sui token (refusi), accettato solo se il nodo più simile è unico
+    """
+    lowered = text.lower()
+    exact = {t for t in targets if re.search(rf"(?<![\w-]){re.escape(t.lower())}(?![\w-])", lowered)}
+    if len(exact) > 1:
+        return _NO_TARGET, True
+    if exact:
+        return exact.pop(), True
+
+    tokens = _TOKEN.findall(lowered)
+    by_compact = {}
+    for t in targets:
+        by_compact.setdefault(_compact(t), []).append(t)
+    compact_hits = {t for token in tokens for t in by_compact.get(_compact(token), [])}
+    if len(compact_hits) > 1:
+        return _NO_TARGET, True
+    if compact_hits:
+        return compact_hits.pop(), True
+
+    fuzzy_hits = set()
+    lowered_targets = {t.lower(): t for t in targets}
+    for token in tokens:
+        if len(token) < 4:
+            continue
+        matches = difflib.get_close_matches(token, list(lowered_targets), n=2, cutoff=FUZZY_CUTOFF)
+        if len(matches) > 1:
+            scores = [difflib.SequenceMatcher(None, token, m).ratio() for m in matches]
+            if scores[0] == scores[1]:
+                return _NO_TARGET, False
+        if matches:
+            fuzzy_hits.add(lowered_targets[matches[0]])
+    if len(fuzzy_hits) > 1:
+        return _NO_TARGET, False
+    if fuzzy_hits:
+        return fuzzy_hits.pop(), False
+    return None, True
+
+
+def classify_intent_rules(text: str, targets: list) -> IntentGuess:
+    """
+    Pre-classificatore deterministico dell'intento (allocation / status) e del nodo target.
+    Restituisce sempre un IntentGuess: con confidence bassa (o intent None) il chiamante ripiega sull'LLM.
+    """
+    lowered = text.lower()
+    verb_hits = sum(1 for p in _ALLOCATION_PATTERNS if p.search(lowered))
+    workload_hits = sum(1 for p in _WORKLOAD_PATTERNS if p.search(lowered))
+    # Verbo di piazzamento senza carico di lavoro (o viceversa): segnale insufficiente, decide l'LLM
+    allocation_hits = verb_hits + workload_hits if verb_hits and workload_hits else 0
+    status_hits = sum(1 for p in _STATUS_PATTERNS if p.search(lowered))
+
+    if allocation_hits and not status_hits:
+        intent, hits = "allocation", allocation_hits
+    elif status_hits and not allocation_hits:
+        intent, hits = "status", status_hits
+    else:
+        return IntentGuess(None, None, 0.0,
+                           f"segnali contrastanti o assenti (allocation={allocation_hits}, status={status_hits})")
+
+    target, exact = match_target(text, targets or [])
+    if target is _NO_TARGET:
+        return IntentGuess(intent, None, 0.0, "nodo target ambiguo")
+
+    confidence = min(1.0, 0.6 + 0.2 * hits)
+    reason = f"{hits} pattern '{intent}'"
+    if target and not exact:
+        confidence -= FUZZY_PENALTY
+        reason += f", nodo '{target}' per somiglianza"
+    return IntentGuess(intent, target, round(confidence, 2), reason)
+
+
+class FastPathStats:
+    """Contatori del fast path: classificazioni risolte dalle regole vs. delegate all'LLM."""
+
+    def __init__(self):
+        self.fast = 0
+        self.llm = 0
+
+    def record(self, fast: bool):
+        if fast:
+            self.fast += 1
+        else:
+            self.llm += 1
+
+    def stats(self) -> dict:
+        total = self.fast + self.llm
+        return {
+            "fast": self.fast,
+            "llm": self.llm,
+            "fast_ratio": (self.fast / total) if total else 0.0,
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        log.info(f"Classificazione intento: fast path {s['fast']} | LLM {s['llm']} | "
+                 f"fast ratio {s['fast_ratio']:.0%}")
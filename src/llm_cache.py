@@ -0,0 +1,200 @@
+import os
+import re
+import json
+import asyncio
+import hashlib
+import unicodedata
+from collections import OrderedDict
+
+from src.logger import log
+
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " \t\n\"'`.,;:!?¿¡"
+
+
+def normalize_input(text: str) -> str:
+    """Chiave testuale della richiesta: Unicode NFKC, case-folding, spazi compattati, punteggiatura ai bordi rimossa."""
+    text = unicodedata.normalize("NFKC", text or "").casefold()
+    return _SPACES.sub(" ", text).strip(_EDGE_PUNCTUATION)
+
+
+def context_hash(*parts) -> str:
+    """Hash stabile della porzione di contesto che entra nel prompt (tabella profili, metriche, nodi...)."""
+    payload = json.dumps(parts, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class LLMResponseCache:
+    """
+    Cache persistente delle risposte strutturate dell'LLM (classificatori ed estrattori).
+    1. Chiave: tipo di chiamata + input utente normalizzato + hash del contesto del prompt.
+    2. Eviction LRU oltre `max_entries`.
+    3. Copia su file (scrittura atomica) per riusare le risposte tra un avvio e l'altro:
+       scritture raggruppate ogni `flush_delay` secondi ed eseguite fuori dall'event loop, flush() alla chiusura.
+    4. Le voci che dipendono dal config QoS vengono invalidate quando cambia il contenuto (hash) del config.
+    Solo le risposte valide vengono salvate: gli errori dell'LLM non entrano in cache.
+    """
+
+    def __init__(self, path: str | None = None, max_entries: int = 512, flush_delay: float = 2.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.flush_delay = flush_delay
+
+        self._entries = OrderedDict()   # { chiave: {"kind", "data", "config_version"} }
+        self._config_version = None
+        self._dirty = False
+        self._flush_task = None
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @staticmethod
+    def make_key(kind: str, user_input: str, context: str = "") -> str:
+        raw = f"{kind}\x00{normalize_input(user_input)}\x00{context}"
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    # --- PERSISTENZA ---
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+            self._config_version = data.get("config_version")
+            for key, entry in data.get("entries", []):
+                self._entries[key] = entry
+            log.info(f"Cache LLM caricata da {self.path}: {len(self._entries)} risposte.")
+        except (OSError, ValueError, TypeError) as e:
+            log.warning(f"Cache LLM su file non utilizzabile: {e}")
+            self._entries.clear()
+
+    def _write(self, data: dict):
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            log.warning(f"Impossibile salvare la cache LLM su file: {e}")
+
+    def _snapshot(self) -> dict:
+        # Copia superficiale: le voci non vengono mai modificate dopo l'inserimento (put le sostituisce)
+        self._dirty = False
+        return {"config_version": self._config_version, "entries": list(self._entries.items())}
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.flush_delay)
+        self._flush_task = None
+        if self._dirty:
+            await asyncio.to_thread(self._write, self._snapshot())
+
+    def _save(self):
+        """Segna la cache come modificata e pianifica una scrittura raggruppata (sincrona fuori da un event loop)."""
+        if not self.path:
+            return
+        self._dirty = True
+        if self._flush_task is not None:
+            return
+        try:
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+        except RuntimeError:
+            self._write(self._snapshot())
+
+    def flush(self):
+        """Scrive subito le modifiche in sospeso (da chiamare alla chiusura)."""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            self._flush_task = None
+        if self.path and self._dirty:
+            self._write(self._snapshot())
+
+    # --- INVALIDAZIONE ---
+
+    def sync_config(self, version: str | None):
+        """Allinea la cache all'hash del config QoS: le voci legate a un contenuto diverso vengono scartate."""
+        if version is None or version == self._config_version:
+            return
+        stale = [k for k, e in self._entries.items()
+                 if e.get("config_version") is not None and e.get("config_version") != version]
+        for key in stale:
+            del self._entries[key]
+        self.invalidations += len(stale)
+        if stale:
+            log.info(f"Cache LLM: {len(stale)} risposte invalidate (config QoS {str(self._config_version)[:12]} -> {version[:12]}).")
+        self._config_version = version
+        self._save()
+
+    # --- LOOKUP ---
+
+    def get(self, key: str, schema):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        try:
+            result = schema.model_validate(entry["data"])
+        except Exception:
+            # Schema cambiato rispetto alla copia su file: la voce non è più valida
+            del self._entries[key]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, key: str, kind: str, result, depends_on_config: bool = False):
+        self._entries[key] = {
+            "kind": kind,
+            "data": result.model_dump(mode="json"),
+            "config_version": self._config_version if depends_on_config else None,
+        }
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        self._save()
+
+    async def structured(self, kind: str, user_input: str, context: str, schema, invoke,
+                         depends_on_config: bool = False):
+        """
+        Risposta strutturata dalla cache oppure da `invoke()` (coroutine factory che chiama l'LLM).
+        - kind: tipo di chiamata (intent, task, constraints)
+        - context: hash della porzione di contesto che entra nel prompt
+        """
+        key = self.make_key(kind, user_input, context)
+        cached = self.get(key, schema)
+        if cached is not None:
+            log.info(f"Cache LLM hit ({kind}).")
+            return cached
+        result = await invoke()
+        self.put(key, kind, result, depends_on_config)
+        return result
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+            "entries": len(self._entries),
+            "hit_ratio": (self.hits / lookups) if lookups else 0.0,
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        log.info(f"Cache LLM: hit {s['hits']} | miss {s['misses']} | evictions {s['evictions']} | "
+                 f"invalidate {s['invalidations']} | entries {s['entries']} | hit ratio {s['hit_ratio']:.0%}")
+
+    def clear(self):
+        self._entries.clear()
+        self._save()
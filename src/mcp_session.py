@@ -0,0 +1,164 @@
+import asyncio
+import anyio
+from mcp.shared.exceptions import McpError
+from mcp.types import CONNECTION_CLOSED
+from langchain_mcp_adapters.tools import load_mcp_tools
+from langchain_mcp_adapters.resources import load_mcp_resources
+
+from src.logger import log
+
+
+# Tool del server Prometheus usati dai nodi del grafo
+REQUIRED_TOOLS = ("health_check", "get_targets", "execute_query")
+
+# Errori che indicano un trasporto rotto (processo MCP terminato, pipe chiusa, ecc.)
+TRANSPORT_ERRORS = (
+    anyio.ClosedResourceError,
+    anyio.BrokenResourceError,
+    anyio.EndOfStream,
+    ConnectionError,
+    EOFError,
+)
+
+
+def is_transport_error(exc: Exception) -> bool:
+    if isinstance(exc, TRANSPORT_ERRORS):
+        return True
+    return isinstance(exc, McpError) and exc.error.code == CONNECTION_CLOSED
+
+
+class MCPSessionManager:
+    """
+    Sessione MCP persistente condivisa da tutti i nodi del grafo.
+    1. Apre il trasporto stdio UNA sola volta per processo (task dedicato che tiene viva la sessione).
+    2. Risolve i tool in un registry in cache (nome -> tool), senza rifare il discovery ad ogni turno.
+    3. In caso di errore di trasporto chiude la sessione e si riconnette in modo trasparente.
+    """
+
+    def __init__(self, client, server_name: str):
+        self.client = client
+        self.server_name = server_name
+
+        self._session = None
+        self._tools = {}            # Registry: { "execute_query": BaseTool, ... }
+        self._runner = None         # Task che possiede il context manager della sessione stdio
+        self._ready = None          # Evento: sessione aperta e tool risolti
+        self._stop = None           # Evento: richiesta di chiusura della sessione
+        self._error = None
+        self._generation = 0        # Incrementata ad ogni sessione aperta (evita riconnessioni doppie)
+        self._lock = asyncio.Lock()
+
+    async def _run_session(self):
+        # Il context manager stdio va aperto e chiuso nello stesso task (vincolo anyio),
+        # quindi lo teniamo vivo qui finché non viene richiesto lo stop.
+        try:
+            async with self.client.session(self.server_name) as session:
+                tools = await load_mcp_tools(session)
+                self._session = session
+                self._tools = {t.name: t for t in tools}
+                self._generation += 1
+
+                missing = [name for name in REQUIRED_TOOLS if name not in self._tools]
+                if missing:
+                    log.warning(f"Tool MCP mancanti sul server '{self.server_name}': {missing}")
+                log.info(f"Sessione MCP aperta ({self.server_name}): {len(self._tools)} tool in cache.")
+
+                self._ready.set()
+                await self._stop.wait()
+        except Exception as e:
+            self._error = e
+            log.error(f"Sessione MCP terminata con errore: {e}")
+        finally:
+            self._session = None
+            self._tools = {}
+            self._ready.set()
+
+    def _is_open(self) -> bool:
+        return bool(self._runner and not self._runner.done() and self._session is not None)
+
+    async def _open(self):
+        # Da chiamare con self._lock acquisito
+        self._error = None
+        self._ready = asyncio.Event()
+        self._stop = asyncio.Event()
+        self._runner = asyncio.create_task(self._run_session())
+        await self._ready.wait()
+
+        if self._session is None:
+            raise ConnectionError(f"Impossibile aprire la sessione MCP: {self._error}")
+        return self._tools
+
+    async def connect(self):
+        """Apre la sessione (se non già attiva) e restituisce il registry dei tool."""
+        async with self._lock:
+            if self._is_open():
+                return self._tools
+            return await self._open()
+
+    async def _close(self):
+        if self._runner and not self._runner.done():
+            self._stop.set()
+            await asyncio.gather(self._runner, return_exceptions=True)
+        self._runner = None
+
+    async def close(self):
+        """Chiude la sessione e svuota il registry."""
+        async with self._lock:
+            await self._close()
+
+    async def reconnect(self, failed_generation: int | None = None):
+        """
+        Riapre la sessione. Con `failed_generation` riconnette solo se la sessione fallita è ancora quella attiva:
+        se un'altra coroutine l'ha già sostituita si riusa il nuovo registry (niente chiusure a catena nel fan-out).
+        """
+        async with self._lock:
+            if failed_generation is not None and self._generation != failed_generation and self._is_open():
+                return self._tools
+            log.warning(f"Riconnessione sessione MCP ({self.server_name})...")
+            await self._close()
+            return await self._open()
+
+    async def get_tools(self) -> dict:
+        return await self.connect()
+
+    async def get_tool(self, name: str):
+        """Restituisce il tool richiesto dal registry in cache (None se il server non lo espone)."""
+        tools = await self.connect()
+        return tools.get(name)
+
+    async def call_tool(self, name: str, args: dict):
+        """
+        Invoca un tool dal registry.
+        Se la chiamata fallisce per un problema di sessione, si riconnette e riprova una volta.
+        """
+        tool = await self.get_tool(name)
+        if tool is None:
+            raise LookupError(f"Tool '{name}' non trovato su MCP Server.")
+
+        generation = self._generation
+        try:
+            return await tool.ainvoke(args)
+        except Exception as e:
+            if not is_transport_error(e):
+                # Errore applicativo (es. query PromQL errata): nessuna riconnessione
+                raise
+            log.warning(f"Errore di sessione durante '{name}' ({e}). Nuovo tentativo dopo riconnessione.")
+            tools = await self.reconnect(generation)
+            tool = tools.get(name)
+            if tool is None:
+                # Il server riavviato non espone più il tool: stesso errore del caso "tool mancante"
+                raise LookupError(f"Tool '{name}' non trovato su MCP Server dopo la riconnessione.")
+            return await tool.ainvoke(args)
+
+    async def get_resources(self, uris):
+        """Scarica le resource richieste riusando la sessione persistente."""
+        await self.connect()
+        generation = self._generation
+        try:
+            return await load_mcp_resources(self._session, uris=uris)
+        except Exception as e:
+            if not is_transport_error(e):
+                raise
+            log.warning(f"Errore download resource ({e}). Nuovo tentativo dopo riconnessione.")
+            await self.reconnect(generation)
+            return await load_mcp_resources(self._session, uris=uris)
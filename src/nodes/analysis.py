@@ -1,111 +1,74 @@
 import json
-import operator
-import asyncio
+import time
+import numpy as np
 from rich.panel import Panel
 from rich.console import Console
 
 # Import interni
 from src.state import AgentState
-from src.config import client
-from src.utils import parse_prometheus_output, get_strictest_threshold_config, get_physical_threshold, classify_stability
+from src.config import (mcp_session, rolling_store, recording_rules, TS_STORE_ENABLED, PROMQL_PUSHDOWN,
+                        STABILITY_WINDOWS_S, STABILITY_MAX_POINTS, STABILITY_MIN_POINTS, METRICS_RANGE_STEP_S)
+from src.promql import format_duration
+from src.stability import StabilityReport
+from src.query_executor import query_executor
+from src.nodes.retrieval import fetch_history, fetch_snapshot
+from src.snapshot import MetricsSnapshot
+from src.evaluation import evaluate_profiles
+from src.qos_model import qos_model
 from src.logger import log
 
 
 console = Console()
 
-# Mappa degli operatori per la valutazione sicura 
-OPS = {
-    "<": operator.lt,
-    "<=": operator.le,
-    ">": operator.gt,
-    ">=": operator.ge,
-    "==": operator.eq,
-    "!=": operator.ne
-}
-
-async def single_profile_evaluator_node(state):
+
+def select_profiles(state: AgentState) -> list | None:
     """
-    Valutatore di Profilo Singolo.
-    Controlla i nodi contro i requisiti definiti in un profilo QoS.
-    1. Itera sui nodi e verifica i requisiti matematici.
-    2. Registra i risultati dettagliati.
-    3. Prepara il payload di risultato.
+    Profili QoS da valutare (None = tutti).
+    OTTIMIZZAZIONE (Early Binding): 
+    Se abbiamo già identificato i profili target (es. cpu-bound), valutiamo SOLO quelli.
+    Se l'intento è generico ("status") o non chiaro, valutiamo TUTTO (Fallback).
+    Il fallback su nomi di profilo errati è gestito da QoSModel.select().
     """
-    profile = state["profile"]
-    metrics_json = state["metrics"]
-    target_filter = state.get("target_filter")
+    target_profiles = state.get("target_profiles", [])
 
-    try:
-        metrics_data = json.loads(metrics_json)
-    except:
-        metrics_data = {}
+    # Se siamo in allocazione e abbiamo capito cosa vuole l'utente, filtriamo.
+    if state.get("intent", "status") == "allocation" and target_profiles:
+        return target_profiles
 
-    profile_name = profile.get("profile_name", "Unknown")
-    requirements = profile.get("required_conditions", [])
-    
-    qualified_nodes = []
-    analysis_log = {} 
-
-    # 1. Iteriamo sui nodi
-    for node, node_metrics in metrics_data.items():
-        if target_filter and node != target_filter:
-            continue
-
-        is_qualified = True
-        node_logs = []
-
-        # 2. Verifica matematica dei requisiti
-        for req in requirements:
-            metric_key = req.get("metric")
-            op_sym = req.get("operator")
-            threshold = req.get("threshold")
-            
-            val = node_metrics.get(metric_key)
-            
-            if val is None:
-                is_qualified = False
-                node_logs.append(f"{metric_key}: N/A (FAIL)")
-                break
-
-            op_func = OPS.get(op_sym)
-            if op_func:
-                try:
-                    val_float = float(val)
-                    thresh_float = float(threshold)
-                    
-                    if op_func(val_float, thresh_float):
-                        node_logs.append(f"{metric_key}: {val_float} {op_sym} {thresh_float} (PASS)")
-                    else:
-                        is_qualified = False
-                        node_logs.append(f"{metric_key}: {val_float} not {op_sym} {thresh_float} (FAIL)")
-                except ValueError:
-                     is_qualified = False
-                     node_logs.append(f"{metric_key}: Type Error (FAIL)")
-
-        if is_qualified:
-            qualified_nodes.append(node)
-        
-        analysis_log[node] = node_logs
-
-    # 3. Preparazione Risultato
-    result_payload = {
-        "profile_name": profile_name,
-        "qualified_nodes": qualified_nodes,
-        "analysis_lines": analysis_log
-    }
+    # Status Report o Intento generico: Scansione completa.
+    return None
+
+
+async def profile_evaluator_node(state: AgentState):
+    """
+    Valutatore vettoriale dei profili (sostituisce il fan-out di un worker per profilo).
+    1. Compila i required_conditions di tutti i profili in array (metrica, operatore, soglia).
+    2. Calcola la matrice profili x nodi di idoneità con NumPy in un'unica passata.
+    3. Le righe di audit per nodo restano lazy (generate dal report solo se servono).
+    """
+    start_time = time.perf_counter()
+    snapshot = state.get("metrics_report") or MetricsSnapshot.empty()
+    compiled = qos_model(state).compiled_profiles(select_profiles(state))
+
+    evaluation = evaluate_profiles(compiled, snapshot, target_filter=state.get("target_filter"))
+    elapsed_ms = (time.perf_counter() - start_time) * 1000
 
     # --- VISUALIZZAZIONE ---
-    count = len(qualified_nodes)
-    if count > 0:
-        # Visuale per l'utente (con colori)
-        console.print(f"⚡ Profilo di carico valutato ({profile_name}): [bold green]{count}[/bold green] nodi idonei.")
-        # Log di sistema (testo pulito)
-        log.info(f"Profilo di carico valutato ({profile_name}): {count} nodi idonei.")
-    else:
-        console.print(f"⚡ Profilo di carico valutato ({profile_name}): Nessun nodo soddisfa i requisiti.", style="yellow")
-        log.info(f"Profilo di carico valutato ({profile_name}): Nessun nodo soddisfa i requisiti.")
+    for profile_name in evaluation.profiles:
+        count = len(evaluation.qualified_nodes(profile_name))
+        if count > 0:
+            # Visuale per l'utente (con colori)
+            console.print(f"⚡ Profilo di carico valutato ({profile_name}): [bold green]{count}[/bold green] nodi idonei.")
+            # Log di sistema (testo pulito)
+            log.info(f"Profilo di carico valutato ({profile_name}): {count} nodi idonei.")
+        else:
+            console.print(f"⚡ Profilo di carico valutato ({profile_name}): Nessun nodo soddisfa i requisiti.", style="yellow")
+            log.info(f"Profilo di carico valutato ({profile_name}): Nessun nodo soddisfa i requisiti.")
+
+    log.info(f"Valutazione vettoriale: {len(evaluation.profiles)} profili x {len(evaluation.nodes)} nodi "
+             f"({len(evaluation.compiled)} requisiti) in {elapsed_ms:.2f}ms.")
 
-    return {"profile_results": [json.dumps(result_payload)]}
+    return {"profile_evaluation": evaluation}
 
 
 async def stability_analyzer_node(state: AgentState):
@@ -114,120 +77,162 @@ async def stability_analyzer_node(state: AgentState):
     Esegue analisi storiche parallele per identificare anomalie nei nodi candidati
     rispetto ai profili di carico individuati.
     1. Recupera i nodi candidati e i profili di carico individuati.
-    2. Costruisce ed esegue query storiche in parallelo.
-    3. Analizza i risultati per classificare la stabilità.
+    2. Ricava le statistiche per finestra (es. 1h / 24h / 7d) da store locale, storico in memoria,
+       recording rules o, in mancanza, da un'unica range query sulla finestra più lunga.
+    3. Classifica la stabilità di tutte le finestre insieme (vince lo stato più grave).
     4. Prepara il report di stabilità.
 
     """
-    candidates = state.get("final_candidates", [])
+    candidates = list(dict.fromkeys(state.get("final_candidates", [])))
     target_profiles = state.get("target_profiles", [])
-    config = state.get("qos_config", {})
-    metrics_def = config.get("metrics", {})
-    profiles_def = config.get("profiles", {})
-    metrics_json = state.get("metrics_report", "{}")
+    model = qos_model(state)
+    current_data_snapshot = state.get("metrics_report") or MetricsSnapshot.empty()
+    history = state.get("metrics_history")
     
     if not candidates or not target_profiles:
-        return {"stability_report": {}}
+        return {"stability_report": StabilityReport.empty()}
 
-    tools = await client.get_tools()
-    query_tool = next((t for t in tools if t.name == "execute_query"), None)
-    if not query_tool: 
-        log.error("Tool 'execute_query' mancante. Salto analisi stabilità.")
-        return {"stability_report": {}}
 
-
-    console.print(Panel("📉 Avvio Analisi Stabilità (Parallel Async)", style="blue"))
+    console.print(Panel("📉 Avvio Analisi Stabilità (Multi-finestra)", style="blue"))
     log.info("Avvio Analisi Stabilità.")
 
-    # Trova le soglie più restrittive dai profili target (Principio di Cautela)
-    active_thresholds_map = get_strictest_threshold_config(target_profiles, profiles_def)
-    metrics_to_analyze = set()
-    for p in target_profiles:
-        # Per ogni profilo target recupero i nomi delle metriche a cui sono associati pesi di scoring
-        metrics_to_analyze.update(profiles_def.get(p, {}).get("scoring_weights", {}).keys())
-
-    time_window = "24h"
-    resolution = "5m"
-    
-    tasks = []
-    task_metadata = [] 
-
-    # Costruzione ed esecuzione query storiche in parallelo
-    for metric_name in metrics_to_analyze:
-        this_metric_def = metrics_def.get(metric_name, {})
-        base_query = this_metric_def.get("query")
-        if not base_query: continue
-
-        q_avg = f"avg_over_time(({base_query})[{time_window}:{resolution}])"
-        q_std = f"stddev_over_time(({base_query})[{time_window}:{resolution}])"
-
-        tasks.append(query_tool.ainvoke({"query": q_avg}))
-        task_metadata.append({"metric": metric_name, "type": "avg"})
-
-        tasks.append(query_tool.ainvoke({"query": q_std}))
-        task_metadata.append({"metric": metric_name, "type": "std"})
-
-    if not tasks:
-        return {"stability_report": {}}
-
-    # Visuale
-    console.print(f"🚀 Lancio [bold]{len(tasks)}[/bold] query storiche simultanee...")
-    # Log
-    log.info(f"Lancio {len(tasks)} query storiche simultanee...")
-
-    results_raw = await asyncio.gather(*tasks, return_exceptions=True)
-
-    temp_results = {} 
-    for i, res in enumerate(results_raw):
-        meta = task_metadata[i]
-        m_name = meta["metric"]
-        q_type = meta["type"]
-
-        if isinstance(res, Exception):
-            log.warning(f"⚠️ Errore query storica {m_name} ({q_type}): {res}")
-            continue
-        
-        parsed_data = parse_prometheus_output(res, m_name)
-        if m_name not in temp_results: 
-            temp_results[m_name] = {}
-        temp_results[m_name][q_type] = parsed_data
-
-    stability_report = {}
-    try:
-        current_data_snapshot = json.loads(metrics_json)
-    except:
-        current_data_snapshot = {}
-    
-    spikes_found = 0
-
-    for metric_name, data_pair in temp_results.items():
-        parsed_avg = data_pair.get("avg", {})
-        parsed_std = data_pair.get("std", {})
-        
-        this_metric_def = metrics_def.get(metric_name, {})
-        phys_threshold = get_physical_threshold(metric_name, this_metric_def, active_thresholds_map)
-
-        for node in candidates:
-            curr_val = current_data_snapshot.get(node, {}).get(metric_name)
-            avg_val = parsed_avg.get(node)
-            std_val = parsed_std.get(node)
-
-            if curr_val is not None and avg_val is not None:
-                result = classify_stability(float(curr_val), avg_val, std_val, phys_threshold)
-                
-                if node not in stability_report: stability_report[node] = {}
-                stability_report[node][metric_name] = {
-                    "status": result["status"],
-                    "reason": result["reason"],
-                    "stats": result["metrics"]
-                }
-
-                if result["status"] in ["SPIKE", "CHAOTIC"]:
-                    # Qui warning va bene sia per console che log perché è importante
-                    console.print(f"⚠️ Instabilità rilevata su {node} [{metric_name}]: {result['status']}", style="bold red")
-                    log.warning(f"Instabilità rilevata su {node} [{metric_name}]: {result['status']}")
-                    spikes_found += 1
+    # Metriche con pesi di scoring nei profili target (indice precalcolato del config compilato)
+    metrics_to_analyze = model.weighted_metrics(target_profiles)
+
+    # Finestre di analisi (es. 1h / 24h / 7d), tutte valutate insieme
+    windows = STABILITY_WINDOWS_S
+    labels = [format_duration(w) for w in windows]
+    avg_tensor = np.full((len(windows), len(candidates), len(metrics_to_analyze)), np.nan)
+    std_tensor = np.full_like(avg_tensor, np.nan)
+    covered = np.zeros((len(windows), len(metrics_to_analyze)), dtype=bool)   # finestre x metriche
+
+    def fill_from_history(source):
+        """Statistiche per finestra derivate per slicing da un unico storico (risoluzione adattiva)."""
+        rows = np.array([source.node_index.get(n, -1) for n in candidates], dtype=np.int64)
+        found = rows >= 0
+        for w, window_s in enumerate(windows):
+            if not source.covers(window_s):
+                continue
+            stats = source.window_stats(window_s, STABILITY_MAX_POINTS)
+            for j, metric_name in enumerate(metrics_to_analyze):
+                if covered[w, j] or metric_name not in source.metric_index:
+                    continue
+                col = source.metric_index[metric_name]
+                if not np.isfinite(stats["mean"][rows[found], col]).any():
+                    continue    # Metrica senza storico (range query fallita): resta da coprire
+                avg_tensor[w, found, j] = stats["mean"][rows[found], col]
+                std_tensor[w, found, j] = stats["std"][rows[found], col]
+                covered[w, j] = True
+        log.info("Finestre di stabilità: " + ", ".join(
+            f"{label} @ {format_duration(source.window_step(w, STABILITY_MAX_POINTS))}"
+            for label, w in zip(labels, windows) if source.covers(w)))
+
+    # 1. Store locale (statistiche incrementali): risponde per la sua finestra solo se, per tutti i candidati,
+    #    i campioni accumulati la coprono davvero (uno store di poche ore non vale come finestra di 24h)
+    if TS_STORE_ENABLED and rolling_store.window_s in windows:
+        w = windows.index(rolling_store.window_s)
+        for j, metric_name in enumerate(metrics_to_analyze):
+            local_stats = [rolling_store.window_stats(n, metric_name) for n in candidates]
+            if all(rolling_store.covers(st, rolling_store.window_s) for st in local_stats):
+                avg_tensor[w, :, j] = [st["mean"] for st in local_stats]
+                std_tensor[w, :, j] = [st["std"] for st in local_stats]
+                covered[w, j] = True
+        if covered[w].any():
+            log.info(f"Statistiche di stabilità ({labels[w]}) dallo store locale per "
+                     f"{[m for j, m in enumerate(metrics_to_analyze) if covered[w, j]]}.")
+
+    # 2. Storico della range query del Metrics Engine: nessuna query aggiuntiva
+    if history is not None:
+        fill_from_history(history)
+
+    # 3. Recording rules: medie e deviazioni per finestra già precalcolate da Prometheus,
+    #    lette con query istantanee sulle serie registrate (nessuna aggregazione sul percorso della richiesta)
+    recorded = {}   # { serie registrata: (finestra, metrica, tensore di destinazione) }
+    for j, metric_name in enumerate(metrics_to_analyze):
+        query = model.metrics[metric_name].query
+        for w, window_s in enumerate(windows):
+            if covered[w, j] or not query:
+                continue
+            avg_record = recording_rules.window_record(query, "avg", window_s)
+            std_record = recording_rules.window_record(query, "stddev", window_s)
+            if avg_record and std_record:
+                recorded[avg_record] = (w, j, avg_tensor)
+                recorded[std_record] = (w, j, std_tensor)
+
+    if recorded:
+        recorded_snapshot, failed_records, _ = await fetch_snapshot(
+            list(recorded), {record: {"query": record} for record in recorded},
+            nodes=candidates if PROMQL_PUSHDOWN else None, decimals=None
+        )
+        rows = np.array([recorded_snapshot.node_index.get(n, -1) for n in candidates], dtype=np.int64)
+        found = rows >= 0
+        arrived = np.zeros_like(covered, dtype=np.int64)
+        for record, (w, j, tensor) in recorded.items():
+            col = recorded_snapshot.metric_index.get(record)
+            values = recorded_snapshot.values[rows[found], col] if col is not None else np.empty(0)
+            if not np.isfinite(values).any():
+                if record not in failed_records:
+                    recording_rules.mark_unavailable(record)   # Query riuscita ma nessuna serie: regola non caricata
+                continue
+            tensor[w, found, j] = recorded_snapshot.values[rows[found], col]
+            arrived[w, j] += 1
+        covered |= arrived == 2     # Servono sia la media sia la deviazione standard
+        log.info(f"Statistiche di stabilità da recording rules: {int((arrived == 2).sum())} coppie finestra/metrica.")
+
+    # 4. Fallback: UNA range query per le metriche non ancora coperte, con push-down sui soli candidati.
+    #    La finestra è la più lunga ancora scoperta (non sempre l'ultima: es. 7d già dalle recording rules)
+    #    e la risoluzione si adatta alla più corta scoperta; le finestre più corte derivano per slicing
+    missing_cols = [j for j, m in enumerate(metrics_to_analyze) if not covered[:, j].all() and model.metrics[m].query]
+    missing = [metrics_to_analyze[j] for j in missing_cols]
+    uncovered = [windows[w] for w in range(len(windows)) if missing_cols and not covered[w, missing_cols].all()]
+    failed_queries = []
+    if missing and await mcp_session.get_tool("execute_range_query") is None:
+        log.warning(f"Tool 'execute_range_query' non trovato su MCP Server: storico non disponibile per {missing}.")
+        failed_queries = missing
+    elif missing:
+        window_s = uncovered[-1]
+        step_s = max(METRICS_RANGE_STEP_S, uncovered[0] // STABILITY_MIN_POINTS)
+        console.print(f"🚀 Lancio range query storica ({format_duration(window_s)}) per [bold]{len(missing)}[/bold] metriche...")
+        log.info(f"Range query storica ({format_duration(window_s)} @ {format_duration(step_s)}) per {missing} "
+                 f"sui candidati {candidates} (finestre scoperte: {[format_duration(w) for w in uncovered]}).")
+        fetched, failed_queries, _ = await fetch_history(
+            missing, {m: model.metrics[m].raw for m in missing},
+            nodes=candidates if PROMQL_PUSHDOWN else None, window_s=window_s, step_s=step_s
+        )
+        fill_from_history(fetched)
+
+    # Risultati parziali: l'analisi prosegue sulle metriche per cui lo storico è disponibile
+    if failed_queries:
+        console.print(f"⚠️ Storico parziale: {len(missing) - len(failed_queries)}/{len(missing)} metriche. "
+                      f"Mancanti: {failed_queries}", style="yellow")
+
+    analyzed = covered.any(axis=0)
+    if not analyzed.any():
+        return {"stability_report": StabilityReport.empty()}
+
+    # --- CLASSIFICAZIONE VETTORIALE (finestre x candidati x metriche) ---
+    analyzed_metrics = [m for j, m in enumerate(metrics_to_analyze) if analyzed[j]]
+    current_matrix = np.array([[current_data_snapshot.get(node, m, np.nan) for m in analyzed_metrics]
+                               for node in candidates], dtype=np.float64).reshape(len(candidates), len(analyzed_metrics))
+
+    # Soglia fisica per metrica con le soglie più restrittive dei profili target (Principio di Cautela)
+    phys_thresholds = np.array([model.physical_threshold(m, target_profiles) for m in analyzed_metrics])
+
+    stability_report = StabilityReport.build(candidates, analyzed_metrics, current_matrix,
+                                             avg_tensor[:, :, analyzed], std_tensor[:, :, analyzed],
+                                             phys_thresholds, windows=labels)
+
+    risky = stability_report.risky_items()
+    for node, metric_name, status in risky:
+        window = stability_report.window(node, metric_name)
+        window_str = f" (finestra {window})" if window else ""
+        # Qui warning va bene sia per console che log perché è importante
+        console.print(f"⚠️ Instabilità rilevata su {node} [{metric_name}]: {status}{window_str}", style="bold red")
+        log.warning(f"Instabilità rilevata su {node} [{metric_name}]: {status}{window_str}")
+    spikes_found = len(risky)
     
+    query_executor.log_stats()
+
     if spikes_found == 0:
         console.print("✅ Analisi storica completata: Nessuna anomalia critica.", style="green")
         log.info("Analisi storica completata: Nessuna anomalia critica.")
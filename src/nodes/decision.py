@@ -3,26 +3,139 @@ import operator
 from rich.table import Table
 from rich.panel import Panel
 from src.state import AgentState
-from src.config import llm, console
+from src.config import (llm, console, llm_cache, intent_fast_path_stats, INTENT_FAST_PATH,
+                        INTENT_FAST_PATH_MIN_CONFIDENCE, CONSTRAINT_PARSER, LLM_STREAMING, stream_stats,
+                        PROMPT_TOKEN_BUDGET, PROMPT_TOP_K_CANDIDATES)
 from src.schemas import (UserRequestClassification,
                               TaskProfileIntent,
-                                RequirementExtraction)
+                                RequirementExtraction,
+                                RequestUnderstanding)
 from langchain.messages import HumanMessage, AIMessage
 from src.utils import humanize_metrics_with_config, json_to_markdown_table, get_last_user_message
+from src.snapshot import MetricsSnapshot
+from src.stability import StabilityReport
+from src.nodes.retrieval import ensure_metrics
+from src.qos_model import qos_model
+from src.intent_rules import classify_intent_rules
+from src.llm_cache import context_hash
+from src.constraint_parser import parse_constraints
+from src.streaming import stream_llm
+from src.prompt_budget import estimate_tokens, messages_tokens, fit_messages, top_rows, log_prompt_size
 from src.logger import log
 
 
+_NO_TARGET_WORDS = ["nessuno", "none", "null", "n/a", "tutti", "all"]
+
+
+def _fast_path_intent(user_input: str, targets: list) -> dict | None:
+    """
+    Classificazione deterministica (regole lessicali + match dei nodi attivi).
+    Restituisce {"intent", "target_filter"} se la confidenza è sufficiente, altrimenti None (serve l'LLM).
+    """
+    if not INTENT_FAST_PATH:
+        intent_fast_path_stats.record(fast=False)
+        return None
+    guess = classify_intent_rules(user_input, targets if isinstance(targets, list) else [])
+    if guess.intent and guess.confidence >= INTENT_FAST_PATH_MIN_CONFIDENCE:
+        intent_fast_path_stats.record(fast=True)
+        console.print(f"🧠 Classificazione intento: [bold magenta]{guess.intent}[/bold magenta] [dim](fast path)[/dim]")
+        if guess.target_filter:
+            console.print(f"🎯 Target: [bold cyan]{guess.target_filter}[/bold cyan]")
+        log.info(f"Classificazione intento (fast path, confidenza {guess.confidence}): {guess.intent} | "
+                 f"Target: {guess.target_filter} | {guess.reason}")
+        return {"intent": guess.intent, "target_filter": guess.target_filter}
+    log.info(f"Fast path intento non conclusivo (confidenza {guess.confidence}: {guess.reason}), uso l'LLM.")
+    intent_fast_path_stats.record(fast=False)
+    return None
+
+
+def _profiles_table(state: AgentState) -> tuple[dict, str]:
+    """Profili del config con la sola descrizione (nome profilo come chiave) e relativa tabella markdown."""
+    qos = qos_model(state)
+    profiles = {name: {"description": p.description} for name, p in qos.profiles.items()}
+    # Passo SOLO "description": "required_conditions" e "scoring_weights" confonderebbero l'LLM.
+    return profiles, json_to_markdown_table(profiles, key_label="Profile Name", columns=["description"])
+
+
+def _metrics_table(state: AgentState) -> str:
+    """Tabella delle metriche con le sole colonne utili a capirne il significato (la 'query' è esclusa)."""
+    metrics = (state.get("qos_config") or {}).get("metrics", {})
+    return json_to_markdown_table(metrics, key_label="Metric", columns=["unit", "description"])
+
+
+_CONVERSION_RULES = """REGOLE DI CONVERSIONE:
+    1. RAM/DISK (Bytes):
+        - 1KB = 1024, 1MB = 1024^2, 1GB = 1024^3.
+        - Es: "4GB RAM libera" -> metrica: `ram_available_bytes`, val: 4294967296, op: `>=`
+    2. PERCENTUALI (0-100):
+        - Es: "CPU sotto il 20%" -> metrica: `cpu_usage_pct`, val: 20, op: `<`
+    3. Se non ci sono numeri espliciti, restituisci una lista vuota."""
+
+
+def _parse_constraints_locally(state: AgentState, user_input: str) -> list | None:
+    """
+    Vincoli estratti dal parser deterministico, oppure None se restano frammenti numerici
+    non interpretati (in quel caso decide l'LLM).
+    """
+    if not CONSTRAINT_PARSER:
+        return None
+    parsed = parse_constraints(user_input, (state.get("qos_config") or {}).get("metrics", {}))
+    if not parsed.complete:
+        log.info(f"Parser vincoli: frammenti non interpretati {parsed.unparsed}, uso l'LLM.")
+        return None
+    log.info("Vincoli estratti dal parser deterministico.")
+    return [c.model_dump() for c in parsed.extraction.constraints]
+
+
+def _print_constraints(constraints_list: list):
+    if constraints_list:
+        # 1. Visualizzazione per l'utente
+        c_text = "\n".join([f"- [bold]{c['metric_name']}[/bold] {c['operator']} {c['value']} ({c['original_text']})" for c in constraints_list])
+        console.print(Panel(c_text, title="📏 Vincoli Estratti", border_style="yellow"))
+
+        # 2. Log di sistema
+        # Loggo la lista grezza, utile per debuggare i valori esatti
+        log.info(f"Vincoli numerici estratti: {constraints_list}")
+    else:
+        # 1. Utente
+        console.print("Nessun vincolo numerico esplicito trovato.", style="dim")
+        # 2. Log
+        log.info("Nessun vincolo numerico esplicito trovato.")
+
+
+def _print_task_profiles(sel_profiles: list, reason: str):
+    # 1. Visualizzazione per l'utente
+    console.print(Panel(
+        f"Task mappato su: [bold magenta]{sel_profiles}[/bold magenta]\n[italic dim]\"{reason}\"[/italic dim]",
+        title="🧠 Technical Profiler",
+        border_style="magenta"
+    ))
+
+    # 2. Log di sistema
+    log.info(f"Task profile classification: {sel_profiles} | Reason: {reason}")
+
+
 # --- NODO 3: CLASSIFIER ---
 async def classify_intent_node(state: AgentState):
     """
     Analizza l'input utente e determina l'intento: "allocation" o "status".
     Se l'utente specifica un nodo particolare, lo estrae e lo assegna a "target_filter".
+    OTTIMIZZAZIONE (Fast Path): i casi netti vengono risolti con regole lessicali e match
+    (esatto/fuzzy) sui nodi attivi; l'LLM interviene solo se la confidenza è bassa.
     """
     user_input = get_last_user_message(state["messages"])
 
     # Recupera i nodi attivi dallo stato e formatta per il prompt
     targets_raw = state.get("active_targets", [])
-    
+
+    fast = _fast_path_intent(user_input, targets_raw)
+    if fast:
+        return fast
+    return await _classify_intent_llm(user_input, targets_raw)
+
+
+async def _classify_intent_llm(user_input: str, targets_raw) -> dict:
+    """Classificazione d'intento via LLM (senza fast path): {"intent", "target_filter"}."""
     if isinstance(targets_raw, list) and targets_raw:
         formatted_targets = "\n- ".join(targets_raw) # Crea elenco puntato
     else:
@@ -39,12 +152,16 @@ async def classify_intent_node(state: AgentState):
     structured_llm = llm.with_structured_output(UserRequestClassification)
     
     try:
-        response = await structured_llm.ainvoke(prompt)
+        # Cache delle risposte: stessa domanda (normalizzata) con la stessa lista di nodi
+        response = await llm_cache.structured(
+            "intent", user_input, context_hash(targets_raw), UserRequestClassification,
+            lambda: structured_llm.ainvoke(prompt)
+        )
         
         intent = response.intent
         target = response.target_filter
                 
-        if target and target.lower() in ["nessuno", "none", "null", "n/a", "tutti", "all"]:
+        if target and target.lower() in _NO_TARGET_WORDS:
             target = None
 
         # 1. Visualizzazione per l'utente
@@ -62,6 +179,94 @@ async def classify_intent_node(state: AgentState):
     
     return {"intent": intent, "target_filter": target}
 
+# --- NODO 3 (COMBINATO): REQUEST UNDERSTANDING ---
+async def understand_request_node(state: AgentState):
+    """
+    Comprensione della richiesta in UNA sola chiamata strutturata:
+    intento, nodo target, profili di carico (con motivazione) e vincoli numerici espliciti.
+    - Le richieste di stato risolte dal fast path non chiamano l'LLM.
+    - Con i profili e i vincoli già nello stato, Task Classifier e Constraint Extractor vengono saltati.
+    - In caso di errore si ripiega sul classificatore d'intento: i nodi successivi fanno le loro chiamate.
+    """
+    user_input = get_last_user_message(state["messages"])
+    targets_raw = state.get("active_targets", [])
+    targets = targets_raw if isinstance(targets_raw, list) else []
+
+    fast = _fast_path_intent(user_input, targets)
+    if fast and fast["intent"] == "status":
+        return fast
+
+    profiles, profiles_table = _profiles_table(state)
+    metrics_table = _metrics_table(state)
+    formatted_targets = "\n- ".join(targets) if targets else "Nessun nodo rilevato."
+
+    prompt = f"""
+    ANALIZZA LA RICHIESTA UTENTE: "{user_input}"
+
+    1. INTENTO: "allocation" (dove eseguire/allocare un task) oppure "status" (stato del cluster o di un nodo).
+    2. TARGET: inserisci in "target_filter" il nome del nodo specifico se menzionato e se esiste tra i nodi validi, altrimenti non inserire nulla.
+    Nodi validi:
+    - {formatted_targets}
+
+    Solo se l'intento è "allocation":
+    3. PROFILI: identifica quali profili di carico si adattano meglio al task (seleziona TUTTI quelli rilevanti)
+       e spiega brevemente il perché in "reasoning".
+       Se l'utente specifica requisiti tecnici (es. "voglio tanta RAM"), seleziona il profilo corrispondente (memory-bound).
+    Profili Disponibili:
+    {profiles_table}
+
+    4. VINCOLI: trova numeri e requisiti espliciti e convertili in filtri sulle metriche.
+    METRICHE DISPONIBILI:
+    {metrics_table}
+
+    {_CONVERSION_RULES}
+    """
+    structured_llm = llm.with_structured_output(RequestUnderstanding)
+
+    try:
+        # Cache delle risposte: stessa richiesta (normalizzata) con gli stessi nodi, profili e metriche
+        result = await llm_cache.structured(
+            "understanding", user_input, context_hash(targets, profiles, metrics_table), RequestUnderstanding,
+            lambda: structured_llm.ainvoke(prompt), depends_on_config=True
+        )
+    except Exception as e:
+        log.error(f"Errore comprensione richiesta (chiamata combinata): {e}. Ripiego sui nodi singoli.")
+        # Il fast path è già stato valutato (e contato) qui: niente secondo passaggio
+        return fast or await _classify_intent_llm(user_input, targets_raw)
+
+    intent = result.intent
+    target = result.target_filter
+    if target and (target.lower() in _NO_TARGET_WORDS or target not in targets):
+        target = None
+    if fast:
+        # Il fast path ha già deciso intento e target con confidenza sufficiente
+        intent, target = fast["intent"], fast["target_filter"]
+    else:
+        console.print(f"🧠 Classificazione intento: [bold magenta]{intent}[/bold magenta]")
+        if target:
+            console.print(f"🎯 Target: [bold cyan]{target}[/bold cyan]")
+        log.info(f"Classificazione intento: {intent} | Target: {target}")
+
+    update = {"intent": intent, "target_filter": target}
+    if intent != "allocation":
+        return update
+
+    # Profili sconosciuti scartati: senza profili validi il Task Classifier resta in carico
+    sel_profiles = [p for p in result.selected_profiles if p in profiles]
+    if sel_profiles:
+        _print_task_profiles(sel_profiles, result.reasoning)
+        update["target_profiles"] = sel_profiles
+        update["classification_reason"] = result.reasoning
+
+    # Se il parser locale interpreta tutta la richiesta, i suoi vincoli (deterministici) prevalgono
+    constraints_list = _parse_constraints_locally(state, user_input)
+    if constraints_list is None:
+        constraints_list = [c.model_dump() for c in result.constraints if c is not None]
+    _print_constraints(constraints_list)
+    update["explicit_constraints"] = constraints_list
+    return update
+
+
 async def classify_task_node(state: AgentState):
     """
     Analizza la descrizione del task utente e identifica i profili di carico più adatti.
@@ -69,20 +274,16 @@ async def classify_task_node(state: AgentState):
     2. Costruisce un prompt che elenca i profili con le loro descrizioni.
     3. Chiede all'LLM di selezionare i profili più rilevanti per il task descritto.
     4. Registra la selezione e la motivazione nello stato.
+    Se i profili sono già stati selezionati (Request Understanding), il nodo non fa nulla.
 
     """
+    if state.get("target_profiles"):
+        log.info("Profili target già selezionati, salto il Task Classifier.")
+        return {}
+
     user_input = get_last_user_message(state["messages"])
 
-    config = state.get("qos_config", {})
-    profiles = config.get("profiles", {})
-    
-    # Passo SOLO "description". La key_label sarà il nome del profilo.
-    # Escludmo "required_conditions" e "scoring_weights" per evitare di confondere l'LLM.
-    profiles_table = json_to_markdown_table(
-        profiles, 
-        key_label="Profile Name", 
-        columns=["description"] 
-    )
+    profiles, profiles_table = _profiles_table(state)
     
     prompt = f"""
     ANALIZZA LA NATURA DEL TASK.
@@ -98,21 +299,16 @@ async def classify_task_node(state: AgentState):
     """
     
     model = llm.with_structured_output(TaskProfileIntent)
-    result = await model.ainvoke(prompt)
+    # Cache delle risposte: stessa richiesta (normalizzata) con la stessa tabella dei profili
+    result = await llm_cache.structured(
+        "task", user_input, context_hash(profiles), TaskProfileIntent,
+        lambda: model.ainvoke(prompt), depends_on_config=True
+    )
     
     # STAMPA MIGLIORATA
     sel_profiles = result.selected_profiles
     reason = result.reasoning
-    
-    # 1. Visualizzazione per l'utente
-    console.print(Panel(
-        f"Task mappato su: [bold magenta]{sel_profiles}[/bold magenta]\n[italic dim]\"{reason}\"[/italic dim]",
-        title="🧠 Technical Profiler",
-        border_style="magenta"
-    ))
-    
-    # 2. Log di sistema
-    log.info(f"Task profile classification: {sel_profiles} | Reason: {reason}")
+    _print_task_profiles(sel_profiles, reason)
     
     return {
         "target_profiles": sel_profiles,
@@ -124,21 +320,23 @@ async def constraint_extractor_node(state: AgentState):
     Estrae i vincoli numerici espliciti dalla richiesta utente.
     1. Usa le metriche disponibili nella configurazione QoS per guidare l'estrazione.
     2. Restituisce una lista di vincoli strutturati nello stato.
+    Se i vincoli sono già stati estratti (Request Understanding), il nodo non fa nulla.
 
     """
+    if state.get("explicit_constraints") is not None:
+        log.info("Vincoli già estratti, salto il Constraint Extractor.")
+        return {}
+
     # --- Recupero ultimo messaggio utente ---
     user_input = get_last_user_message(state["messages"])
 
-    config = state.get("qos_config", {})
-    metrics = config.get("metrics", {})
-    
-    # Estraggo SOLO le colonne utili per capire il significato della metrica.
-    # La colonna 'query' verrà ignorata automaticamente.
-    metrics_table = json_to_markdown_table(
-        metrics, 
-        key_label="Metric", 
-        columns=["unit", "description"] 
-    )
+    # Parser locale (deterministico, sub-millisecondo): l'LLM solo per le frasi che non sa interpretare
+    local_constraints = _parse_constraints_locally(state, user_input)
+    if local_constraints is not None:
+        _print_constraints(local_constraints)
+        return {"explicit_constraints": local_constraints}
+
+    metrics_table = _metrics_table(state)
     
     prompt = f"""
     SEI UN ESTRATTORE DI VINCOLI TECNICI.
@@ -151,35 +349,20 @@ async def constraint_extractor_node(state: AgentState):
     
     RICHIESTA UTENTE: "{user_input}"
     
-    REGOLE DI CONVERSIONE:
-    1. RAM/DISK (Bytes):
-        - 1KB = 1024, 1MB = 1024^2, 1GB = 1024^3.
-        - Es: "4GB RAM libera" -> metrica: `ram_available_bytes`, val: 4294967296, op: `>=`
-    2. PERCENTUALI (0-100):
-        - Es: "CPU sotto il 20%" -> metrica: `cpu_usage_pct`, val: 20, op: `<`
-    3. Se non ci sono numeri espliciti, restituisci una lista vuota.
+    {_CONVERSION_RULES}
     """
     
     model = llm.with_structured_output(RequirementExtraction)
     try:
-        result = await model.ainvoke(prompt)
+        # Cache delle risposte: stessa richiesta (normalizzata) con la stessa tabella delle metriche
+        result = await llm_cache.structured(
+            "constraints", user_input, context_hash(metrics_table), RequirementExtraction,
+            lambda: model.ainvoke(prompt), depends_on_config=True
+        )
         
         # Serializziamo per salvare nello stato (Pydantic -> Dict)
         constraints_list = [c.model_dump() for c in result.constraints]
-    
-        if constraints_list:
-            # 1. Visualizzazione per l'utente
-            c_text = "\n".join([f"- [bold]{c['metric_name']}[/bold] {c['operator']} {c['value']} ({c['original_text']})" for c in constraints_list])
-            console.print(Panel(c_text, title="📏 Vincoli Estratti", border_style="yellow"))
-            
-            # 2. Log di sistema 
-            # Loggo la lista grezza, utile per debuggare i valori esatti
-            log.info(f"Vincoli numerici estratti: {constraints_list}")
-        else:
-            # 1. Utente
-            console.print("Nessun vincolo numerico esplicito trovato.", style="dim")
-            # 2. Log
-            log.info("Nessun vincolo numerico esplicito trovato.")
+        _print_constraints(constraints_list)
         
         return {"explicit_constraints": constraints_list}
         
@@ -198,30 +381,18 @@ async def candidate_filter_node(state: AgentState):
     
     # --- RECUPERO DATI DALLO STATO ---
     target_profiles = state.get("target_profiles", [])
-    raw_results = state.get("profile_results", [])
+    evaluation = state.get("profile_evaluation")
     user_constraints = state.get("explicit_constraints", [])
-    metrics_json = state.get("metrics_report", "{}")
-    
-    try:
-        metrics_data = json.loads(metrics_json) # Dict: {"worker-1": {"cpu": 10...}, ...}
-    except:
-        metrics_data = {}
-
     console.print(Panel("🌪️ Filtering Candidates", style="grey50"))
     log.info("Avvio filtro candidati (Candidate Filter Node).")
 
+    # Fetch lazy: le metriche citate nei vincoli utente potrebbero non essere state scaricate
+    snapshot = await ensure_metrics(state, [c.get("metric_name") for c in user_constraints]) # Matrice colonnare Nodi x Metriche
+
     # --- FASE 1: FILTRO PER PROFILO  ---
     
-    # Parsing dei risultati del Map-Reduce
-    profile_qualification_map = {} # profile_name -> set(nodi qualificati)
-    for r_str in raw_results:
-        try:
-            r_dict = json.loads(r_str)
-            p_name = r_dict.get("profile_name")
-            q_nodes = set(r_dict.get("qualified_nodes", [])) 
-            profile_qualification_map[p_name] = q_nodes
-        except:
-            continue
+    # Righe della matrice di idoneità profili x nodi
+    profile_qualification_map = evaluation.qualification_map() if evaluation else {} # profile_name -> set(nodi qualificati)
 
     # Calcolo dei candidati iniziali
     initial_candidates = set() # uso un set così da evitare duplicati
@@ -278,17 +449,14 @@ async def candidate_filter_node(state: AgentState):
         # Ciclo sui nodi candidati
         for node in list(final_candidates):
 
-            # Per ogni nodo prendo le sue metriche...
-            node_metrics = metrics_data.get(node, {})
-            
-            # ... e ciclo sui vincoli utente
+            # Per ogni nodo ciclo sui vincoli utente
             for constr in user_constraints:
                 metric_key = constr["metric_name"]
                 target_val = constr["value"]
                 op_sym = constr["operator"]
                 op_func = ops.get(op_sym)
                 
-                real_val = node_metrics.get(metric_key)
+                real_val = snapshot.get(node, metric_key)
                 
                 # Check 1: verifica esistenza della metrica per il nodo
                 if real_val is None:
@@ -316,7 +484,45 @@ async def candidate_filter_node(state: AgentState):
         # Log
         log.warning("Nessun candidato sopravvissuto ai filtri.")
 
-    return {"final_candidates": final_candidates}
+    return {"final_candidates": final_candidates, "metrics_report": snapshot}
+
+def _performance_scores(candidates: list, weights_map: dict, snapshot) -> dict:
+    """
+    Score di performance per nodo: somma pesata delle metriche normalizzate MIN-MAX tra i candidati.
+    Questo permette di confrontare metriche con scale e unità di misura diverse:
+    - metric_score = (MAX - val) / spread  (se minimize)
+    - metric_score = (val - MIN) / spread  (se maximize)
+    """
+    scores = {n: 0.0 for n in candidates}
+    for metric_name, info in weights_map.items():
+        weight = info.get("weight", 0)
+        direction = info.get("direction", "minimize")
+
+        # Valori della metrica per ogni nodo candidato che la espone
+        values = {n: float(v) for n in candidates if (v := snapshot.get(n, metric_name)) is not None}
+        if not values:
+            continue
+
+        min_v, max_v = min(values.values()), max(values.values())
+        spread = max_v - min_v
+        for node, raw_val in values.items():
+            if spread == 0:
+                metric_score = 1.0
+            elif direction == "minimize":
+                metric_score = (max_v - raw_val) / spread
+            else:
+                metric_score = (raw_val - min_v) / spread
+            scores[node] += metric_score * weight
+    return scores
+
+
+def _budgeted_history(messages: list, budget_tokens: int) -> list:
+    """Storico dei messaggi da anteporre al prompt dell'advisor, entro il budget residuo dei dati."""
+    history, omitted = fit_messages(messages, max(0, budget_tokens))
+    if omitted:
+        log.info(f"Storico del prompt advisor: {omitted} messaggi meno recenti omessi (budget {budget_tokens} token).")
+    return history
+
 
 async def allocation_advisor_node(state: AgentState):
     """
@@ -335,16 +541,10 @@ async def allocation_advisor_node(state: AgentState):
     # --- 0. RECUPERO CONTESTO DALLO STATO ---
     candidates = state.get("final_candidates", [])
     target_profiles = state.get("target_profiles", [])
-    metrics_json = state.get("metrics_report", "{}")
-    stability_data = state.get("stability_report", {}) 
+    snapshot = state.get("metrics_report") or MetricsSnapshot.empty()
+    stability_data = state.get("stability_report") or StabilityReport.empty()
     
     config = state.get("qos_config", {})
-    profiles_def = config.get("profiles", {})
-    
-    try:
-        metrics_data = json.loads(metrics_json)
-    except:
-        metrics_data = {}
 
 
     console.print(Panel("🚀 Allocation Advisor (Deep Scan)", style="grey50"))
@@ -356,92 +556,23 @@ async def allocation_advisor_node(state: AgentState):
         return {"messages": [AIMessage(content=msg)]}
     
     # --- FASE 1: PREPARAZIONE PESI (WEIGHT MIXING) ---
-    active_weights = {}
-
-    # Caso: Nessun profilo specifico, usiamo peso di default su CPU
+    # Dict {nome_metrica -> {"weight": float, "direction": str, "stability_threshold": float}, ...}
     if not target_profiles:
-        active_weights = {"cpu_usage_pct": {"weight": 1.0, "direction": "minimize"}}
-    else:
-
-        # Per ogni profilo target prendo i pesi delle sue metriche 
-        for p_name in target_profiles:
-            p_weights = profiles_def.get(p_name, {}).get("scoring_weights", {})
-
-            # Mixaggio pesi
-            for metric, info in p_weights.items():
-
-                # Se la metrica non esiste, la aggiungo
-                if metric not in active_weights:
-                    active_weights[metric] = info
-                else:
-                    # Se esiste (ovvero più profili target la usano), prendo il peso più alto
-                    if info["weight"] > active_weights[metric]["weight"]:
-                        active_weights[metric] = info
-    
-    # Normalizzazione pesi
-    total_weight_sum = sum(info["weight"] for info in active_weights.values())
-    normalized_weights_map = {} # Dict {nome_metrica -> {"weight": float, "direction": str, "stability_threshold": float}, ...}
-    if total_weight_sum > 0:
-        # Caso in cui ci sono più profili target
-        for metric, info in active_weights.items():
-            new_info = info.copy()
-            new_info["weight"] = info["weight"] / total_weight_sum
-            normalized_weights_map[metric] = new_info
+        # Caso: Nessun profilo specifico, usiamo peso di default su CPU
+        normalized_weights_map = {"cpu_usage_pct": {"weight": 1.0, "direction": "minimize"}}
     else:
-        normalized_weights_map = active_weights
+        # Pesi mixati (per metrica vince il peso più alto) e normalizzati: memoizzati nel config compilato
+        normalized_weights_map = qos_model(state).mixed_weights(target_profiles)
 
     # --- FASE 2: CALCOLO SCORE & RISK ASSESSMENT ---
-    node_perf_scores = {n: 0.0 for n in candidates}
+    node_perf_scores = _performance_scores(candidates, normalized_weights_map, snapshot)
     node_risks = {n: [] for n in candidates} 
 
-    for metric_name, info in normalized_weights_map.items(): 
-        # Inizio il calcolo degli score per questa metrica dei vari nodi candidati
-
-        weight = info.get("weight", 0)
-        direction = info.get("direction", "minimize")
-        
-        values = [] # conterrà i valori di quella metrica per ogni nodo candidato
-        valid_nodes = []
+    for metric_name in normalized_weights_map:
         for node in candidates:
-            # Raccolgo per ogni nodo candidato il valore della metrica di interesse
-            val = metrics_data.get(node, {}).get(metric_name)
-            if val is not None:
-                values.append(float(val))
-                valid_nodes.append(node)
-        
-        if not values: continue
-
-        # Normalizzazione valori MIN-MAX 
-        # Questo mi permette di confrontare metriche con scale e unità di misura diverse
-        min_v, max_v = min(values), max(values)
-        spread = max_v - min_v 
-
-        # Calcolo score -> 
-        # - metric_score = (MAX - val) / spread  (se minimize)
-        # - metric_score = (val - MIN) / spread  (se maximize)
-        
-        for node in valid_nodes:
-            raw_val = float(metrics_data.get(node, {}).get(metric_name))
-            
-            metric_score = 0.0
-            if spread == 0: 
-                metric_score = 1.0 
-            else:
-                if direction == "minimize":
-                    metric_score = (max_v - raw_val) / spread
-                else:
-                    metric_score = (raw_val - min_v) / spread
-            
-            # Raccolgo qui gli score parziali una metrica alla volta per ogni nodo candidato
-            node_perf_scores[node] += (metric_score * weight)
-
-            # Recupero le info sulla stabilità della metrica per questo nodo
-            stab_info = stability_data.get(node, {}).get(metric_name, {})
-            status = stab_info.get("status", "UNKNOWN")
-            reason = stab_info.get("reason", "")
-            
-            if status in ["SPIKE", "CHAOTIC"]:
-                node_risks[node].append(f"{metric_name} -> {reason}")
+            # Stato di stabilità della metrica per questo nodo (motivazione solo se a rischio)
+            if snapshot.get(node, metric_name) is not None and stability_data.is_risky(node, metric_name):
+                node_risks[node].append(f"{metric_name} -> {stability_data.reason(node, metric_name)}")
 
     # --- FASE 3: RANKING & RESCUE SCAN ---
     ranked_nodes = sorted(node_perf_scores.items(), key=lambda x: x[1], reverse=True)
@@ -509,7 +640,7 @@ async def allocation_advisor_node(state: AgentState):
     def get_node_context(n_name):
         if not n_name: 
             return "N/A"
-        raw = {k: metrics_data.get(n_name, {}).get(k) for k in metrics_keys}
+        raw = {k: snapshot.get(n_name, k) for k in metrics_keys}
         fmt = humanize_metrics_with_config(raw, config)
         risks = node_risks[n_name]
         return {
@@ -574,8 +705,13 @@ async def allocation_advisor_node(state: AgentState):
     {current_instructions}
    
     """
+    # Budget dei dati: tabella dei candidati (al più 3 righe) + storico dei messaggi, troncato ai più recenti
+    history = _budgeted_history(state["messages"], PROMPT_TOKEN_BUDGET - estimate_tokens(compressed_table))
+    log_prompt_size("allocation_advisor", messages_tokens(history) + estimate_tokens(prompt), PROMPT_TOKEN_BUDGET)
     
-    response = await llm.ainvoke(state["messages"] + [HumanMessage(content=prompt)])
+    # Risposta in streaming: i token arrivano al loop principale man mano che vengono generati
+    response = await stream_llm(llm, history + [HumanMessage(content=prompt)], "allocation_advisor",
+                                stream_stats, LLM_STREAMING)
     
     return {"messages": [response]}
 
@@ -588,8 +724,8 @@ async def allocation_advisor_node_llm(state: AgentState):
     # --- 1. RECUPERO DATI ---
     candidates = state.get("final_candidates", [])
     target_profiles = state.get("target_profiles", [])
-    metrics_json = state.get("metrics_report", "{}")
-    stability_data = state.get("stability_report", {})
+    snapshot = state.get("metrics_report") or MetricsSnapshot.empty()
+    stability_data = state.get("stability_report") or StabilityReport.empty()
     config = state.get("qos_config", {})
     
     # Header Visuale
@@ -602,11 +738,6 @@ async def allocation_advisor_node_llm(state: AgentState):
         console.print(msg, style="bold red")
         return {"messages": [AIMessage(content=msg)]}
 
-    try:
-        metrics_data = json.loads(metrics_json)
-    except:
-        metrics_data = {}
-
     # --- 2. PREPARAZIONE DEL CONTESTO (DATA PREP) ---
     # Invece di calcolare uno score, preparo una "Scheda Tecnica" per ogni nodo.
     
@@ -615,12 +746,10 @@ async def allocation_advisor_node_llm(state: AgentState):
     # Recupero le metriche rilevanti
     relevant_metrics = set()
     if target_profiles:
-        for p in target_profiles:
-            weights = config.get("profiles", {}).get(p, {}).get("scoring_weights", {})
-            relevant_metrics.update(weights.keys())
+        relevant_metrics = qos_model(state).weighted_metrics(target_profiles)
     else:
         if candidates:
-            relevant_metrics = metrics_data.get(candidates[0], {}).keys()
+            relevant_metrics = snapshot.node_metrics(candidates[0]).keys()
 
     # Creo anche una tabella visiva per l'utente per capire cosa sto mandando all'LLM
     table = Table(title="📊 Dati inviati all'LLM", show_header=True)
@@ -630,16 +759,15 @@ async def allocation_advisor_node_llm(state: AgentState):
 
     for node in candidates:
         # A. Dati Metrici (Performance)
-        node_raw_metrics = {k: metrics_data.get(node, {}).get(k) for k in relevant_metrics}
+        node_raw_metrics = {k: snapshot.get(node, k) for k in relevant_metrics}
         node_human_metrics = humanize_metrics_with_config(node_raw_metrics, config)
         
         # B. Dati Stabilità (Rischio)
         risk_flags = []
-        node_stability = stability_data.get(node, {})
-        for metric, info in node_stability.items():
-            status = info.get("status", "UNKNOWN")
-            if status in ["SPIKE", "CHAOTIC"]:
-                risk_flags.append(f"{metric} is {status} ({info.get('reason')})")
+        for metric in stability_data.node_metrics(node):
+            if stability_data.is_risky(node, metric):
+                status = stability_data.status(node, metric)
+                risk_flags.append(f"{metric} is {status} ({stability_data.reason(node, metric)})")
         
         status_summary = "STABLE" if not risk_flags else f"UNSTABLE: {', '.join(risk_flags)}"
         
@@ -661,8 +789,27 @@ async def allocation_advisor_node_llm(state: AgentState):
     console.print(table)
     log.info(f"Contesto preparato per {len(candidates)} nodi. Invio all'LLM...")
 
-    # --- 3. COSTRUZIONE DEL PROMPT ---
+    # --- 3. COSTRUZIONE DEL PROMPT (entro il budget di token) ---
     compressed_table = json_to_markdown_table(candidates_context, key_label="Node")
+    if estimate_tokens(compressed_table) > PROMPT_TOKEN_BUDGET:
+        # Cluster grande: top-k candidati per score (+ il miglior nodo stabile), senza i valori grezzi duplicati
+        weights_map = (qos_model(state).mixed_weights(target_profiles) if target_profiles
+                       else {"cpu_usage_pct": {"weight": 1.0, "direction": "minimize"}})
+        scores = _performance_scores(candidates, weights_map, snapshot)
+        ranked = sorted(candidates_context, key=lambda c: scores[c["node_name"]], reverse=True)
+        selected = ranked[:PROMPT_TOP_K_CANDIDATES]
+        safe = next((c for c in ranked if c["stability_status"] == "STABLE"), None)
+        if safe is not None and safe not in selected:
+            selected.append(safe)
+        rows = [{k: v for k, v in c.items() if k != "_debug_raw_values"} for c in selected]
+        rows, _ = top_rows(rows, lambda r: json_to_markdown_table(r, key_label="Node"), PROMPT_TOKEN_BUDGET,
+                           min_rows=2)
+        omitted = len(candidates_context) - len(rows)
+        compressed_table = json_to_markdown_table(rows, key_label="Node")
+        if omitted:
+            compressed_table += (f"\n\n(Altri {omitted} candidati idonei omessi: score di performance inferiore "
+                                 f"ai {len(rows)} mostrati.)")
+        log.info(f"Prompt advisor compresso: {len(rows)}/{len(candidates_context)} candidati nel budget.")
     
     prompt = f"""
     SEI UN SENIOR CAPACITY PLANNER (SRE).
@@ -686,8 +833,12 @@ async def allocation_advisor_node_llm(state: AgentState):
     5. **Warning**: Se il vincitore ha problemi di stabilità, evidenzialo chiaramente.
     
     """
+    history = _budgeted_history(state["messages"], PROMPT_TOKEN_BUDGET - estimate_tokens(compressed_table))
+    log_prompt_size("allocation_advisor", messages_tokens(history) + estimate_tokens(prompt), PROMPT_TOKEN_BUDGET)
 
-    response = await llm.ainvoke(state["messages"] + [HumanMessage(content=prompt)])
+    # Risposta in streaming: i token arrivano al loop principale man mano che vengono generati
+    response = await stream_llm(llm, history + [HumanMessage(content=prompt)], "allocation_advisor",
+                                stream_stats, LLM_STREAMING)
     
     log.info("Risposta LLM generata.")
     return {"messages": [response]}
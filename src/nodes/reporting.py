@@ -1,8 +1,12 @@
 from src.state import AgentState
-from src.config import llm
-from langchain.messages import HumanMessage
+from src.config import llm, stream_stats, LLM_STREAMING, REPORT_MODE, REPORT_LLM_SUMMARY, PROMPT_TOKEN_BUDGET
+from langchain.messages import HumanMessage, AIMessage
 import json
-from src.utils import json_to_markdown_table
+from src.utils import json_to_markdown_table, format_capability_report_markdown
+from src.schemas import CapabilityReport, ProfileEvaluation as ProfileReport
+from src.qos_model import qos_model
+from src.streaming import stream_llm, BackgroundStream
+from src.prompt_budget import compress_audit, estimate_tokens, log_prompt_size, summarize_names
 from src.logger import log
 from rich.console import Console
 from rich.table import Table    
@@ -10,72 +14,119 @@ from rich.panel import Panel
 
 console = Console()
 
+# Sintesi LLM avviate in background dal fast report (il grafo non le aspetta): lette dal chiamante a fine turno
+pending_summaries = []
+
+
+def build_capability_report(evaluation, model, target_filter: str | None = None) -> CapabilityReport:
+    """
+    Capability Report deterministico dalla matrice profili x nodi del valutatore:
+    requisiti del config, audit PASS/FAIL per nodo e sintesi calcolata (nessuna chiamata LLM).
+    """
+    # Liste per l'ordinamento, set per i test di appartenenza (O(profili x nodi) sui cluster grandi)
+    nodes = [n for n in (evaluation.nodes if evaluation else []) if not target_filter or n == target_filter]
+    node_set = set(nodes)
+    suitable_by_node = {node: [] for node in nodes}
+    profiles = []
+    for p_name in (evaluation.profiles if evaluation else []):
+        definition = model.profiles.get(p_name)
+        requirements = [
+            {"metric": r.metric, "operator": r.operator, "threshold": r.threshold}
+            for r in (definition.required_conditions if definition else ())
+        ]
+        qualified = [n for n in evaluation.qualified_nodes(p_name) if n in node_set]
+        qualified_set = set(qualified)
+        for node in qualified:
+            suitable_by_node[node].append(p_name)
+        analysis = []
+        for node in nodes:
+            icon = "✅" if node in qualified_set else "❌"
+            analysis.append(f"{icon} **{node}**: " + ("; ".join(evaluation.audit_lines(p_name, node)) or "nessun requisito"))
+        conclusion = f"Idonei: {', '.join(qualified)}" if qualified else "Nessun nodo idoneo."
+        profiles.append(ProfileReport(profile_name=p_name, requirements=requirements, metric_analysis=analysis,
+                                      conclusion=conclusion, suitable_nodes=qualified))
+
+    synthesis = []
+    for node in nodes:
+        suitable = suitable_by_node[node]
+        if suitable:
+            synthesis.append(f"- **{node}**: idoneo a {len(suitable)}/{len(profiles)} profili ({', '.join(suitable)}).")
+        else:
+            synthesis.append(f"- **{node}**: nessun profilo soddisfatto.")
+    return CapabilityReport(
+        all_nodes_scanned=nodes,
+        profiles=profiles,
+        final_synthesis="\n".join(synthesis) or "Nessun nodo analizzato."
+    )
+
+
 async def report_synthesizer_node(state: AgentState):
     """
     Aggrega i risultati delle valutazioni dei profili e genera il Capability Report finale.
     OTTIMIZZAZIONE: Adaptive View (Scheda Singola vs Matrice Cluster) + Audit Logs.
     """
 
-    results = state["profile_results"] # Lista di stringhe JSON dai worker
+    evaluation = state.get("profile_evaluation") # Matrice profili x nodi dal valutatore vettoriale
     target_filter = state.get("target_filter") # Recuperiamo il filtro (es. "worker-1")
     
     # Header Visuale
     console.print(Panel("📑 Generating Capability Report", style="grey50"))
     log.info(f"Avvio Report Synthesizer. Target filter: {target_filter}")
 
-    # 1. Parsing dei risultati parziali
+    # 1. Lettura della matrice di idoneità
     summary_data = []
-    audit_logs = [] 
+    audit_rows = []     # [(profilo, nodi idonei, set dei nodi idonei, nodi da mostrare)], audit compresso nel budget
 
     # Creiamo anche una tabella Rich per la visualizzazione immediata
     rich_table = Table(title="📊 Matrice Idoneità Preliminare", show_header=True)
     rich_table.add_column("Profilo", style="bold magenta")
     rich_table.add_column("Nodi Qualificati", style="green")
 
-    for r_str in results:
-        try:
-            r_dict = json.loads(r_str)
-            p_name = r_dict.get("profile_name", "Unknown")
-            q_nodes = r_dict.get("qualified_nodes", [])
-            analysis = r_dict.get("analysis_lines", {}) 
-
-            q_nodes_str = ", ".join(q_nodes) if q_nodes else "NESSUNO"
-
-            # A. Dati per la Tabella Sintetica (Prompt)
-            summary_data.append({
-                "Profile": p_name,
-                "Qualified Nodes": q_nodes_str
-            })
-
-            # Aggiunta riga alla tabella visiva
-            rich_table.add_row(p_name, q_nodes_str)
-
-            # B. Dati per i Log di Audit
-            if analysis:
-                audit_section = f"--- Dettagli Profilo: {p_name} ---\n"
-                has_relevant_logs = False
-                
-                for node, checks in analysis.items():
-                    if target_filter and node != target_filter:
-                        continue
-                        
-                    checks_str = "; ".join(checks)
-                    audit_section += f"- {node}: {checks_str}\n"
-                    has_relevant_logs = True
-                
-                if has_relevant_logs:
-                    audit_logs.append(audit_section)
-
-        except Exception as e:
-            log.error(f"Errore parsing risultato profilo: {e}")
-            continue
+    for p_name in (evaluation.profiles if evaluation else []):
+        q_nodes = evaluation.qualified_nodes(p_name)
+        q_nodes_str = ", ".join(q_nodes) if q_nodes else "NESSUNO"
+
+        # A. Dati per la Tabella Sintetica (Prompt)
+        summary_data.append({
+            "Profile": p_name,
+            "Qualified Nodes": q_nodes_str
+        })
+
+        # Aggiunta riga alla tabella visiva
+        rich_table.add_row(p_name, q_nodes_str)
+
+        # B. Nodi e risultati per i Log di Audit (le righe vengono generate solo nella modalità LLM)
+        audit_rows.append((p_name, q_nodes, set(q_nodes),
+                           [n for n in evaluation.nodes if not target_filter or n == target_filter]))
     
     # MOSTRA TABELLA ALL'UTENTE
     console.print(rich_table)
+
+    # --- FAST REPORT: Markdown deterministico, nessuna chiamata LLM (polling delle dashboard) ---
+    if REPORT_MODE == "fast":
+        report = build_capability_report(evaluation, qos_model(state), target_filter)
+        markdown = format_capability_report_markdown(report)
+        if target_filter:
+            markdown = f"# Stato di Salute: {target_filter}\n\n{markdown}"
+        log.info("Report finale generato (fast report, deterministico).")
+        if REPORT_LLM_SUMMARY and evaluation:
+            pending_summaries.append(start_report_summary(evaluation, target_filter))
+        return {"messages": [AIMessage(content=markdown)]}
     
     # 2. Creazione Viste (Data Presentation per LLM)
+    # Budget dei dati: prima la matrice (con elenchi di nodi troncati se troppo lunga), poi l'audit nel budget residuo
     table_view = json_to_markdown_table(summary_data, key_label="Profile")
-    audit_view = "\n".join(audit_logs)
+    if estimate_tokens(table_view) > PROMPT_TOKEN_BUDGET // 2:
+        table_view = json_to_markdown_table(
+            [{"Profile": p_name, "Qualified Nodes": f"{len(q_nodes)} nodi: {summarize_names(q_nodes)}" if q_nodes else "NESSUNO"}
+             for p_name, q_nodes, _, _ in audit_rows],
+            key_label="Profile"
+        )
+    audit_view = compress_audit(
+        [(p_name, [(node, node in q_set, evaluation.audit_lines(p_name, node)) for node in nodes])
+         for p_name, _, q_set, nodes in audit_rows],
+        max(0, PROMPT_TOKEN_BUDGET - estimate_tokens(table_view))
+    )
     
     # --- 3. LOGICA ADATTIVA ---
     if target_filter:
@@ -119,8 +170,30 @@ async def report_synthesizer_node(state: AgentState):
     Genera il Capability Report finale (Markdown).
     Usa icone (✅, ❌, ⚠️) per la massima leggibilità.
     """
+    log_prompt_size("synthesizer", estimate_tokens(prompt), PROMPT_TOKEN_BUDGET)
     
-    response = await llm.ainvoke([HumanMessage(content=prompt)])
+    # Risposta in streaming: i token arrivano al loop principale man mano che vengono generati
+    response = await stream_llm(llm, [HumanMessage(content=prompt)], "synthesizer", stream_stats, LLM_STREAMING)
     
     log.info("Report finale generato.")
-    return {"messages": [response]}
\ No newline at end of file
+    return {"messages": [response]}
+
+
+def start_report_summary(evaluation, target_filter: str | None = None) -> BackgroundStream:
+    """
+    Sintesi LLM breve (opzionale) del fast report, avviata in background: l'esecuzione del grafo
+    termina con il report deterministico, la sintesi arriva dopo (token in coda, vedi BackgroundStream).
+    """
+    nodes = {n for n in evaluation.nodes if not target_filter or n == target_filter}
+    # Elenchi di nodi troncati: per la sintesi bastano conteggi ed esempi
+    qualified = {p: [n for n in evaluation.qualified_nodes(p) if n in nodes] for p in evaluation.profiles}
+    matrix = [{"Profile": p, "Qualified Nodes": f"{len(q)}/{len(nodes)}: {summarize_names(q)}" if q else "NESSUNO"}
+              for p, q in qualified.items()]
+    prompt = f"""
+    SEI UN SRE. Scrivi una sintesi di massimo 3 frasi (Markdown, niente tabelle) dello stato
+    {f"del nodo {target_filter}" if target_filter else "del cluster"} a partire da questa matrice di idoneità:
+    {json_to_markdown_table(matrix, key_label="Profile")}
+    """
+    log_prompt_size("report_summary", estimate_tokens(prompt))
+    log.info("Sintesi LLM del report avviata in background.")
+    return BackgroundStream("report_summary").start(llm, [HumanMessage(content=prompt)], stream_stats, LLM_STREAMING)
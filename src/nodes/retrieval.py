@@ -1,6 +1,8 @@
 import json
+import math
 import asyncio
 import time
+from datetime import datetime, timezone
 from rich.panel import Panel
 from rich.markdown import Markdown
 from rich.console import Console # <--- 1. Import Console
@@ -8,17 +10,319 @@ from langchain_core.messages import SystemMessage
 
 # Import interni
 from src.state import AgentState
-from src.config import client
-from src.utils import parse_prometheus_output, json_to_markdown_table
+from src.config import (mcp_session, rolling_store, recording_rules, TS_STORE_ENABLED, PROMQL_BATCH_MODE,
+                        PROMQL_BATCH_MAX_CHARS, PROMQL_PUSHDOWN, PROMQL_NODE_LABEL, PROMQL_CACHE_TTL_S, METRICS_DEMAND_DRIVEN,
+                        METRICS_RANGE_MODE, METRICS_RANGE_WINDOW_S, METRICS_RANGE_STEP_S)
+from src.utils import json_to_markdown_table
+from src.prom_decoder import DecodeStats, decode_into, decode_series_into, payload_text
+from src.snapshot import MetricsSnapshot, SnapshotBuilder
+from src.history import MetricsHistory, HistoryBuilder
+from src.qos_model import qos_model
+from src.nodes.setup import qos_config_cache
+from src.promql import build_batches, scope_query, BATCH_LABEL
+from src.query_executor import execute_promql, execute_promql_range, query_executor
 from src.logger import log
 
 # Inizializziamo la console
 console = Console()
 
+async def _fetch_single(metric_name: str, query: str, builder: SnapshotBuilder, stats: DecodeStats,
+                        execute=execute_promql, decode=decode_into) -> list:
+    """Esegue la query di una singola metrica e la decodifica nel builder. Restituisce le metriche fallite."""
+    try:
+        result = await execute(query)
+    except Exception as e:
+        log.warning(f"Errore query {metric_name}: {e}")
+        return [metric_name]
+
+    if not decode(result, builder, metric=metric_name, stats=stats):
+        log.warning(f"Risposta non valida per {metric_name}: {str(payload_text(result))[:50]}...")
+        return [metric_name]
+    return []
+
+
+async def _fetch_batch(query: str, metric_names: list, metric_queries: dict,
+                       builder: SnapshotBuilder, stats: DecodeStats,
+                       execute=execute_promql, decode=decode_into) -> list:
+    """
+    Esegue una query batch e la decodifica nel builder (split per metrica via BATCH_LABEL).
+    Se il batch fallisce (errore o risposta non valida) ripiega automaticamente sulle query singole.
+    """
+    try:
+        result = await execute(query)
+        if decode(result, builder, tag_label=BATCH_LABEL, stats=stats):
+            return []
+    except Exception as e:
+        log.warning(f"Errore query batch {metric_names}: {e}")
+
+    log.warning(f"Batch non valido per {metric_names}: fallback su {len(metric_names)} query singole.")
+    results = await asyncio.gather(*[
+        _fetch_single(name, metric_queries[name], builder, stats, execute, decode) for name in metric_names
+    ])
+    return [name for failed_names in results for name in failed_names]
+
+
+async def _run_metric_queries(metric_queries: dict, builder: SnapshotBuilder, stats: DecodeStats,
+                              execute=execute_promql, decode=decode_into) -> list:
+    """
+    Esegue le query delle metriche (batch dove possibile) in parallelo, decodificando
+    le risposte direttamente nello snapshot colonnare (o nello storico, per le range query).
+    Concorrenza, deadline, retry e hedging sono gestiti dal QueryExecutor condiviso.
+    Restituisce la lista delle metriche fallite.
+    """
+    if PROMQL_BATCH_MODE:
+        # Fusione delle query compatibili: poche richieste PromQL invece di una per metrica
+        batches, singles = build_batches(metric_queries, max_chars=PROMQL_BATCH_MAX_CHARS)
+    else:
+        batches, singles = [], list(metric_queries.keys())
+
+    n_requests = len(batches) + len(singles)
+    console.print(f"🚀 Avvio retrieval parallelo per [bold]{len(metric_queries)}[/bold] metriche "
+                  f"([bold]{n_requests}[/bold] richieste PromQL)...", style="dim")
+    log.info(f"Lancio {n_requests} query Prometheus in parallelo per {len(metric_queries)} metriche "
+             f"({len(batches)} batch, {len(singles)} singole).")
+
+    tasks = [_fetch_batch(query, names, metric_queries, builder, stats, execute, decode) for query, names in batches]
+    tasks += [_fetch_single(name, metric_queries[name], builder, stats, execute, decode) for name in singles]
+    fetched = await asyncio.gather(*tasks)
+
+    return [name for failed_names in fetched for name in failed_names]
+
+
+def required_metrics(state: AgentState) -> list:
+    """
+    Metriche necessarie al turno corrente (ordine del config).
+    Modalità demand-driven sul ramo allocation: solo le metriche referenziate dai profili selezionati
+    (required_conditions + scoring_weights) e dai vincoli espliciti dell'utente.
+    In tutti gli altri casi (status, profili non ancora noti o sconosciuti): tutte le metriche.
+    """
+    model = qos_model(state)
+    all_metrics = [name for name, definition in model.metrics.items() if definition.query]
+
+    target_profiles = state.get("target_profiles") or []
+    if not METRICS_DEMAND_DRIVEN or state.get("intent") != "allocation" or not target_profiles:
+        return all_metrics
+
+    if len(model.known_profiles(target_profiles)) < len(target_profiles):
+        # Profilo sconosciuto: la valutazione potrebbe ripiegare su tutti i profili, servono tutte le metriche
+        return all_metrics
+
+    referenced = set(model.required_metrics(target_profiles))
+    for constr in state.get("explicit_constraints") or []:
+        referenced.add(constr.get("metric_name"))
+
+    return [name for name in all_metrics if name in referenced]
+
+
+def _compatible_snapshot(state: AgentState) -> MetricsSnapshot | None:
+    """Lo snapshot in stato, se copre il perimetro richiesto (cluster intero o lo stesso nodo)."""
+    snapshot = state.get("metrics_report")
+    if not snapshot:
+        return None
+    if state.get("metrics_scope") not in (None, state.get("target_filter")):
+        return None
+    return snapshot
+
+
+def missing_metrics(state: AgentState) -> list:
+    """Metriche richieste dal turno corrente che lo snapshot in stato non contiene ancora."""
+    needed = required_metrics(state)
+    snapshot = _compatible_snapshot(state)
+    if snapshot is None:
+        return needed
+    return [m for m in needed if m not in snapshot.metric_index]
+
+
+async def _fetch_into(metric_names: list, metrics_def: dict, scope: str | None, make_builder,
+                      execute=execute_promql, decode=decode_into, nodes: list | None = None):
+    """
+    Scarica le metriche indicate nel builder prodotto da make_builder(metriche) e restituisce
+    (builder, metriche_fallite, statistiche_decoder).
+    Applica il push-down del filtro nodo (o della lista `nodes`) e ripiega su query non filtrate
+    se non torna alcuna serie.
+    """
+    stats = DecodeStats()
+    metric_queries = {
+        name: metrics_def[name]["query"]
+        for name in metric_names
+        if metrics_def.get(name, {}).get("query")
+    }
+    if not metric_queries:
+        return make_builder([]), [], stats
+
+    # --- RECORDING RULES: le query con una serie precalcolata leggono direttamente quella ---
+    raw_queries = metric_queries
+    if recording_rules:
+        metric_queries = {name: recording_rules.rewrite(query) for name, query in metric_queries.items()}
+
+    # --- PUSH-DOWN DEL FILTRO: il label matcher del nodo entra direttamente nella PromQL ---
+    scope_nodes = [scope] if scope else nodes
+    pushed_down = bool(scope_nodes and PROMQL_PUSHDOWN)
+
+    def scoped(queries: dict) -> dict:
+        if not pushed_down:
+            return queries
+        return {name: scope_query(query, scope_nodes, PROMQL_NODE_LABEL) for name, query in queries.items()}
+
+    scoped_queries = scoped(metric_queries)
+
+    # Le risposte vengono decodificate direttamente nella struttura colonnare Nodi x Metriche.
+    # Il filtro sul nodo resta come safety net lato client (le serie arrivano già filtrate).
+    builder = make_builder(list(metric_queries.keys()))
+    failed_metrics = await _run_metric_queries(scoped_queries, builder, stats, execute, decode)
+
+    if pushed_down and not builder.node_index:
+        # Il nodo potrebbe essere identificato da un'altra label (es. instance): riproviamo senza push-down
+        log.warning(f"Nessuna serie con {PROMQL_NODE_LABEL} in {scope_nodes}: fallback su query non filtrate.")
+        pushed_down = False
+        builder = make_builder(list(metric_queries.keys()))
+        failed_metrics = await _run_metric_queries(metric_queries, builder, stats, execute, decode)
+
+    # Serie registrate senza dati (regole presenti nel file ma non caricate su Prometheus): query originali
+    filled = builder.filled_metrics()
+    unserved = [name for name, query in metric_queries.items() if query != raw_queries[name] and name not in filled]
+    if unserved:
+        for name in unserved:
+            if name not in failed_metrics:
+                # Query riuscita ma nessuna serie: la regola non è caricata su Prometheus
+                recording_rules.mark_unavailable(metric_queries[name])
+        retried = await _run_metric_queries(scoped({name: raw_queries[name] for name in unserved}),
+                                            builder, stats, execute, decode)
+        failed_metrics = [name for name in failed_metrics if name not in unserved] + retried
+
+    return builder, failed_metrics, stats
+
+
+async def fetch_snapshot(metric_names: list, metrics_def: dict, scope: str | None = None,
+                         nodes: list | None = None, decimals: int | None = 3) -> tuple[MetricsSnapshot, list, DecodeStats]:
+    """Query istantanee: restituisce (snapshot, metriche_fallite, statistiche_decoder)."""
+    builder, failed_metrics, stats = await _fetch_into(
+        metric_names, metrics_def, scope,
+        lambda metrics: SnapshotBuilder(metrics, node_filter=scope, decimals=decimals),
+        nodes=nodes
+    )
+    return builder.build(), failed_metrics, stats
+
+
+def _range_window(window_s: int, step_s: int) -> tuple[float, float, int]:
+    """Finestra (start, end, punti) della range query, con fine allineata all'intervallo di scrape (cache)."""
+    align = PROMQL_CACHE_TTL_S if PROMQL_CACHE_TTL_S > 0 else 1
+    end = math.floor(time.time() / align) * align
+    start = end - window_s
+    return start, end, window_s // step_s + 1
+
+
+def _rfc3339(ts: float) -> str:
+    return datetime.fromtimestamp(ts, timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+async def fetch_history(metric_names: list, metrics_def: dict, scope: str | None = None,
+                        nodes: list | None = None, window_s: int | None = None,
+                        step_s: int | None = None) -> tuple[MetricsHistory, list, DecodeStats]:
+    """
+    Range query (una per metrica o batch): restituisce (storico, metriche_fallite, statistiche_decoder).
+    Valore corrente, media, deviazione standard e le altre statistiche di finestra vengono
+    calcolate localmente, senza le subquery *_over_time lato server.
+    `nodes` restringe le serie scaricate (push-down) a un insieme di nodi, es. i candidati.
+    """
+    step = step_s or METRICS_RANGE_STEP_S
+    start, end, points = _range_window(window_s or METRICS_RANGE_WINDOW_S, step)
+    range_args = (_rfc3339(start), _rfc3339(end), f"{step}s")
+
+    builder, failed_metrics, stats = await _fetch_into(
+        metric_names, metrics_def, scope,
+        lambda metrics: HistoryBuilder(metrics, start, step, points, node_filter=scope),
+        execute=lambda query: execute_promql_range(query, *range_args),
+        decode=decode_series_into,
+        nodes=nodes
+    )
+    return builder.build(), failed_metrics, stats
+
+
+async def fetch_with_history(metric_names: list, metrics_def: dict, scope: str | None,
+                             history_metrics) -> tuple[MetricsHistory | None, MetricsSnapshot, list, DecodeStats]:
+    """
+    Range mode: storico a finestra solo per le metriche che servono all'analisi di stabilità
+    (`history_metrics`), query istantanee per tutte le altre.
+    Se il server non espone 'execute_range_query', o la range query fallisce, le metriche interessate
+    ripiegano sulle query istantanee: lo snapshot resta completo anche senza storico.
+    Restituisce (storico | None, snapshot, metriche_fallite, statistiche_decoder).
+    """
+    ranged = [m for m in metric_names if m in history_metrics]
+    instant = [m for m in metric_names if m not in history_metrics]
+
+    if ranged and await mcp_session.get_tool("execute_range_query") is None:
+        log.warning("Tool 'execute_range_query' non trovato su MCP Server: fallback su query istantanee.")
+        instant, ranged = list(metric_names), []
+
+    async def fetch_ranged():
+        if not ranged:
+            return None, []
+        try:
+            history, failed, _ = await fetch_history(ranged, metrics_def, scope)
+        except Exception as e:
+            log.warning(f"Range query fallita ({e}): fallback su query istantanee.")
+            return None, ranged
+        if not history.node_index:
+            return None, ranged
+        return history, failed
+
+    (history, failed_ranged), (snapshot, failed_metrics, stats) = await asyncio.gather(
+        fetch_ranged(), fetch_snapshot(instant, metrics_def, scope)
+    )
+
+    # Metriche senza storico: valore corrente con query istantanee (la stabilità ripiegherà sulla sua range query)
+    if failed_ranged:
+        log.warning(f"Storico non disponibile per {failed_ranged}: fallback su query istantanee.")
+        fallback, failed_metrics_fallback, _ = await fetch_snapshot(failed_ranged, metrics_def, scope)
+        snapshot = snapshot.merge(fallback)
+        failed_metrics = failed_metrics + failed_metrics_fallback
+
+    if history is not None:
+        snapshot = history.snapshot().merge(snapshot)
+    return history, snapshot, failed_metrics, stats
+
+
+async def ensure_metrics(state: AgentState, metric_names: list) -> MetricsSnapshot:
+    """
+    Fetch lazy e incrementale: aggiunge allo snapshot in stato le metriche richieste da uno stadio
+    successivo (es. vincoli utente) che non sono ancora state scaricate.
+    """
+    snapshot = state.get("metrics_report") or MetricsSnapshot.empty()
+    metrics_def = state.get("qos_config", {}).get("metrics", {})
+    missing = [m for m in dict.fromkeys(metric_names) if m in metrics_def and m not in snapshot.metric_index]
+    if not missing:
+        return snapshot
+
+    console.print(f"🧮 Retrieval incrementale: {missing}", style="dim")
+    log.info(f"Retrieval incrementale delle metriche mancanti: {missing}")
+
+    new_snapshot, failed, _ = await fetch_snapshot(missing, metrics_def, state.get("metrics_scope"))
+    if failed:
+        log.warning(f"Metriche non recuperate: {failed}")
+    return snapshot.merge(new_snapshot)
+
+
+async def sample_cluster() -> MetricsSnapshot:
+    """Snapshot completo del cluster per il campionatore in background dello store locale."""
+    config = await qos_config_cache.get()
+    metrics_def = config.get("metrics", {})
+    snapshot, failed, _ = await fetch_snapshot(list(metrics_def.keys()), metrics_def)
+    if failed:
+        log.warning(f"Campionatore: metriche non recuperate {failed}")
+    return snapshot
+
+
 async def metrics_engine_node(state: AgentState):
     """
     Esegue le query definite nella configurazione QoS in PARALLELO (Async Scatter-Gather).
-    OTTIMIZZAZIONE: Applica il filtro target direttamente alla fonte (Push-Down Predicate).
+    OTTIMIZZAZIONE: le query compatibili vengono fuse in poche richieste batch (label_replace + or).
+    OTTIMIZZAZIONE (Range Mode): sul ramo allocation una range query per metrica alimenta
+    sia lo snapshot sia le statistiche di stabilità (niente subquery *_over_time lato server).
+    OTTIMIZZAZIONE (Demand-Driven): sul ramo allocation scarica solo le metriche usate dai profili
+    selezionati, e solo quelle che lo snapshot già in stato non contiene.
+    OTTIMIZZAZIONE: Applica il filtro target direttamente alla fonte (Push-Down Predicate):
+    il nodo diventa un label matcher nelle query, e Prometheus restituisce solo le sue serie.
     """
     start_time = time.perf_counter()
     
@@ -27,15 +331,14 @@ async def metrics_engine_node(state: AgentState):
     log.info("Avvio Metrics Engine.")
 
     # 1. Recupero Tool
-    tools = await client.get_tools()
-    query_tool = next((t for t in tools if t.name == "execute_query"), None)
+    query_tool = await mcp_session.get_tool("execute_query")
     
     if not query_tool:
         msg = "❌ Errore critico: Tool 'execute_query' non trovato su MCP Server."
         console.print(msg, style="bold red")
         log.error("Tool 'execute_query' non trovato.")
         return {
-            "metrics_report": "Error: Tool 'execute_query' not found",
+            "metrics_report": MetricsSnapshot.empty(),
             "messages": [SystemMessage(content="Error: Prometheus tool missing.")]
         }
 
@@ -45,7 +348,7 @@ async def metrics_engine_node(state: AgentState):
     
     if not metrics_def:
         log.error("Nessuna metrica definita nella configurazione QoS.")
-        return {"metrics_report": "Error: Nessuna metrica definita."}
+        return {"metrics_report": MetricsSnapshot.empty()}
 
     # --- RECUPERO FILTRO TARGET ---
     target_filter = state.get("target_filter")
@@ -53,74 +356,64 @@ async def metrics_engine_node(state: AgentState):
     if target_filter:
         console.print(f"🎯 Focus Mode Attivo: Estraggo solo dati per [bold magenta]{target_filter}[/bold magenta]")
         log.info(f"Focus Mode Attivo per: {target_filter}")
-    
-    # --- PREPARAZIONE TASKS ---
-    tasks = []
-    metric_names = [] # Teniamo traccia dell'ordine
-    
-    console.print(f"🚀 Avvio retrieval parallelo per [bold]{len(metrics_def)}[/bold] metriche...", style="dim")
-    log.info(f"Lancio {len(metrics_def)} query Prometheus in parallelo.")
 
-    for metric_name, definition in metrics_def.items():
-        query = definition.get("query")
-        if query:
-            # Creiamo i task asincroni
-            tasks.append(query_tool.ainvoke({"query": query}))
-            metric_names.append(metric_name)
+    # --- SELEZIONE METRICHE (Demand-Driven) ---
+    # Riusiamo lo snapshot già in stato (es. sessione) se compatibile e scarichiamo solo ciò che manca
+    base_snapshot = _compatible_snapshot(state)
+    scope = state.get("metrics_scope") if base_snapshot is not None else target_filter
 
-    # --- ESECUZIONE PARALLELA (FIRE ALL) ---
-    raw_results = await asyncio.gather(*tasks, return_exceptions=True)
+    needed = required_metrics(state)
+    to_fetch = [m for m in needed if base_snapshot is None or m not in base_snapshot.metric_index]
 
-    # --- AGGREGAZIONE RISULTATI CON FILTRO ---
-    nodes_snapshot = {} # { "nome_nodo": { "cpu": 10, "ram": 50 } }
-    errors_count = 0
+    if len(needed) < len(metrics_def):
+        console.print(f"🧮 Retrieval on-demand: [bold]{len(needed)}[/bold]/{len(metrics_def)} metriche "
+                      f"richieste dai profili selezionati.", style="dim")
+        log.info(f"Retrieval on-demand: {len(needed)}/{len(metrics_def)} metriche ({needed}).")
 
-    for metric_name, result in zip(metric_names, raw_results):
-        if isinstance(result, Exception):
-            log.warning(f"Errore query {metric_name}: {result}")
-            errors_count += 1
-            continue
+    # --- ESECUZIONE PARALLELA (FIRE ALL) ---
+    # Range mode (opt-in) sul ramo allocation: per le metriche pesate dai profili, che l'analisi di stabilità
+    # userà, una sola range query fornisce sia il valore corrente sia le statistiche storiche
+    history = None
+    target_profiles = state.get("target_profiles") or []
+    if METRICS_RANGE_MODE and state.get("intent") == "allocation" and target_profiles:
+        history, new_snapshot, failed_metrics, stats = await fetch_with_history(
+            to_fetch, metrics_def, scope, qos_model(state).weighted_metrics(target_profiles)
+        )
+        if history is not None:
+            log.info(f"Storico a finestra in memoria ({history!r}, {history.samples.nbytes} bytes)")
+    else:
+        new_snapshot, failed_metrics, stats = await fetch_snapshot(to_fetch, metrics_def, scope)
+    snapshot = base_snapshot.merge(new_snapshot) if base_snapshot is not None else new_snapshot
 
-        try:
-            parsed_series = parse_prometheus_output(result, metric_name)
-            
-            # Pivot dei dati: Da {Metrica -> {Nodo -> Val}} a {Nodo -> {Metrica -> Val}}
-            for node, value in parsed_series.items():
-                
-                # --- IL FILTRO (Push-Down Logic) ---
-                if target_filter and node != target_filter:
-                    continue
-                # -----------------------------------
-
-                if node not in nodes_snapshot:
-                    nodes_snapshot[node] = {}
-                nodes_snapshot[node][metric_name] = value
-                
-        except Exception as e:
-            log.error(f"Errore parsing {metric_name}: {e}")
-            errors_count += 1
+    # Ogni snapshot scaricato alimenta lo store locale delle serie temporali
+    if TS_STORE_ENABLED:
+        if history is not None:
+            rolling_store.seed(history)
+        rolling_store.record(new_snapshot)
 
     # --- STATISTICHE E LOGGING ---
     elapsed_time = time.perf_counter() - start_time
-    node_count = len(nodes_snapshot)
+    node_count = len(snapshot)
     
     # Feedback visivo
     title_suffix = f"(Focus: {target_filter})" if target_filter else "(Full Cluster)"
     
-    # 1. Output Visuale (Console)
+    errors_count = len(failed_metrics)
+
+    # 1. Output Visuale (Console): uno snapshot parziale è comunque utilizzabile
     if errors_count > 0:
-        console.print(f"⚠️ Completato con {errors_count} errori.", style="yellow")
+        console.print(f"⚠️ Snapshot parziale: {len(to_fetch) - errors_count}/{len(to_fetch)} metriche. "
+                      f"Mancanti: {failed_metrics}", style="yellow")
 
     # 2. Log di Sistema
     log.info(f"Metrics Engine Report {title_suffix} | Tempo: {elapsed_time:.3f}s | Nodi: {node_count} | Errori: {errors_count}")
+    log.info(f"Decoder: {stats.as_dict()}")
+    query_executor.log_stats()
 
-    # Serializzazione
-    snapshot_json = json.dumps(nodes_snapshot, indent=2)
-    
     # --- VISUALIZZAZIONE TABELLARE ---
     if node_count > 0:
         # Generiamo la tabella Markdown per visualizzarla nel pannello
-        preview_table = json_to_markdown_table(nodes_snapshot, key_label="Node")
+        preview_table = json_to_markdown_table(snapshot.to_dict(), key_label="Node")
         
         # Stampa visiva del Pannello con Markdown renderizzato
         console.print(Panel(
@@ -129,14 +422,19 @@ async def metrics_engine_node(state: AgentState):
             border_style="dim cyan"
         ))
         
-        log.info(f"Snapshot dati salvato in memoria ({len(snapshot_json)} bytes)")
+        log.info(f"Snapshot dati salvato in memoria ({snapshot!r}, {snapshot.values.nbytes} bytes)")
         
     else:
         console.print("⚠️ Nessun dato trovato per il target richiesto.", style="bold red")
         log.warning("Nessun dato trovato per il target richiesto.")
 
-    return {
-        "metrics_report": snapshot_json,
-        "active_targets": list(nodes_snapshot.keys()),
-        "messages": [SystemMessage(content=f"Metrics updated in {elapsed_time:.2f}s.")]
-    }
\ No newline at end of file
+    update = {
+        "metrics_report": snapshot,
+        "metrics_scope": scope,
+        "active_targets": list(snapshot.nodes),
+        "messages": [SystemMessage(content=f"Metrics updated in {elapsed_time:.2f}s."
+                                   + (f" Partial snapshot, missing metrics: {failed_metrics}." if failed_metrics else ""))]
+    }
+    if history is not None:
+        update["metrics_history"] = history
+    return update
\ No newline at end of file
@@ -1,10 +1,3 @@
-import json
-from langchain_core.messages import SystemMessage
-from src.state import AgentState
-from src.config import client
-# IMPORTA IL LOGGER CENTRALIZZATO
-from src.logger import log
-
 # --- NODO 1: SETUP E CONTESTO ---
 import json
 import asyncio
@@ -14,26 +7,121 @@ from langchain_core.messages import SystemMessage
 
 # Import interni
 from src.state import AgentState
-from src.config import client
+from src.config import (mcp_session, llm_cache, QOS_CONFIG_REVALIDATE_S,
+                        QOS_CONFIG_FETCH_TIMEOUT_S, QOS_CONFIG_FALLBACK_PATH)
+from src.config_cache import QoSConfigCache
+from src.qos_model import compile_qos_config
 from src.logger import log
 
 # Inizializziamo la console
 console = Console()
 
+TARGET_URI = "prometheus://qos/config"
+
+
+# --- ROUND-TRIP MCP DELLA FASE DI SETUP (eseguiti in parallelo) ---
+
+async def _check_health() -> str:
+    """Esegue health_check. Solleva eccezione se Prometheus non è raggiungibile."""
+    health_result = await mcp_session.call_tool("health_check", {})
+
+    health_str = str(health_result).lower()
+    if "error" in health_str or "unhealthy" in health_str or "down" in health_str:
+        raise Exception(f"Health Check Fallito: {health_result}")
+    return health_result
+
+
+def _extract_text(tool_result) -> str:
+    """Estrazione JSON (Logica robusta per vari formati MCP)."""
+    if isinstance(tool_result, list) and len(tool_result) > 0:
+        first_item = tool_result[0]
+        if hasattr(first_item, "text"):
+            return first_item.text
+        elif isinstance(first_item, dict) and "text" in first_item:
+            return first_item["text"]
+        return str(first_item)
+    elif hasattr(tool_result, "text"):
+        return tool_result.text
+    return str(tool_result)
+
+
+async def _fetch_targets() -> list:
+    """Recupera i target attivi e restituisce la lista ordinata dei nomi dei nodi."""
+    targets_result = await mcp_session.call_tool("get_targets", {})
+    raw_json_str = _extract_text(targets_result)
+
+    unique_names = set()
+    try:
+        data = json.loads(raw_json_str)
+        active_targets_raw = data.get("activeTargets", [])
+
+        for t in active_targets_raw:
+            labels = t.get("labels", {})
+            name = labels.get("name")
+            if not name:
+                name = labels.get("instance")
+            if name:
+                unique_names.add(name)
+
+    except json.JSONDecodeError:
+        log.error(f"Errore parsing JSON targets: {raw_json_str[:50]}...")
+
+    return sorted(list(unique_names))
+
+
+async def _download_qos_config_text() -> str:
+    """Scarica la resource di configurazione QoS e ne restituisce il testo grezzo (non parsato)."""
+    log.info(f"Richiesta resource: {TARGET_URI}")
+    resources = await mcp_session.get_resources(uris=TARGET_URI)
+
+    if not resources or len(resources) == 0:
+        console.print(f"⚠️ Resource vuota per URI: {TARGET_URI}", style="yellow")
+        log.warning(f"Resource list vuota per URI: {TARGET_URI}")
+        return json.dumps({"metrics": {}, "profiles": {}})
+
+    config_blob = resources[0]
+
+    # MCP Python SDK: resource.text or resource.blob depending on implementation
+    # Assumiamo text per file di configurazione
+    if hasattr(config_blob, "text") and config_blob.text:
+        return config_blob.text
+    elif hasattr(config_blob, "content") and config_blob.content:
+        # Se fosse base64 o bytes, servirebbe decode. Assumiamo stringa.
+        return config_blob.content
+    else:
+        # Fallback: prova a chiamare il metodo del tuo SDK se diverso
+        # Nel tuo codice originale usavi .as_string(), mantengo quello se è del tuo SDK custom
+        try:
+            return config_blob.as_string()
+        except:
+            return str(config_blob)
+
+
+# Config QoS parsata e versionata in memoria: niente download + json.loads ad ogni turno
+qos_config_cache = QoSConfigCache(
+    _download_qos_config_text,
+    revalidate_interval=QOS_CONFIG_REVALIDATE_S,
+    fallback_path=QOS_CONFIG_FALLBACK_PATH,
+    fetch_timeout=QOS_CONFIG_FETCH_TIMEOUT_S
+)
+
+
 async def context_manager_node(state: AgentState):
     """ 
     1. Verifica salute Prometheus.
     2. Recupera i target.
-    3. SCARICA la configurazione QoS (Resource) dal server.
+    3. Recupera la configurazione QoS (Resource) dalla cache versionata (download solo se scaduta).
+    OTTIMIZZAZIONE: i tre round-trip MCP partono in PARALLELO; l'esito dell'health check
+    decide a posteriori se i risultati di target e configurazione vengono usati.
     """    
     
     # Header Visuale
     console.print(Panel("🔌 System Context Setup", style="blue"))
     log.info("Avvio Context Manager: Health Check, Targets, Resources.")
 
-    # 1. Recuperiamo tutti i tool disponibili
+    # 1. Recuperiamo il registry dei tool dalla sessione MCP persistente
     try:
-        tools = await client.get_tools()
+        tools = await mcp_session.get_tools()
     except Exception as e:
         log.critical(f"Errore connessione MCP Tools: {e}")
         return {
@@ -41,155 +129,79 @@ async def context_manager_node(state: AgentState):
             "sanity_check_ok": False
         }
 
-    # Recupero tool specifici
-    health_tool = next((t for t in tools if t.name == "health_check"), None)
-    target_tool = next((t for t in tools if t.name == "get_targets"), None)
-    
-    # --- FASE 1: HEALTH CHECK ---
-    if not health_tool:
-        msg = "Tool 'health_check' non trovato su MCP Server."
-        console.print(f"❌ {msg}", style="bold red")
-        log.critical(msg)
-        return {
-            "messages": [SystemMessage(content=f"ERRORE CRITICO: {msg}")],
-            "sanity_check_ok": False
-        }
-        
-    try:
-        # Eseguiamo health_check
-        console.print("Diagnostica: Controllo stato Prometheus...", style="dim")
-        health_result = await health_tool.ainvoke({})
-        
-        health_str = str(health_result).lower()
-        if "error" in health_str or "unhealthy" in health_str or "down" in health_str:
-             console.print(f"❌ Health Check Fallito: {health_result}", style="bold red")
-             log.error(f"Health Check Fallito: {health_result}")
-             raise Exception(f"Health Check Fallito: {health_result}")
-        else:
-             console.print("✅ Prometheus Health Check: OK", style="green")
-             log.info("Prometheus Health Check: OK")
-             
-    except Exception as e:
-        log.error(f"ERRORE HEALTH CHECK: {e}")
+    # Verifica presenza dei tool specifici
+    for tool_name in ("health_check", "get_targets"):
+        if tool_name not in tools:
+            msg = f"Tool '{tool_name}' non trovato su MCP Server."
+            console.print(f"❌ {msg}", style="bold red")
+            log.critical(msg)
+            return {
+                "messages": [SystemMessage(content=f"ERRORE CRITICO: {msg}")],
+                "sanity_check_ok": False
+            }
+
+    # --- ROUND-TRIP CONCORRENTI (Health + Targets + Config) ---
+    console.print("Diagnostica: Health Check, scansione nodi e download Config QoS "
+                  f"([dim]{TARGET_URI}[/dim]) in parallelo...", style="dim")
+    health_res, targets_res, config_res = await asyncio.gather(
+        _check_health(),
+        _fetch_targets(),
+        qos_config_cache.get(),
+        return_exceptions=True
+    )
+
+    # --- FASE 1: HEALTH CHECK (decide se usare gli altri risultati) ---
+    if isinstance(health_res, Exception):
+        console.print(f"❌ {health_res}", style="bold red")
+        log.error(f"ERRORE HEALTH CHECK: {health_res}")
         return {
-            "messages": [SystemMessage(content=f"⛔ ERRORE HEALTH CHECK: {str(e)}")],
+            "messages": [SystemMessage(content=f"⛔ ERRORE HEALTH CHECK: {str(health_res)}")],
             "sanity_check_ok": False
         }
 
-    # --- FASE 2: GET TARGETS (Solo se health passata) ---
-    if not target_tool:
-        msg = "Tool 'get_targets' non trovato."
-        console.print(f"❌ {msg}", style="bold red")
-        log.critical(msg)
-        return {
-            "messages": [SystemMessage(content=f"ERRORE CRITICO: {msg}")],
-            "sanity_check_ok": False
-        }
+    console.print("✅ Prometheus Health Check: OK", style="green")
+    log.info("Prometheus Health Check: OK")
 
-    unique_names = set() 
-
-    try:
-        console.print("Diagnostica: Scansione nodi attivi...", style="dim")
-        targets_result = await target_tool.ainvoke({})
-        
-        # 1. Estrazione JSON (Logica robusta per vari formati MCP)
-        raw_json_str = ""
-        
-        if isinstance(targets_result, list) and len(targets_result) > 0:
-            first_item = targets_result[0]
-            if hasattr(first_item, "text"):
-                raw_json_str = first_item.text
-            elif isinstance(first_item, dict) and "text" in first_item:
-                raw_json_str = first_item["text"]
-            else:
-                raw_json_str = str(first_item)
-        elif hasattr(targets_result, "text"):
-            raw_json_str = targets_result.text
-        else:
-            raw_json_str = str(targets_result)
-
-        # 2. Parsing
-        try:
-            data = json.loads(raw_json_str)
-            active_targets_raw = data.get("activeTargets", [])
-            
-            for t in active_targets_raw:
-                labels = t.get("labels", {})
-                name = labels.get("name")
-                if not name:
-                    name = labels.get("instance")
-                if name:
-                    unique_names.add(name) 
-
-        except json.JSONDecodeError:
-            log.error(f"Errore parsing JSON targets: {raw_json_str[:50]}...")
-
-        targets_list = sorted(list(unique_names))
-        
-        if targets_list:
-            console.print(f"✅ Nodi identificati: [bold cyan]{targets_list}[/bold cyan]")
-            log.info(f"Nodi identificati: {targets_list}")
-        else:
-            console.print("⚠️ Nessun nodo attivo trovato.", style="yellow")
-            log.warning("Lista nodi vuota.")
-             
-    except Exception as e:
-        log.error(f"ERRORE GET TARGETS: {e}")
+    # --- FASE 2: GET TARGETS ---
+    if isinstance(targets_res, Exception):
+        log.error(f"ERRORE GET TARGETS: {targets_res}")
         return {
-            "messages": [SystemMessage(content=f"⛔ ERRORE GET TARGETS: {str(e)}")],
+            "messages": [SystemMessage(content=f"⛔ ERRORE GET TARGETS: {str(targets_res)}")],
             "sanity_check_ok": False,
             "active_targets": []
         }
 
-    # --- FASE 3: CARICAMENTO RISORSA ---
-    TARGET_URI = "prometheus://qos/config"
-    qos_config = {}
-    
-    try:
-        console.print(f"Diagnostica: Download Config QoS ([dim]{TARGET_URI}[/dim])...", style="dim")
-        log.info(f"Richiesta resource: {TARGET_URI}")
-        
-        resources = await client.get_resources(uris=TARGET_URI)
-        
-        if resources and len(resources) > 0:
-            config_blob = resources[0]
-            
-            # MCP Python SDK: resource.text or resource.blob depending on implementation
-            # Assumiamo text per file di configurazione
-            if hasattr(config_blob, "text") and config_blob.text:
-                text_content = config_blob.text
-            elif hasattr(config_blob, "content") and config_blob.content:
-                 # Se fosse base64 o bytes, servirebbe decode. Assumiamo stringa.
-                 text_content = config_blob.content
-            else:
-                 # Fallback: prova a chiamare il metodo del tuo SDK se diverso
-                 # Nel tuo codice originale usavi .as_string(), mantengo quello se è del tuo SDK custom
-                 try:
-                    text_content = config_blob.as_string()
-                 except:
-                    text_content = str(config_blob)
-
-            qos_config = json.loads(text_content)
-            
-            num_metrics = len(qos_config.get('metrics', {}))
-            num_profiles = len(qos_config.get('profiles', {}))
-            
-            console.print(f"✅ Configurazione QoS caricata: [bold]{num_metrics}[/bold] metriche, [bold]{num_profiles}[/bold] profili.", style="green")
-            log.info(f"Config QoS caricata: {num_metrics} metriche, {num_profiles} profili.")
-        else:
-            console.print(f"⚠️ Resource vuota per URI: {TARGET_URI}", style="yellow")
-            log.warning(f"Resource list vuota per URI: {TARGET_URI}")
-            qos_config = {"metrics": {}, "profiles": {}}
+    targets_list = targets_res
+    if targets_list:
+        console.print(f"✅ Nodi identificati: [bold cyan]{targets_list}[/bold cyan]")
+        log.info(f"Nodi identificati: {targets_list}")
+    else:
+        console.print("⚠️ Nessun nodo attivo trovato.", style="yellow")
+        log.warning("Lista nodi vuota.")
 
-    except Exception as e:
-        console.print(f"❌ Errore caricamento Risorse: {e}", style="bold red")
-        log.error(f"Errore caricamento Risorse: {e}", exc_info=True)
+    # --- FASE 3: CARICAMENTO RISORSA ---
+    if isinstance(config_res, Exception):
+        console.print(f"❌ Errore caricamento Risorse: {config_res}", style="bold red")
+        log.error(f"Errore caricamento Risorse: {config_res}", exc_info=config_res)
         return {
             "qos_config": {"metrics": {}, "profiles": {}},
-            "messages": [SystemMessage(content=f"ATTENZIONE: Errore caricamento risorse ({e}).")],
+            "messages": [SystemMessage(content=f"ATTENZIONE: Errore caricamento risorse ({config_res}).")],
             "sanity_check_ok": False 
         }
 
+    qos_config = config_res
+    # Compilazione una tantum del config (indici precalcolati, memoizzati per versione del config)
+    model = compile_qos_config(qos_config, qos_config_cache.digest)
+    # Le risposte LLM in cache legate a un contenuto precedente del config non sono più valide
+    # (hash del contenuto: anche le modifiche che non aggiornano il campo "version" invalidano)
+    llm_cache.sync_config(qos_config_cache.digest)
+    num_metrics = len(model.metrics)
+    num_profiles = len(model.profiles)
+    
+    console.print(f"✅ Configurazione QoS caricata: [bold]{num_metrics}[/bold] metriche, [bold]{num_profiles}[/bold] profili "
+                  f"[dim](versione {qos_config_cache.version})[/dim].", style="green")
+    log.info(f"Config QoS caricata: {num_metrics} metriche, {num_profiles} profili (versione {qos_config_cache.version}).")
+
     # Safety Check
     if not qos_config.get("profiles"):
         console.print("⚠️ ATTENZIONE: Configurazione QoS incompleta.", style="bold yellow")
@@ -201,6 +213,7 @@ async def context_manager_node(state: AgentState):
     return {
         "active_targets": targets_list,
         "qos_config": qos_config,
+        "qos_config_digest": qos_config_cache.digest,
         "sanity_check_ok": True,
         "messages": [SystemMessage(content=msg)]
-    }
\ No newline at end of file
+    }
@@ -0,0 +1,223 @@
+import re
+import json
+import math
+import numpy as np
+
+# --- DECODER VELOCE DELLE RISPOSTE PROMETHEUS (decodifica incrementale delle serie) ---
+
+_WHITESPACE = re.compile(r"\s*")
+
+_json_decoder = json.JSONDecoder()
+
+
+class DecodeStats:
+    """Contatori strutturati degli errori di decodifica (al posto delle print nel loop)."""
+
+    __slots__ = ("payloads", "series", "invalid_payloads", "non_numeric", "missing_value")
+
+    def __init__(self):
+        self.payloads = 0            # Risposte decodificate
+        self.series = 0              # Serie valide estratte
+        self.invalid_payloads = 0    # Risposte non Prometheus (errore server, testo grezzo, JSON rotto)
+        self.non_numeric = 0         # Valori non numerici (es. "NaN" testuali non parsabili)
+        self.missing_value = 0       # Serie senza campo value/values
+
+    @property
+    def errors(self) -> int:
+        return self.invalid_payloads + self.non_numeric + self.missing_value
+
+    def as_dict(self) -> dict:
+        return {k: getattr(self, k) for k in self.__slots__}
+
+
+def payload_text(result):
+    """
+    Estrae il payload dal wrapper MCP/LangChain senza parsarlo.
+    Restituisce una stringa JSON oppure un dict già decodificato.
+    """
+    # Content-list MCP: [{'type': 'text', 'text': '{...}', 'id': ...}] oppure oggetti con .text
+    if isinstance(result, list) and len(result) > 0:
+        first_item = result[0]
+        if isinstance(first_item, dict) and "text" in first_item:
+            return first_item["text"]
+        if hasattr(first_item, "text"):
+            return first_item.text
+
+    if isinstance(result, (dict, str)):
+        return result
+    if isinstance(result, bytes):
+        return result.decode("utf-8", errors="replace")
+    if hasattr(result, "content"):
+        return result.content
+    return str(result)
+
+
+def _skip_ws(text: str, pos: int) -> int:
+    return _WHITESPACE.match(text, pos).end()
+
+
+def _result_array_start(text: str, pos: int, allow_data: bool = True) -> int:
+    """
+    Posizione del primo elemento dell'array "result", cercato come chiave dell'oggetto che inizia in `pos`
+    (formato {"resultType", "result"}) o dell'oggetto "data" (envelope {"status", "data"}).
+    I valori degli altri campi vengono saltati con raw_decode: una chiave "result" annidata altrove
+    (es. in "warnings" o nelle label) non viene scambiata per l'array dei risultati.
+    """
+    if pos >= len(text) or text[pos] != "{":
+        raise ValueError("Oggetto JSON atteso")
+    pos = _skip_ws(text, pos + 1)
+    while pos < len(text) and text[pos] != "}":
+        if text[pos] != '"':
+            raise ValueError("Chiave JSON attesa")
+        key, pos = _json_decoder.raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if pos >= len(text) or text[pos] != ":":
+            raise ValueError("':' atteso dopo la chiave")
+        pos = _skip_ws(text, pos + 1)
+        if key == "result" and text.startswith("[", pos):
+            return pos + 1
+        if key == "data" and allow_data and text.startswith("{", pos):
+            return _result_array_start(text, pos, allow_data=False)
+        _, pos = _json_decoder.raw_decode(text, pos)
+        pos = _skip_ws(text, pos)
+        if text.startswith(",", pos):
+            pos = _skip_ws(text, pos + 1)
+    raise ValueError("Array 'result' non trovato")
+
+
+def _iter_result_items(text: str):
+    """
+    Decodifica incrementale degli elementi dell'array "result": il testo della risposta resta in memoria,
+    ma le serie vengono decodificate (raw_decode) e consumate una alla volta, senza costruire l'intero
+    albero JSON del documento.
+    Solleva ValueError se il payload non contiene un array "result".
+    """
+    pos = _result_array_start(text, _skip_ws(text, 0))
+    end = len(text)
+    while True:
+        pos = _skip_ws(text, pos)
+        if pos >= end:
+            raise ValueError("Array 'result' troncato")
+        if text[pos] == "]":
+            return
+        item, pos = _json_decoder.raw_decode(text, pos)
+        yield item
+        pos = _skip_ws(text, pos)
+        if pos < end and text[pos] == ",":
+            pos += 1
+
+
+def iter_series(result, stats: DecodeStats | None = None):
+    """
+    Decodifica una risposta (vector o matrix) e restituisce per ogni serie (labels, item grezzo).
+    Imposta stats.invalid_payloads se la risposta non è un risultato Prometheus.
+    """
+    stats = stats if stats is not None else DecodeStats()
+    payload = payload_text(result)
+
+    try:
+        if isinstance(payload, dict):
+            data = payload.get("data", payload)
+            items = data.get("result") if isinstance(data, dict) else None
+            if not isinstance(items, list):
+                raise ValueError("Campo 'result' mancante")
+        else:
+            items = _iter_result_items(payload)
+
+        stats.payloads += 1
+        for item in items:
+            if not isinstance(item, dict):
+                # Es. resultType "scalar": [ts, "val"]
+                raise ValueError("Elemento 'result' non è una serie")
+            yield item.get("metric", {}), item
+    except ValueError:
+        # json.JSONDecodeError è sottoclasse di ValueError
+        stats.invalid_payloads += 1
+        raise
+
+
+def sample_value(item: dict, stats: DecodeStats) -> float | None:
+    """Valore istantaneo della serie: 'value' per i vector, ultimo campione di 'values' per i matrix."""
+    sample = item.get("value")
+    if sample is None:
+        values = item.get("values")
+        sample = values[-1] if values else None
+    if sample is None or len(sample) < 2:
+        stats.missing_value += 1
+        return None
+    try:
+        return float(sample[1])
+    except (TypeError, ValueError):
+        stats.non_numeric += 1
+        return None
+
+
+def sample_series(item: dict, stats: DecodeStats):
+    """Campioni della serie come array (timestamps, valori): 'values' per i matrix, 'value' per i vector."""
+    samples = item.get("values")
+    if samples is None:
+        sample = item.get("value")
+        samples = [sample] if sample is not None else None
+    if not samples:
+        stats.missing_value += 1
+        return None
+    try:
+        # Conversione vettoriale delle coppie [ts, "valore"] ("NaN" e "+Inf" inclusi)
+        matrix = np.array(samples, dtype=np.float64)
+    except (TypeError, ValueError):
+        stats.non_numeric += 1
+        return None
+    if matrix.ndim != 2 or matrix.shape[1] < 2:
+        stats.missing_value += 1
+        return None
+    return matrix[:, 0], matrix[:, 1]
+
+
+def node_name(labels: dict) -> str:
+    return labels.get("name") or labels.get("instance") or "unknown"
+
+
+def decode_into(result, builder, metric: str | None = None, tag_label: str | None = None,
+                stats: DecodeStats | None = None) -> bool:
+    """
+    Decodifica la risposta e riempie direttamente il builder dello snapshot colonnare.
+    - metric: nome della metrica per le risposte singole
+    - tag_label: label che porta il nome della metrica nelle risposte batch
+    Restituisce False se la risposta non è un risultato Prometheus valido.
+    """
+    stats = stats if stats is not None else DecodeStats()
+    try:
+        for labels, item in iter_series(result, stats):
+            metric_name = labels.get(tag_label) if tag_label else metric
+            if not metric_name:
+                continue
+            value = sample_value(item, stats)
+            if value is None or math.isnan(value):
+                continue
+            builder.add(metric_name, node_name(labels), value)
+            stats.series += 1
+    except ValueError:
+        return False
+    return True
+
+
+def decode_series_into(result, builder, metric: str | None = None, tag_label: str | None = None,
+                       stats: DecodeStats | None = None) -> bool:
+    """
+    Come decode_into, ma per le range query: passa al builder dello storico l'intera serie di campioni.
+    Restituisce False se la risposta non è un risultato Prometheus valido.
+    """
+    stats = stats if stats is not None else DecodeStats()
+    try:
+        for labels, item in iter_series(result, stats):
+            metric_name = labels.get(tag_label) if tag_label else metric
+            if not metric_name:
+                continue
+            series = sample_series(item, stats)
+            if series is None:
+                continue
+            builder.add_series(metric_name, node_name(labels), *series)
+            stats.series += 1
+    except ValueError:
+        return False
+    return True
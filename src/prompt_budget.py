@@ -0,0 +1,118 @@
+import math
+
+from src.logger import log
+
+
+# Stima conservativa dei token senza tokenizer (testo misto italiano/inglese/Markdown)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text or "") / CHARS_PER_TOKEN)
+
+
+def messages_tokens(messages: list) -> int:
+    """Token stimati di una lista di messaggi LangChain (solo contenuto testuale)."""
+    return sum(estimate_tokens(m.content if isinstance(m.content, str) else str(m.content)) for m in messages)
+
+
+def fit_messages(messages: list, budget_tokens: int) -> tuple[list, int]:
+    """
+    Storico dei messaggi entro il budget: i più recenti per primi e senza buchi (ci si ferma al primo che non sta nel budget);
+    l'ultimo messaggio utente è sempre incluso.
+    Restituisce (messaggi_inclusi nell'ordine originale, messaggi_omessi).
+    """
+    last_human = max((k for k, m in enumerate(messages) if getattr(m, "type", None) == "human"), default=None)
+    start, used = len(messages), 0
+    for k in range(len(messages) - 1, -1, -1):
+        cost = messages_tokens([messages[k]])
+        if k != last_human and used + cost > budget_tokens:
+            # Al primo messaggio che non sta nel budget ci si ferma: lo storico resta contiguo
+            break
+        start = k
+        used += cost
+    kept = messages[start:]
+    if last_human is not None and start > last_human:
+        # Coda troppo grande dopo l'ultimo messaggio utente: resta solo quest'ultimo
+        kept = [messages[last_human]]
+    return kept, len(messages) - len(kept)
+
+
+def fit_lines(lines: list, budget_tokens: int) -> tuple[list, int]:
+    """Righe (già ordinate per rilevanza) che stanno nel budget: restituisce (righe_incluse, righe_omesse)."""
+    kept, used = [], 0
+    for k, line in enumerate(lines):
+        cost = estimate_tokens(line) + 1
+        if used + cost > budget_tokens:
+            return kept, len(lines) - k
+        kept.append(line)
+        used += cost
+    return kept, 0
+
+
+def summarize_names(nodes: list, max_names: int = 20) -> str:
+    """Elenco di nodi troncato: "a, b, c (+N)"."""
+    shown = ", ".join(nodes[:max_names])
+    return shown + (f" (+{len(nodes) - max_names})" if len(nodes) > max_names else "")
+
+
+def compress_audit(profiles_audit: list, budget_tokens: int, max_names: int = 20) -> str:
+    """
+    Audit trail entro il budget di token.
+    profiles_audit: [(profilo, [(nodo, idoneo, [righe di controllo])])]
+    - Se l'audit completo sta nel budget viene restituito così com'è.
+    - Altrimenti, per ogni profilo: prima i nodi con controlli falliti (solo le righe FAIL),
+      poi una riga aggregata "N nodi hanno superato tutti i controlli"; il resto viene contato e omesso.
+    """
+    full = "\n".join(
+        f"--- Dettagli Profilo: {profile} ---\n" + "".join(f"- {node}: {'; '.join(checks)}\n" for node, _, checks in rows)
+        for profile, rows in profiles_audit if rows
+    )
+    if estimate_tokens(full) <= budget_tokens:
+        return full
+
+    sections = [(profile, rows) for profile, rows in profiles_audit if rows]
+    # Profili con meno fallimenti per primi: il budget che non usano passa ai successivi
+    sections.sort(key=lambda section: sum(1 for _, ok, _ in section[1] if not ok))
+    remaining = budget_tokens
+    blocks = {}
+    for k, (profile, rows) in enumerate(sections):
+        per_profile = max(1, remaining // (len(sections) - k))
+        passed = [node for node, ok, _ in rows if ok]
+        failed = [(node, [c for c in checks if "FAIL" in c] or checks) for node, ok, checks in rows if not ok]
+
+        header = f"--- Dettagli Profilo: {profile} ---"
+        summary = (f"- {len(passed)} nodi hanno superato tutti i controlli: {summarize_names(passed, max_names)}"
+                   if passed else "- Nessun nodo ha superato tutti i controlli.")
+        budget = per_profile - estimate_tokens(header) - estimate_tokens(summary) - 2
+        fail_lines, omitted = fit_lines([f"- {node}: {'; '.join(checks)}" for node, checks in failed], budget)
+        if omitted:
+            fail_lines.append(f"- ... altri {omitted} nodi con controlli falliti (omessi per brevità)")
+        blocks[profile] = "\n".join([header, *fail_lines, summary])
+        remaining -= estimate_tokens(blocks[profile]) + 1
+    # Ordine originale dei profili nel prompt
+    return "\n".join(blocks[profile] for profile, rows in profiles_audit if rows)
+
+
+def top_rows(rows: list, render, budget_tokens: int, min_rows: int = 1) -> tuple[list, int]:
+    """
+    Prime righe (già ordinate per rilevanza) la cui resa testuale `render(righe)` sta nel budget.
+    Restituisce (righe_incluse, righe_omesse); almeno `min_rows` righe vengono sempre incluse.
+    """
+    if estimate_tokens(render(rows)) <= budget_tokens:
+        return rows, 0
+    low, high = min(min_rows, len(rows)), len(rows)
+    # Ricerca binaria sul numero di righe: la resa è monotona nella lunghezza
+    while low < high:
+        mid = (low + high + 1) // 2
+        if estimate_tokens(render(rows[:mid])) <= budget_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return rows[:low], len(rows) - low
+
+
+def log_prompt_size(node: str, prompt_tokens: int, budget_tokens: int | None = None):
+    """Registra la dimensione stimata del prompt (e l'eventuale sforamento del budget)."""
+    budget_str = f" (budget dati {budget_tokens})" if budget_tokens else ""
+    log.info(f"Prompt {node}: ~{prompt_tokens} token stimati{budget_str}.")
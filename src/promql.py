@@ -0,0 +1,237 @@
+import re
+
+# --- RISCRITTURA DELLE QUERY PROMQL ---
+
+# Label sintetica con cui ogni serie di una query batch viene marcata col nome della metrica QoS
+BATCH_LABEL = "__qos_metric__"
+
+# Query che restituiscono uno scalare (o un letterale) non possono passare da label_replace
+_SCALAR_QUERY = re.compile(r"^\s*(scalar\s*\(|time\s*\(\s*\)\s*$|[-+]?\d+(\.\d+)?([eE][-+]?\d+)?\s*$)")
+
+
+def is_batchable(query: str) -> bool:
+    """True se la query restituisce un instant vector e può essere fusa in una query batch."""
+    if not query or not query.strip():
+        return False
+    return _SCALAR_QUERY.match(query) is None
+
+
+def tag_query(query: str, metric_name: str) -> str:
+    """Marca ogni serie della query con la label BATCH_LABEL="<metric_name>"."""
+    return f'label_replace(({query}), "{BATCH_LABEL}", "{metric_name}", "", "")'
+
+
+def build_batches(metric_queries: dict, max_chars: int = 6000) -> tuple[list, list]:
+    """
+    Raggruppa le query compatibili in query batch unite con `or`.
+    Restituisce:
+    - batches: lista di (query_batch, [nomi_metriche])
+    - singles: lista di nomi di metriche da interrogare singolarmente (non fondibili)
+    """
+    batches = []
+    singles = []
+
+    current_parts = []
+    current_names = []
+    current_len = 0
+
+    for metric_name, query in metric_queries.items():
+        if not is_batchable(query):
+            singles.append(metric_name)
+            continue
+
+        part = tag_query(query, metric_name)
+        # Chiudiamo il batch corrente se supererebbe la lunghezza massima (limite URL/POST lato server)
+        if current_parts and current_len + len(part) + 4 > max_chars:
+            batches.append((" or ".join(current_parts), current_names))
+            current_parts, current_names, current_len = [], [], 0
+
+        current_parts.append(part)
+        current_names.append(metric_name)
+        current_len += len(part) + 4
+
+    if current_parts:
+        batches.append((" or ".join(current_parts), current_names))
+
+    # Un batch con una sola metrica non porta vantaggi: meglio la query originale
+    final_batches = []
+    for query, names in batches:
+        if len(names) == 1:
+            singles.append(names[0])
+        else:
+            final_batches.append((query, names))
+
+    return final_batches, singles
+
+
+# --- PUSH-DOWN DEL FILTRO NODO NEI LABEL MATCHER ---
+
+# Keyword PromQL seguite da una lista di label tra parentesi (da non trattare come selettori)
+_GROUPING_KEYWORDS = {"by", "without", "on", "ignoring", "group_left", "group_right"}
+# Operatori di aggregazione: possono essere seguiti da "by (...)" prima delle parentesi
+_AGGREGATIONS = {"sum", "avg", "min", "max", "count", "group", "stddev", "stdvar",
+                 "topk", "bottomk", "quantile", "count_values", "limitk", "limit_ratio"}
+# Altre keyword/operatori testuali che non sono nomi di metrica
+_KEYWORDS = {"and", "or", "unless", "bool", "offset", "atan2"} | _GROUPING_KEYWORDS | _AGGREGATIONS
+_REGEX_META = re.compile(r"([.^$*+?()\[\]{}|\\])")
+
+_IDENT_START = re.compile(r"[a-zA-Z_:]")
+_IDENT = re.compile(r"[a-zA-Z_:][a-zA-Z0-9_:]*")
+_NUMBER = re.compile(r"[0-9.][0-9a-zA-Z_.+-]*")
+
+
+def _quote(value: str) -> str:
+    """Letterale stringa PromQL (escape stile Go)."""
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def node_matcher(nodes: list, label: str = "name") -> str:
+    """Matcher per uno o più nodi: name="w1" oppure name=~"w1|w2"."""
+    if len(nodes) == 1:
+        return f"{label}={_quote(nodes[0])}"
+    pattern = "|".join(_REGEX_META.sub(r"\\\1", n) for n in nodes)
+    return f"{label}=~{_quote(pattern)}"
+
+
+def _skip_string(query: str, i: int) -> int:
+    """Restituisce l'indice successivo alla chiusura della stringa che inizia in i."""
+    quote = query[i]
+    i += 1
+    while i < len(query):
+        if query[i] == "\\" and quote != "`":
+            i += 2
+            continue
+        if query[i] == quote:
+            return i + 1
+        i += 1
+    return i
+
+
+def _skip_block(query: str, i: int, open_ch: str, close_ch: str) -> int:
+    """Restituisce l'indice successivo alla parentesi che chiude il blocco aperto in i."""
+    depth = 0
+    while i < len(query):
+        ch = query[i]
+        if ch in "\"'`":
+            i = _skip_string(query, i)
+            continue
+        if ch == open_ch:
+            depth += 1
+        elif ch == close_ch:
+            depth -= 1
+            if depth == 0:
+                return i + 1
+        i += 1
+    return i
+
+
+def _skip_spaces(query: str, i: int) -> int:
+    while i < len(query) and query[i].isspace():
+        i += 1
+    return i
+
+
+def add_label_matcher(query: str, matcher: str) -> str:
+    """
+    Inserisce il matcher (es. name="worker-1") in OGNI selettore di serie della query.
+    Le chiamate di funzione, le liste di grouping (by/on/...), le stringhe e le durate restano intatte.
+    """
+    out = []
+    i = 0
+    n = len(query)
+
+    while i < n:
+        ch = query[i]
+
+        if ch in "\"'`":
+            end = _skip_string(query, i)
+            out.append(query[i:end])
+            i = end
+
+        elif ch == "[":
+            # Range/subquery ([5m], [24h:5m]): nessun selettore all'interno
+            end = _skip_block(query, i, "[", "]")
+            out.append(query[i:end])
+            i = end
+
+        elif ch == "{":
+            # Selettore senza nome metrica: {__name__=~"..."}
+            end = _skip_block(query, i, "{", "}")
+            out.append(_inject(query[i:end], matcher))
+            i = end
+
+        elif ch.isdigit() or (ch == "." and i + 1 < n and query[i + 1].isdigit()):
+            m = _NUMBER.match(query, i)
+            out.append(m.group(0))
+            i = m.end()
+
+        elif _IDENT_START.match(ch):
+            m = _IDENT.match(query, i)
+            ident = m.group(0)
+            j = _skip_spaces(query, m.end())
+            next_ch = query[j] if j < n else ""
+
+            if ident in _GROUPING_KEYWORDS and next_ch == "(":
+                # by (name) / on (instance): lista di label, da copiare così com'è
+                end = _skip_block(query, j, "(", ")")
+                out.append(query[i:end])
+                i = end
+            elif ident in _KEYWORDS or next_ch == "(":
+                # Keyword o chiamata di funzione/aggregazione
+                out.append(ident)
+                i = m.end()
+            elif next_ch == "{":
+                end = _skip_block(query, j, "{", "}")
+                out.append(query[i:j] + _inject(query[j:end], matcher))
+                i = end
+            else:
+                out.append(ident + "{" + matcher + "}")
+                i = m.end()
+
+        else:
+            out.append(ch)
+            i += 1
+
+    return "".join(out)
+
+
+def _inject(braces: str, matcher: str) -> str:
+    """Aggiunge il matcher dentro un blocco di label matcher '{...}'."""
+    inner = braces[1:-1].strip().rstrip(",")
+    if not inner:
+        return "{" + matcher + "}"
+    return "{" + inner + ", " + matcher + "}"
+
+
+def scope_query(query: str, nodes: list, label: str = "name") -> str:
+    """Restringe la query ai soli nodi indicati (push-down del filtro lato Prometheus)."""
+    if not nodes:
+        return query
+    return add_label_matcher(query, node_matcher(nodes, label))
+
+
+# --- DURATE PROMQL ---
+
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800, "y": 31536000}
+_DURATION_PART = re.compile(r"(\d+)(ms|s|m|h|d|w|y)")
+
+
+def parse_duration(text: str) -> int:
+    """Durata PromQL (es. "90s", "1h30m", "7d") in secondi; accetta anche un numero di secondi."""
+    text = text.strip()
+    if text.isdigit():
+        return int(text)
+    parts = _DURATION_PART.findall(text)
+    if not parts or "".join(n + u for n, u in parts) != text:
+        raise ValueError(f"Durata PromQL non valida: {text!r}")
+    return int(sum(int(n) * _DURATION_UNITS[u] for n, u in parts))
+
+
+def format_duration(seconds: float) -> str:
+    """Secondi in durata PromQL compatta (es. 86400 -> "1d", 5400 -> "90m")."""
+    seconds = int(seconds)
+    for unit in ("d", "h", "m"):
+        size = _DURATION_UNITS[unit]
+        if seconds >= size and seconds % size == 0:
+            return f"{seconds // size}{unit}"
+    return f"{seconds}s"
@@ -0,0 +1,270 @@
+import json
+import math
+import hashlib
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from src.evaluation import CompiledProfiles, normalize_profiles
+from src.utils import get_strictest_threshold_config, get_physical_threshold
+from src.logger import log
+
+
+_KNOWN_OPERATORS = {"<", "<=", ">", ">=", "==", "!="}
+
+
+@dataclass(frozen=True, slots=True)
+class MetricDef:
+    name: str
+    query: str | None
+    unit: str = "raw"
+    stability_threshold: float | None = None
+    raw: dict = field(default_factory=dict, repr=False)
+
+
+@dataclass(frozen=True, slots=True)
+class Requirement:
+    metric: str
+    operator: str
+    threshold: float
+
+
+@dataclass(frozen=True, slots=True)
+class ScoringWeight:
+    metric: str
+    weight: float
+    direction: str = "minimize"
+    stability_threshold: float | None = None
+
+
+@dataclass(frozen=True, slots=True)
+class ProfileDef:
+    name: str
+    description: str
+    required_conditions: tuple
+    scoring_weights: dict
+    raw: dict = field(repr=False)
+
+    @property
+    def metrics(self) -> frozenset:
+        """Metriche referenziate dal profilo (requisiti + pesi di scoring)."""
+        return frozenset([r.metric for r in self.required_conditions] + list(self.scoring_weights))
+
+
+def _to_float(value) -> float | None:
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        return None
+    return None if math.isnan(number) else number
+
+
+class QoSModel:
+    """
+    Config QoS compilata una sola volta al caricamento, con indici precalcolati:
+    - metric_profiles: metrica -> profili che la usano
+    - profile_metrics: profilo -> insieme delle metriche richieste
+    - soglie più restrittive, pesi mixati e requisiti compilati per combinazione di profili (memoizzati)
+    - unità e soglia fisica per metrica
+    I nodi leggono da qui invece di riscandire i dict annidati del config ad ogni turno.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self.issues = []   # Problemi di validazione (riportati nei log, non bloccanti)
+
+        # --- METRICHE ---
+        self.metrics = {}
+        for name, definition in (config.get("metrics") or {}).items():
+            if not isinstance(definition, dict):
+                self.issues.append(f"Metrica '{name}': definizione non valida")
+                continue
+            if not definition.get("query"):
+                self.issues.append(f"Metrica '{name}': query mancante")
+            threshold = definition.get("stability_threshold")
+            self.metrics[name] = MetricDef(
+                name=name,
+                query=definition.get("query"),
+                unit=definition.get("unit", "raw"),
+                stability_threshold=_to_float(threshold) if threshold is not None else None,
+                raw=definition,
+            )
+
+        # --- PROFILI ---
+        self.profile_list = normalize_profiles(config.get("profiles", []))
+        self.profiles = {}
+        for data in self.profile_list:
+            name = data.get("profile_name", "Unknown")
+            self.profiles[name] = self._compile_profile(name, data)
+
+        # --- INDICI ---
+        self.profile_metrics = {name: p.metrics for name, p in self.profiles.items()}
+        metric_profiles = {}
+        for name, metrics in self.profile_metrics.items():
+            for metric in metrics:
+                metric_profiles.setdefault(metric, []).append(name)
+        self.metric_profiles = {m: tuple(names) for m, names in metric_profiles.items()}
+
+        # Dict grezzo { profilo: definizione } per le funzioni di utils che lavorano sui dict
+        self._profiles_raw = {name: p.raw for name, p in self.profiles.items()}
+        self._memo = {}
+
+        for issue in self.issues:
+            log.warning(f"Config QoS: {issue}")
+
+    def _compile_profile(self, name: str, data: dict) -> ProfileDef:
+        requirements = []
+        for req in data.get("required_conditions", []):
+            metric = req.get("metric")
+            if metric not in self.metrics:
+                self.issues.append(f"Profilo '{name}': requisito su metrica sconosciuta '{metric}'")
+            if req.get("operator") not in _KNOWN_OPERATORS:
+                self.issues.append(f"Profilo '{name}': operatore non supportato '{req.get('operator')}'")
+            threshold = _to_float(req.get("threshold"))
+            if threshold is None:
+                self.issues.append(f"Profilo '{name}': soglia non numerica per '{metric}'")
+            requirements.append(Requirement(metric, req.get("operator"), threshold))
+
+        weights = {}
+        for metric, info in data.get("scoring_weights", {}).items():
+            if metric not in self.metrics:
+                self.issues.append(f"Profilo '{name}': peso su metrica sconosciuta '{metric}'")
+            weight = _to_float(info.get("weight"))
+            if weight is None:
+                self.issues.append(f"Profilo '{name}': peso non numerico per '{metric}' (ignorato)")
+                continue
+            threshold = info.get("stability_threshold")
+            weights[metric] = ScoringWeight(
+                metric=metric,
+                weight=weight,
+                direction=info.get("direction", "minimize"),
+                stability_threshold=_to_float(threshold) if threshold is not None else None,
+            )
+
+        return ProfileDef(
+            name=name,
+            description=data.get("description", ""),
+            required_conditions=tuple(requirements),
+            scoring_weights=weights,
+            raw=data,
+        )
+
+    def _cached(self, kind: str, profiles, compute):
+        key = (kind, tuple(profiles))
+        if key not in self._memo:
+            self._memo[key] = compute()
+        return self._memo[key]
+
+    # --- LOOKUP PER METRICA ---
+
+    def unit(self, metric: str) -> str:
+        definition = self.metrics.get(metric)
+        return definition.unit if definition else "raw"
+
+    def physical_threshold(self, metric: str, profiles: list) -> float:
+        """Soglia fisica (Delta) della metrica per la combinazione di profili attiva."""
+        definition = self.metrics.get(metric)
+        return get_physical_threshold(metric, definition.raw if definition else {},
+                                      self.strictest_thresholds(profiles))
+
+    # --- INDICI PER COMBINAZIONE DI PROFILI ---
+
+    def known_profiles(self, profiles: list) -> list:
+        return [p for p in profiles if p in self.profiles]
+
+    def select(self, profiles: list | None) -> list:
+        """Definizioni normalizzate dei profili indicati (tutti se None o se nessuno è noto)."""
+        if profiles:
+            selected = [self.profiles[p].raw for p in profiles if p in self.profiles]
+            if selected:
+                return selected
+        return self.profile_list
+
+    def compiled_profiles(self, profiles: list | None = None) -> CompiledProfiles:
+        """Requisiti compilati per il valutatore vettoriale (memoizzati per combinazione)."""
+        selected = self.select(profiles)
+        names = [p.get("profile_name") for p in selected]
+        return self._cached("compiled", names, lambda: CompiledProfiles(selected))
+
+    def required_metrics(self, profiles: list) -> list:
+        """Metriche referenziate dai profili, nell'ordine del config."""
+        def compute():
+            referenced = set().union(*(self.profile_metrics[p] for p in self.known_profiles(profiles)))
+            return [m for m in self.metrics if m in referenced]
+        return self._cached("required", profiles, compute)
+
+    def weighted_metrics(self, profiles: list) -> list:
+        """Metriche con peso di scoring nei profili, nell'ordine del config."""
+        def compute():
+            referenced = set()
+            for p in self.known_profiles(profiles):
+                referenced.update(self.profiles[p].scoring_weights)
+            return [m for m in self.metrics if m in referenced]
+        return self._cached("weighted", profiles, compute)
+
+    def strictest_thresholds(self, profiles: list) -> dict:
+        """Soglie di stabilità più restrittive tra i profili (Principio di Cautela)."""
+        return self._cached("strictest", profiles,
+                            lambda: get_strictest_threshold_config(list(profiles), self._profiles_raw))
+
+    def mixed_weights(self, profiles: list) -> dict:
+        """
+        Pesi di scoring dei profili combinati (per metrica vince il peso più alto) e normalizzati a somma 1.
+        { metrica: {"weight": float, "direction": str, "stability_threshold": float | None} }
+        """
+        def compute():
+            active = {}
+            for p in self.known_profiles(profiles):
+                for metric, info in self.profiles[p].scoring_weights.items():
+                    if metric not in active or info.weight > active[metric].weight:
+                        active[metric] = info
+
+            total = sum(info.weight for info in active.values())
+            return {
+                metric: {
+                    "weight": info.weight / total if total > 0 else info.weight,
+                    "direction": info.direction,
+                    "stability_threshold": info.stability_threshold,
+                }
+                for metric, info in active.items()
+            }
+        return self._cached("weights", profiles, compute)
+
+
+def config_digest(config: dict) -> str:
+    """Hash del contenuto del config (per i config che non arrivano dal QoSConfigCache)."""
+    return hashlib.sha256(json.dumps(config, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# Modelli compilati, indicizzati per hash del contenuto del config (lo SHA-256 calcolato dal
+# QoSConfigCache, propagato nello stato come qos_config_digest), con eviction LRU
+_compiled_models = OrderedDict()
+_MAX_COMPILED_MODELS = 4
+
+# Config vuoto (stato senza config): una sola istanza, compilata una volta
+_EMPTY_CONFIG = {}
+_EMPTY_DIGEST = config_digest(_EMPTY_CONFIG)
+
+
+def compile_qos_config(config: dict, digest: str | None = None) -> QoSModel:
+    """Compila il config QoS (una sola volta per versione del config, identificata dal suo hash)."""
+    digest = digest or config_digest(config)
+    model = _compiled_models.get(digest)
+    if model is not None:
+        _compiled_models.move_to_end(digest)
+        return model
+
+    model = QoSModel(config)
+    _compiled_models[digest] = model
+    while len(_compiled_models) > _MAX_COMPILED_MODELS:
+        _compiled_models.popitem(last=False)
+    log.info(f"Config QoS compilata: {len(model.metrics)} metriche, {len(model.profiles)} profili, "
+             f"{len(model.issues)} problemi di validazione.")
+    return model
+
+
+def qos_model(state) -> QoSModel:
+    """Modello compilato del config QoS presente nello stato."""
+    config = state.get("qos_config")
+    if not config:
+        return compile_qos_config(_EMPTY_CONFIG, _EMPTY_DIGEST)
+    return compile_qos_config(config, state.get("qos_config_digest"))
@@ -0,0 +1,131 @@
+import re
+import time
+import asyncio
+from collections import OrderedDict
+
+from src.logger import log
+
+
+# Stringhe PromQL (da preservare durante la normalizzazione degli spazi)
+_STRING_LITERAL = re.compile(r'("(?:\\.|[^"\\])*"|\'(?:\\.|[^\'\\])*\'|`[^`]*`)')
+
+
+def normalize_query(query: str) -> str:
+    """Chiave di cache: spazi compattati fuori dalle stringhe, nessuno spazio ai bordi."""
+    parts = _STRING_LITERAL.split(query.strip())
+    # Gli indici dispari sono i letterali stringa catturati dallo split
+    return "".join(p if i % 2 else " ".join(p.split()) for i, p in enumerate(parts))
+
+
+class QueryCache:
+    """
+    Cache dei risultati delle query PromQL istantanee.
+    1. Chiave: stringa PromQL normalizzata.
+    2. Scadenza allineata all'intervallo di scrape: tutte le richieste nella stessa finestra
+       condividono il risultato, alla finestra successiva (nuovi dati) si rifà la query.
+    3. Eviction LRU oltre `max_entries`.
+    4. Coalescing (singleflight): query identiche in volo nello stesso momento producono UNA sola chiamata MCP.
+    """
+
+    def __init__(self, scrape_interval: float = 15.0, max_entries: int = 512):
+        self.scrape_interval = scrape_interval
+        self.max_entries = max_entries
+
+        self._entries = OrderedDict()   # { chiave: (scadenza_epoch, risultato) }
+        self._inflight = {}             # { chiave: Future del leader }
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def _expiry(self, now: float) -> float:
+        # Fine della finestra di scrape corrente
+        return (now // self.scrape_interval + 1) * self.scrape_interval
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, result = entry
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _store(self, key: str, result):
+        self._entries[key] = (self._expiry(time.time()), result)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def get_or_fetch(self, query: str, fetch):
+        """
+        Restituisce il risultato in cache oppure esegue `fetch()` (coroutine factory).
+        Le eccezioni non vengono messe in cache ma vengono propagate a tutti i chiamanti coalescati;
+        se invece viene cancellato il leader, i chiamanti in attesa riprovano (uno di loro diventa leader).
+        """
+        if self.scrape_interval <= 0:
+            return await fetch()
+
+        key = normalize_query(query)
+
+        while True:
+            entry = self._lookup(key)
+            if entry is not None:
+                self.hits += 1
+                return entry[1]
+
+            inflight = self._inflight.get(key)
+            if inflight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(inflight)
+            except asyncio.CancelledError:
+                # Cancellato il leader, non questo chiamante: si riprova e il primo in coda diventa il nuovo leader
+                if inflight.cancelled() and not asyncio.current_task().cancelling():
+                    self.coalesced -= 1
+                    continue
+                raise
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # Evita il warning "exception never retrieved" se nessuno era in attesa
+            future.exception()
+            raise
+        else:
+            self._store(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "evictions": self.evictions,
+            "entries": len(self._entries),
+            "hit_ratio": ((self.hits + self.coalesced) / lookups) if lookups else 0.0,
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        log.info(f"Query cache: hit {s['hits']} | miss {s['misses']} | coalesced {s['coalesced']} | "
+                 f"evictions {s['evictions']} | entries {s['entries']} | hit ratio {s['hit_ratio']:.0%}")
+
+    def clear(self):
+        self._entries.clear()
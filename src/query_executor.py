@@ -0,0 +1,164 @@
+import time
+import random
+import asyncio
+from collections import deque
+
+from src.config import (mcp_session, query_cache, PROMQL_MAX_CONCURRENCY, PROMQL_QUERY_TIMEOUT_S,
+                        PROMQL_RETRIES, PROMQL_RETRY_BACKOFF_S, PROMQL_HEDGE, PROMQL_HEDGE_PERCENTILE)
+from src.mcp_session import is_transport_error
+from src.logger import log
+
+
+class QueryExecutor:
+    """
+    Esecutore delle query PromQL verso il server MCP.
+    1. Concorrenza limitata da un semaforo (niente flood del server con config grandi).
+    2. Deadline per singola query (asyncio.wait_for).
+    3. Retry con backoff esponenziale + jitter solo sugli errori transitori (trasporto, timeout):
+       gli errori deterministici (es. PromQL non valida) falliscono subito.
+    4. Hedging opzionale: se una query supera il percentile di latenza osservato, parte un duplicato
+       e vince la prima risposta.
+    """
+
+    def __init__(self, call, range_call=None, max_concurrency: int = 8, timeout: float = 10.0, retries: int = 2,
+                 backoff: float = 0.2, hedge: bool = False, hedge_percentile: float = 95.0,
+                 hedge_min_samples: int = 20):
+        self.call = call                      # Coroutine factory: call(query) -> risultato grezzo del tool
+        self.range_call = range_call          # Coroutine factory: range_call(query, start, end, step)
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.hedge = hedge
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_samples = hedge_min_samples
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._latencies = deque(maxlen=200)   # Finestra mobile delle latenze (s) delle query riuscite
+
+        self.timeouts = 0
+        self.retried = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.failures = 0
+
+    def _hedge_delay(self) -> float | None:
+        """Latenza al percentile configurato, oppure None se i campioni sono ancora pochi."""
+        if not self.hedge or len(self._latencies) < self.hedge_min_samples:
+            return None
+        ordered = sorted(self._latencies)
+        idx = min(len(ordered) - 1, int(len(ordered) * self.hedge_percentile / 100))
+        return ordered[idx]
+
+    async def _attempt(self, query: str, call):
+        async with self._semaphore:
+            start = time.perf_counter()
+            try:
+                result = await asyncio.wait_for(call(), timeout=self.timeout)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                raise TimeoutError(f"Timeout ({self.timeout}s) per la query: {query[:80]}")
+            self._latencies.append(time.perf_counter() - start)
+            return result
+
+    async def _attempt_hedged(self, query: str, call):
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return await self._attempt(query, call)
+
+        primary = asyncio.create_task(self._attempt(query, call))
+        secondary = None
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=hedge_delay)
+            if done:
+                return primary.result()
+
+            # Straggler: lanciamo un duplicato, vince la prima risposta valida
+            self.hedged += 1
+            secondary = asyncio.create_task(self._attempt(query, call))
+            pending = {primary, secondary}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is secondary:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            # Anche se il chiamante viene cancellato: nessun task resta appeso
+            for task in (primary, secondary):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    async def _run(self, query: str, call):
+        for attempt in range(self.retries + 1):
+            try:
+                return await self._attempt_hedged(query, call)
+            except Exception as e:
+                if not (isinstance(e, TimeoutError) or is_transport_error(e)):
+                    # Errore deterministico (query errata, tool assente): riprovare non serve
+                    self.failures += 1
+                    raise
+                if attempt == self.retries:
+                    self.failures += 1
+                    raise
+                self.retried += 1
+                delay = self.backoff * (2 ** attempt) * (1 + random.random())
+                log.warning(f"Query fallita ({e}). Retry {attempt + 1}/{self.retries} tra {delay:.2f}s.")
+                await asyncio.sleep(delay)
+
+    async def execute(self, query: str):
+        """Esegue la query passando prima dalla cache (con coalescing delle richieste identiche)."""
+        return await query_cache.get_or_fetch(query, lambda: self._run(query, lambda: self.call(query)))
+
+    async def execute_range(self, query: str, start: str, end: str, step: str):
+        """Range query: stessa pipeline, chiave di cache estesa con la finestra temporale."""
+        key = f"{query} @range[{start}, {end}, {step}]"
+        return await query_cache.get_or_fetch(
+            key, lambda: self._run(query, lambda: self.range_call(query, start, end, step))
+        )
+
+    def stats(self) -> dict:
+        return {
+            "timeouts": self.timeouts,
+            "retried": self.retried,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "failures": self.failures,
+            "hedge_delay": self._hedge_delay(),
+        }
+
+    def log_stats(self):
+        s = self.stats()
+        log.info(f"Query executor: timeout {s['timeouts']} | retry {s['retried']} | hedged {s['hedged']} "
+                 f"(vinti {s['hedge_wins']}) | falliti {s['failures']}")
+        query_cache.log_stats()
+
+
+query_executor = QueryExecutor(
+    lambda query: mcp_session.call_tool("execute_query", {"query": query}),
+    range_call=lambda query, start, end, step: mcp_session.call_tool(
+        "execute_range_query", {"query": query, "start": start, "end": end, "step": step}
+    ),
+    max_concurrency=PROMQL_MAX_CONCURRENCY,
+    timeout=PROMQL_QUERY_TIMEOUT_S,
+    retries=PROMQL_RETRIES,
+    backoff=PROMQL_RETRY_BACKOFF_S,
+    hedge=PROMQL_HEDGE,
+    hedge_percentile=PROMQL_HEDGE_PERCENTILE
+)
+
+
+async def execute_promql(query: str):
+    """
+    Punto di ingresso unico per le query PromQL istantanee dei nodi:
+    cache TTL + coalescing, poi semaforo, deadline, retry e hedging.
+    """
+    return await query_executor.execute(query)
+
+
+async def execute_promql_range(query: str, start: str, end: str, step: str):
+    """Punto di ingresso unico per le range query PromQL (stessa pipeline delle query istantanee)."""
+    return await query_executor.execute_range(query, start, end, step)
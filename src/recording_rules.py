@@ -0,0 +1,197 @@
+import os
+import re
+import sys
+import time
+import json
+import argparse
+
+import yaml
+
+from src.promql import is_batchable, parse_duration, format_duration
+from src.logger import log
+
+
+# Prefisso delle serie registrate (convenzione Prometheus level:metric:operations)
+RECORD_PREFIX = "qos"
+WINDOW_FUNCTIONS = ("avg", "stddev")
+
+_INVALID_NAME_CHARS = re.compile(r"[^a-zA-Z0-9_]")
+# Statistica di finestra su una serie registrata: avg_over_time(qos:cpu[1h])
+_WINDOW_RULE = re.compile(r"^(avg|stddev)_over_time\(\s*([a-zA-Z_:][a-zA-Z0-9_:]*)\s*\[(\w+)\]\s*\)$")
+
+
+def _normalize(query: str) -> str:
+    """Forma canonica di una query per il confronto (spazi compattati)."""
+    return " ".join(query.split())
+
+
+def record_name(metric: str, func: str | None = None, window_s: int | None = None) -> str:
+    """Nome della serie registrata: qos:<metrica> oppure qos:<metrica>:<func>_<finestra>."""
+    name = f"{RECORD_PREFIX}:{_INVALID_NAME_CHARS.sub('_', metric)}"
+    if func:
+        name += f":{func}_{format_duration(window_s)}"
+    return name
+
+
+def build_recording_rules(config: dict, windows_s: list, interval: str | None = None,
+                          stability_interval: str | None = None) -> dict:
+    """
+    Recording rules per il config QoS:
+    - gruppo "qos-agent-metrics": una serie qos:<metrica> per ogni query del config
+    - gruppo "qos-agent-stability": avg/stddev per finestra, calcolati sulle serie registrate
+      (la query originale viene valutata una sola volta per intervallo, non per finestra)
+    Le query che restituiscono uno scalare non sono registrabili e vengono saltate.
+    """
+    metric_rules, stability_rules = [], []
+    for metric, definition in (config.get("metrics") or {}).items():
+        query = (definition or {}).get("query") if isinstance(definition, dict) else None
+        if not query or not is_batchable(query):
+            log.info(f"Recording rules: metrica '{metric}' saltata (query assente o scalare).")
+            continue
+        base = record_name(metric)
+        metric_rules.append({"record": base, "expr": _normalize(query)})
+        for window_s in windows_s:
+            for func in WINDOW_FUNCTIONS:
+                stability_rules.append({
+                    "record": record_name(metric, func, window_s),
+                    "expr": f"{func}_over_time({base}[{format_duration(window_s)}])",
+                })
+
+    groups = []
+    for name, rules, group_interval in (("qos-agent-metrics", metric_rules, interval),
+                                        ("qos-agent-stability", stability_rules, stability_interval)):
+        if not rules:
+            continue
+        group = {"name": name}
+        if group_interval:
+            group["interval"] = group_interval
+        group["rules"] = rules
+        groups.append(group)
+    return {"groups": groups}
+
+
+def render_rules_yaml(rules: dict) -> str:
+    return yaml.safe_dump(rules, sort_keys=False, allow_unicode=True, width=1000)
+
+
+class RecordingRules:
+    """
+    Indice delle recording rules disponibili (file YAML in formato Prometheus):
+    - espressione normalizzata -> serie registrata
+    - (espressione, funzione, finestra) -> serie registrata con la statistica di finestra
+    Permette di riscrivere in modo trasparente le query dell'agente sulle serie precalcolate.
+    """
+
+    def __init__(self, groups: list | None = None, recheck_s: float = 300.0):
+        self.records = {}   # { espressione normalizzata: nome serie registrata }
+        self.windows = {}   # { (espressione normalizzata, func, finestra_s): nome serie registrata }
+        # Serie presenti nel file ma trovate vuote su Prometheus (regole non caricate o finestra non ancora piena):
+        # { nome serie: istante monotonic della marcatura }, riprovate dopo recheck_s secondi
+        self.unavailable = {}
+        self.recheck_s = recheck_s
+
+        rules = [rule for group in (groups or []) for rule in group.get("rules", []) if rule.get("record")]
+        for rule in rules:
+            self.records.setdefault(_normalize(str(rule.get("expr", ""))), rule["record"])
+
+        # Le statistiche di finestra si riferiscono a una serie registrata: risaliamo alla sua espressione
+        expr_of = {record: expr for expr, record in self.records.items()}
+        for rule in rules:
+            match = _WINDOW_RULE.match(_normalize(str(rule.get("expr", ""))))
+            if not match or match.group(2) not in expr_of:
+                continue
+            func, base, window = match.groups()
+            try:
+                window_s = parse_duration(window)
+            except ValueError:
+                continue
+            self.windows[(expr_of[base], func, window_s)] = rule["record"]
+
+    @classmethod
+    def load(cls, path: str, recheck_s: float = 300.0) -> "RecordingRules":
+        """Carica un file di recording rules (indice vuoto se il file manca o non è valido)."""
+        if not path:
+            return cls(recheck_s=recheck_s)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                data = yaml.safe_load(f) or {}
+        except (OSError, yaml.YAMLError) as e:
+            log.warning(f"Recording rules non caricate da {path}: {e}")
+            return cls(recheck_s=recheck_s)
+        rules = cls(data.get("groups", []), recheck_s=recheck_s)
+        log.info(f"Recording rules caricate da {path}: {len(rules.records)} serie, "
+                 f"{len(rules.windows)} statistiche di finestra.")
+        return rules
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __bool__(self) -> bool:
+        return bool(self.records)
+
+    def record_for(self, query: str) -> str | None:
+        return self.records.get(_normalize(query))
+
+    def window_record(self, query: str, func: str, window_s: int) -> str | None:
+        """Serie registrata con avg/stddev della query sulla finestra indicata (None se assente o non servita)."""
+        record = self.windows.get((_normalize(query), func, window_s))
+        return record if record and self._available(record) else None
+
+    def rewrite(self, query: str) -> str:
+        """
+        Sostituisce la query della metrica con la serie registrata qos:<metrica>, se esiste
+        (e Prometheus la serve). Le query senza corrispondenza restano invariate.
+        """
+        record = self.record_for(query) if self.records else None
+        return record if record and self._available(record) else query
+
+    def _available(self, record: str) -> bool:
+        marked_at = self.unavailable.get(record)
+        if marked_at is None:
+            return True
+        if time.monotonic() - marked_at >= self.recheck_s:
+            # Scaduta la marcatura: si riprova la serie registrata (le regole potrebbero essere ora servite)
+            del self.unavailable[record]
+            log.info(f"Serie registrata '{record}': nuovo tentativo dopo {self.recheck_s:.0f}s.")
+            return True
+        return False
+
+    def mark_unavailable(self, record: str):
+        """
+        Serie registrata senza dati su Prometheus: per `recheck_s` secondi le query tornano a quella originale,
+        poi la serie viene riprovata (il rewrite si riprende senza riavvio quando le regole producono dati).
+        """
+        if record not in self.unavailable:
+            log.warning(f"Serie registrata '{record}' senza dati su Prometheus: ripiego sulle query originali "
+                        f"per {self.recheck_s:.0f}s.")
+        self.unavailable[record] = time.monotonic()
+
+
+def main(argv: list | None = None) -> int:
+    """Genera le recording rules dal config QoS: python -m src.recording_rules --config <json> [--out <yaml>]"""
+    parser = argparse.ArgumentParser(description="Genera le recording rules Prometheus dal config QoS.")
+    parser.add_argument("--config", default=os.getenv("QOS_CONFIG_FALLBACK_PATH", "qos_config.cache.json"),
+                        help="File JSON del config QoS (default: copia locale del config)")
+    parser.add_argument("--out", default="-", help="File YAML di destinazione (default: stdout)")
+    parser.add_argument("--windows", default=os.getenv("STABILITY_WINDOWS", "1h,24h,7d"),
+                        help="Finestre di stabilità, es. 1h,24h,7d")
+    parser.add_argument("--interval", default=None, help="Intervallo di valutazione delle serie delle metriche")
+    parser.add_argument("--stability-interval", default="1m", help="Intervallo di valutazione delle statistiche di finestra")
+    args = parser.parse_args(argv)
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = json.load(f)
+    windows_s = sorted(parse_duration(w) for w in args.windows.split(",") if w.strip())
+    text = render_rules_yaml(build_recording_rules(config, windows_s, args.interval, args.stability_interval))
+
+    if args.out == "-":
+        sys.stdout.write(text)
+    else:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text)
+        print(f"Recording rules scritte in {args.out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -66,3 +66,27 @@ class TaskProfileIntent(BaseModel):
     reasoning: str = Field(
         description="Breve spiegazione tecnica del perché questi profili si applicano al task descritto."
     )
+
+
+class RequestUnderstanding(BaseModel):
+    """
+    Comprensione completa della richiesta in un'unica chiamata strutturata:
+    intento, nodo target, profili di carico e vincoli espliciti.
+    """
+    intent: Literal["allocation", "status"]
+    target_filter: Optional[str] = Field(
+        default=None,
+        description="Il nome del server specifico se menzionato, altrimenti None."
+    )
+    selected_profiles: List[str] = Field(
+        default=[],
+        description="Solo per 'allocation': nomi dei profili (es. ['cpu-bound', 'disk-bound']). Seleziona TUTTI quelli rilevanti."
+    )
+    reasoning: str = Field(
+        default="",
+        description="Breve spiegazione tecnica del perché questi profili si applicano al task descritto."
+    )
+    constraints: List[Optional[UserConstraint]] = Field(
+        default=[],
+        description="Solo per 'allocation': vincoli numerici espliciti estratti dall'input utente."
+    )
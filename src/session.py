@@ -0,0 +1,72 @@
+import time
+
+from src.logger import log
+
+
+class SessionStore:
+    """
+    Stato di sessione condiviso tra i turni (equivalente leggero di un checkpointer LangGraph).
+    Conserva active_targets, qos_config e l'ultimo metrics_report con un TTL di freschezza ciascuno:
+    il turno successivo riceve solo i campi ancora freschi, e il grafo salta gli stadi che li producono.
+    Per metrics_report il TTL vale per colonna (istante di download di ogni metrica), così le colonne
+    vecchie unite a uno snapshot più recente scadono comunque e vengono riscaricate.
+    """
+
+    def __init__(self, targets_ttl: float = 60.0, config_ttl: float = 300.0, metrics_ttl: float = 15.0):
+        self.ttls = {
+            "active_targets": targets_ttl,
+            "qos_config": config_ttl,
+            "metrics_report": metrics_ttl,
+        }
+        self._values = {}        # { "active_targets": [...], "qos_config": {...}, ... }
+        self._updated_at = {}    # { campo: timestamp monotonic dell'ultimo aggiornamento }
+
+    def _set(self, key: str, value):
+        self._values[key] = value
+        self._updated_at[key] = time.monotonic()
+
+    def is_fresh(self, key: str) -> bool:
+        if key not in self._values:
+            return False
+        return (time.monotonic() - self._updated_at[key]) < self.ttls[key]
+
+    def record(self, node_name: str, update: dict | None):
+        """Registra l'output di un nodo del grafo (da chiamare nel loop di streaming)."""
+        if not update:
+            return
+
+        if node_name == "context" and update.get("sanity_check_ok"):
+            self._set("active_targets", update.get("active_targets", []))
+            self._set("qos_config", update.get("qos_config", {}))
+            # L'hash del config viaggia insieme al config (chiave del modello compilato)
+            self._values["qos_config_digest"] = update.get("qos_config_digest")
+
+        elif node_name == "metrics_engine" and update.get("metrics_report"):
+            self._set("metrics_report", update["metrics_report"])
+            # Il perimetro (cluster intero o singolo nodo) viene salvato insieme allo snapshot
+            self._values["metrics_scope"] = update.get("metrics_scope")
+
+    def seed(self) -> dict:
+        """Restituisce i campi ancora freschi da iniettare nello stato iniziale del turno."""
+        seeded = {}
+
+        # Target e config vengono prodotti insieme dal nodo 'context': riusabili solo se entrambi freschi
+        if self.is_fresh("active_targets") and self.is_fresh("qos_config"):
+            seeded["active_targets"] = self._values["active_targets"]
+            seeded["qos_config"] = self._values["qos_config"]
+            seeded["qos_config_digest"] = self._values.get("qos_config_digest")
+
+            # Lo snapshot metriche ha senso solo sopra un contesto valido: passano solo le colonne fresche
+            snapshot = self._values.get("metrics_report")
+            fresh = snapshot.fresh_metrics(self.ttls["metrics_report"]) if snapshot is not None else []
+            if fresh:
+                seeded["metrics_report"] = snapshot if len(fresh) == len(snapshot.metrics) else snapshot.select(fresh)
+                seeded["metrics_scope"] = self._values.get("metrics_scope")
+
+        if seeded:
+            log.info(f"Sessione: riuso dello stato fresco {sorted(seeded.keys())}")
+        return seeded
+
+    def clear(self):
+        self._values.clear()
+        self._updated_at.clear()
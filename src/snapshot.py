@@ -0,0 +1,159 @@
+import json
+import math
+import time
+from array import array
+import numpy as np
+
+
+class MetricsSnapshot:
+    """
+    Snapshot colonnare delle metriche del cluster, passato tra i nodi del grafo senza serializzazione.
+    - nodes / metrics: assi della matrice (con indici nome -> posizione)
+    - values: matrice densa float64 (nodi x metriche), NaN dove il dato manca
+    - fetched_at: istante (time.monotonic) in cui ogni colonna è stata scaricata, per il TTL per-metrica
+    La conversione in dict/JSON avviene solo ai bordi (log, tabelle, prompt LLM).
+    """
+
+    __slots__ = ("nodes", "metrics", "node_index", "metric_index", "values", "fetched_at")
+
+    def __init__(self, nodes: list, metrics: list, values: np.ndarray, fetched_at: np.ndarray | None = None):
+        self.nodes = list(nodes)
+        self.metrics = list(metrics)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+        self.values = values
+        self.fetched_at = fetched_at if fetched_at is not None else np.full(len(self.metrics), time.monotonic())
+
+    # --- COSTRUZIONE ---
+
+    @classmethod
+    def empty(cls, metrics: list | None = None) -> "MetricsSnapshot":
+        metrics = metrics or []
+        return cls([], metrics, np.full((0, len(metrics)), np.nan))
+
+    # --- ACCESSO ---
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __bool__(self) -> bool:
+        return len(self.nodes) > 0
+
+    def __contains__(self, node) -> bool:
+        return node in self.node_index
+
+    def get(self, node: str, metric: str, default=None):
+        """Valore (float) della metrica per il nodo, oppure `default` se mancante."""
+        i = self.node_index.get(node)
+        j = self.metric_index.get(metric)
+        if i is None or j is None:
+            return default
+        value = self.values[i, j]
+        return default if math.isnan(value) else float(value)
+
+    def column(self, metric: str) -> np.ndarray:
+        """Vista della colonna (tutti i nodi) per la metrica; NaN se la metrica non è presente."""
+        j = self.metric_index.get(metric)
+        if j is None:
+            return np.full(len(self.nodes), np.nan)
+        return self.values[:, j]
+
+    def node_metrics(self, node: str) -> dict:
+        """{ metrica: valore } per un nodo, esclusi i valori mancanti."""
+        i = self.node_index.get(node)
+        if i is None:
+            return {}
+        row = self.values[i]
+        return {m: float(row[j]) for j, m in enumerate(self.metrics) if not math.isnan(row[j])}
+
+    def subset(self, nodes: list) -> "MetricsSnapshot":
+        """Snapshot ristretto ai nodi indicati (nell'ordine dato, ignorando quelli assenti)."""
+        kept = [n for n in nodes if n in self.node_index]
+        rows = [self.node_index[n] for n in kept]
+        return MetricsSnapshot(kept, self.metrics, self.values[rows, :], self.fetched_at)
+
+    def select(self, metrics: list) -> "MetricsSnapshot":
+        """Snapshot ristretto alle metriche indicate (nell'ordine dato, ignorando quelle assenti)."""
+        kept = [m for m in metrics if m in self.metric_index]
+        cols = [self.metric_index[m] for m in kept]
+        return MetricsSnapshot(self.nodes, kept, self.values[:, cols], self.fetched_at[cols])
+
+    def fresh_metrics(self, ttl: float, now: float | None = None) -> list:
+        """Metriche scaricate da meno di `ttl` secondi."""
+        now = time.monotonic() if now is None else now
+        return [m for m, fetched in zip(self.metrics, self.fetched_at) if now - fetched < ttl]
+
+    def merge(self, other: "MetricsSnapshot") -> "MetricsSnapshot":
+        """Unione di due snapshot: i valori presenti in `other` sovrascrivono quelli di self."""
+        nodes = self.nodes + [n for n in other.nodes if n not in self.node_index]
+        metrics = self.metrics + [m for m in other.metrics if m not in self.metric_index]
+
+        values = np.full((len(nodes), len(metrics)), np.nan)
+        values[:len(self.nodes), :len(self.metrics)] = self.values
+
+        fetched_at = np.concatenate([self.fetched_at, np.zeros(len(metrics) - len(self.metrics))])
+        merged = MetricsSnapshot(nodes, metrics, values, fetched_at)
+        # Le colonne scaricate di nuovo prendono l'istante di `other`; le altre conservano il proprio
+        fetched_at[[merged.metric_index[m] for m in other.metrics]] = other.fetched_at
+        if other.values.size:
+            rows = [merged.node_index[n] for n in other.nodes]
+            cols = [merged.metric_index[m] for m in other.metrics]
+            block = values[np.ix_(rows, cols)]
+            present = ~np.isnan(other.values)
+            block[present] = other.values[present]
+            values[np.ix_(rows, cols)] = block
+        return merged
+
+    # --- SERIALIZZAZIONE (solo ai bordi) ---
+
+    def to_dict(self) -> dict:
+        """Formato { nodo: { metrica: valore } } per tabelle e prompt."""
+        return {node: self.node_metrics(node) for node in self.nodes}
+
+    def to_json(self, indent: int | None = None) -> str:
+        return json.dumps(self.to_dict(), indent=indent)
+
+    def __repr__(self) -> str:
+        return f"MetricsSnapshot(nodes={len(self.nodes)}, metrics={len(self.metrics)})"
+
+
+class SnapshotBuilder:
+    """
+    Accumulatore usato dal decoder: riceve le triple (metrica, nodo, valore) man mano che
+    le risposte arrivano e le scrive nella matrice colonnare in un'unica assegnazione vettoriale.
+    """
+
+    def __init__(self, metrics: list, node_filter: str | None = None, decimals: int | None = 3):
+        self.metrics = list(metrics)
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+        self.node_filter = node_filter
+        self.decimals = decimals
+
+        self.node_index = {}
+        self._rows = array("q")
+        self._cols = array("q")
+        self._vals = array("d")
+
+    def add(self, metric: str, node: str, value: float):
+        if self.node_filter and node != self.node_filter:
+            return
+        j = self.metric_index.get(metric)
+        if j is None:
+            return
+        i = self.node_index.setdefault(node, len(self.node_index))
+        self._rows.append(i)
+        self._cols.append(j)
+        self._vals.append(value)
+
+    def filled_metrics(self) -> set:
+        """Metriche per cui è arrivata almeno una serie."""
+        return {self.metrics[j] for j in set(self._cols)}
+
+    def build(self) -> MetricsSnapshot:
+        values = np.full((len(self.node_index), len(self.metrics)), np.nan)
+        if len(self._vals):
+            vals = np.frombuffer(self._vals, dtype=np.float64)
+            if self.decimals is not None:
+                vals = np.round(vals, self.decimals)
+            values[np.frombuffer(self._rows, dtype=np.int64), np.frombuffer(self._cols, dtype=np.int64)] = vals
+        return MetricsSnapshot(list(self.node_index.keys()), self.metrics, values)
@@ -0,0 +1,159 @@
+import numpy as np
+
+
+# Codici compatti dello stato di stabilità (int8), nell'ordine di gravità
+ABSENT, UNKNOWN, STABLE, FALSE_ALARM, SPIKE, CHAOTIC = range(6)
+STATUS_NAMES = {
+    UNKNOWN: "UNKNOWN",
+    STABLE: "STABLE",
+    FALSE_ALARM: "FALSE_ALARM",
+    SPIKE: "SPIKE",
+    CHAOTIC: "CHAOTIC",
+}
+RISKY = (SPIKE, CHAOTIC)
+
+# Costanti di sistema
+Z_THRESHOLD = 2.0           # Oltre questo z-score lo scostamento dalla media storica è un picco
+CV_CHAOS_THRESHOLD = 0.3    # Oltre questo CV (std / media) l'utilizzo è erratico (instabilità cronica)
+Z_NO_VARIANCE = 999.9   # z-score convenzionale quando lo storico è piatto ma il valore corrente se ne discosta
+
+
+def classify_stability_matrix(current: np.ndarray, avg: np.ndarray, std: np.ndarray,
+                              delta_threshold: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Classificazione della stabilità su matrici nodi x metriche
+    (o tensori finestre x nodi x metriche, con broadcasting).
+    - z = |corrente - media| / std (Z_NO_VARIANCE se lo storico è piatto ma il valore se ne discosta)
+    - CV = std / media, azzerato sotto la soglia fisica (fluttuazioni relative senza significato)
+    - CHAOTIC se CV > CV_CHAOS_THRESHOLD; altrimenti, se z > Z_THRESHOLD, SPIKE quando lo scostamento
+      supera la soglia fisica e FALSE_ALARM quando no; STABLE in tutti gli altri casi
+    - delta_threshold: soglia fisica per metrica (broadcast sulle colonne)
+    Restituisce (codici int8, z-score, CV). NaN in current/avg = nessun dato (ABSENT),
+    NaN solo in std = UNKNOWN.
+    """
+    with np.errstate(divide="ignore", invalid="ignore"):
+        delta = np.abs(current - avg)
+        z = np.where(std > 0, delta / std, np.where(delta == 0, 0.0, Z_NO_VARIANCE))
+        # Sotto la soglia di rilevanza fisica le fluttuazioni relative (CV) non hanno significato
+        cv = np.where(avg < delta_threshold, 0.0, np.where(avg > 0, std / avg, 0.0))
+
+    codes = np.full(delta.shape, STABLE, dtype=np.int8)
+    is_spike = z > Z_THRESHOLD
+    codes[is_spike & (delta <= delta_threshold)] = FALSE_ALARM
+    codes[is_spike & (delta > delta_threshold)] = SPIKE
+    codes[cv > CV_CHAOS_THRESHOLD] = CHAOTIC     # Precedenza: l'instabilità cronica vince sul picco
+
+    codes[np.isnan(std)] = UNKNOWN
+    codes[np.isnan(current) | np.isnan(avg)] = ABSENT
+    return codes, z, cv
+
+
+class StabilityReport:
+    """
+    Report di stabilità compatto: codici di stato per nodi x metriche più z-score, CV e delta.
+    Con più finestre temporali conserva lo stato peggiore e la finestra che lo ha prodotto.
+    Le motivazioni testuali vengono generate solo su richiesta (prompt LLM, tabelle a console).
+    """
+
+    __slots__ = ("nodes", "metrics", "node_index", "metric_index", "codes", "z", "cv", "delta",
+                 "windows", "window_idx")
+
+    def __init__(self, nodes: list, metrics: list, codes: np.ndarray, z: np.ndarray, cv: np.ndarray,
+                 delta: np.ndarray, windows: list | None = None, window_idx: np.ndarray | None = None):
+        self.nodes = list(nodes)
+        self.metrics = list(metrics)
+        self.node_index = {n: i for i, n in enumerate(self.nodes)}
+        self.metric_index = {m: j for j, m in enumerate(self.metrics)}
+        self.codes = codes
+        self.z = z
+        self.cv = cv
+        self.delta = delta
+        self.windows = list(windows) if windows else []
+        self.window_idx = window_idx if window_idx is not None else np.zeros(codes.shape, dtype=np.int64)
+
+    @classmethod
+    def empty(cls) -> "StabilityReport":
+        shape = (0, 0)
+        return cls([], [], np.zeros(shape, dtype=np.int8), np.zeros(shape), np.zeros(shape), np.zeros(shape))
+
+    @classmethod
+    def build(cls, nodes: list, metrics: list, current: np.ndarray, avg: np.ndarray, std: np.ndarray,
+              delta_threshold: np.ndarray, windows: list | None = None) -> "StabilityReport":
+        """
+        current: nodi x metriche; avg/std: nodi x metriche oppure finestre x nodi x metriche.
+        Per ogni coppia nodo/metrica vince la finestra con lo stato più grave.
+        """
+        if avg.ndim == 2:
+            avg, std = avg[None], std[None]
+        codes, z, cv = classify_stability_matrix(current[None], avg, std, delta_threshold)
+        delta = np.abs(current[None] - avg)
+
+        # I codici sono ordinati per gravità: argmax = finestra peggiore (la prima a parità)
+        worst = codes.argmax(axis=0)
+
+        def pick(values):
+            return np.take_along_axis(values, worst[None], axis=0)[0]
+
+        return cls(nodes, metrics, pick(codes), pick(z), pick(cv), pick(delta), windows, worst)
+
+    def __bool__(self) -> bool:
+        return bool((self.codes != ABSENT).any()) if self.codes.size else False
+
+    def _code(self, node: str, metric: str) -> int:
+        i = self.node_index.get(node)
+        j = self.metric_index.get(metric)
+        if i is None or j is None:
+            return ABSENT
+        return int(self.codes[i, j])
+
+    def status(self, node: str, metric: str) -> str:
+        """Stato testuale (UNKNOWN se la coppia nodo/metrica non è stata analizzata)."""
+        return STATUS_NAMES.get(self._code(node, metric), "UNKNOWN")
+
+    def is_risky(self, node: str, metric: str) -> bool:
+        return self._code(node, metric) in RISKY
+
+    def risky_count(self) -> int:
+        return int(np.isin(self.codes, RISKY).sum())
+
+    def risky_items(self) -> list:
+        """[(nodo, metrica, stato)] per le coppie SPIKE/CHAOTIC."""
+        rows, cols = np.nonzero(np.isin(self.codes, RISKY))
+        return [(self.nodes[i], self.metrics[j], STATUS_NAMES[int(self.codes[i, j])]) for i, j in zip(rows, cols)]
+
+    def node_metrics(self, node: str) -> list:
+        """Metriche analizzate per il nodo (quelle con dati)."""
+        i = self.node_index.get(node)
+        if i is None:
+            return []
+        return [m for j, m in enumerate(self.metrics) if self.codes[i, j] != ABSENT]
+
+    def window(self, node: str, metric: str) -> str | None:
+        """Etichetta della finestra che ha determinato lo stato (None con finestra singola)."""
+        if len(self.windows) < 2 or self._code(node, metric) == ABSENT:
+            return None
+        return self.windows[int(self.window_idx[self.node_index[node], self.metric_index[metric]])]
+
+    def reason(self, node: str, metric: str) -> str:
+        """Motivazione leggibile dello stato (generata on demand)."""
+        window = self.window(node, metric)
+        text = self._reason_text(node, metric)
+        return f"[{window}] {text}" if window else text
+
+    def _reason_text(self, node: str, metric: str) -> str:
+        code = self._code(node, metric)
+        if code in (ABSENT, UNKNOWN):
+            return "No Data"
+        i, j = self.node_index[node], self.metric_index[metric]
+        if code == CHAOTIC:
+            return (f"Instabilità cronica: Il CV ({self.cv[i, j]:.2f}) è troppo alto, indicando un utilizzo "
+                    f"delle risorse erratico e imprevedibile. Rischio elevato di saturazione improvvisa.")
+        if code == SPIKE:
+            return (f"Picco di carico acuto: Rilevato un aumento improvviso (+{self.delta[i, j]:.2f}) che supera "
+                    f"la soglia di sicurezza. Nonostante lo storico calmo, il nodo è sotto stress immediato.")
+        if code == FALSE_ALARM:
+            return "Variazione statistica trascurabile"
+        return "Nella norma"
+
+    def __repr__(self) -> str:
+        return f"StabilityReport(nodes={len(self.nodes)}, metrics={len(self.metrics)}, risky={self.risky_count()})"
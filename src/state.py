@@ -3,6 +3,11 @@ from typing_extensions import Annotated
 import operator
 from langchain.messages import AnyMessage
 
+from src.snapshot import MetricsSnapshot
+from src.history import MetricsHistory
+from src.evaluation import ProfileEvaluation
+from src.stability import StabilityReport
+
 
 
 # --- DEFINIZIONE DELLO STATO DELL'AGENTE ---
@@ -16,15 +21,17 @@ class AgentState(TypedDict):
     sanity_check_ok: bool
 
     # Dati strutturati raccolti
-    metrics_report: str                                # Il risultato delle query in formato JSON strutturato
+    metrics_report: MetricsSnapshot                    # Snapshot colonnare delle metriche (nodi x metriche)
+    metrics_scope: None | str                          # Perimetro dello snapshot: None (cluster intero) o nome del nodo
+    metrics_history: None | MetricsHistory             # Storico a finestra (range query) con statistiche per nodo/metrica
     intent: Literal["allocation", "status"]            
 
     qos_config: dict            # <--- Qui salviamo il JSON scaricato dal Server MCP
+    qos_config_digest: None | str    # SHA-256 del contenuto del config (chiave del modello compilato)
     target_filter: None | str        # None (tutti) oppure "server-lpha" (singolo server)
 
-    # NUOVO: Accumulatore per i risultati dei singoli profili
-    # Annotated[list, operator.add] significa che ogni worker aggiunge il suo risultato alla lista
-    profile_results: Annotated[List[str], operator.add]
+    # Matrice profili x nodi di idoneità (valutazione vettoriale, audit generato su richiesta)
+    profile_evaluation: ProfileEvaluation
 
     # NUOVO: Lista dei profili target identificati per il task descritto dall'utente (es. ["cpu-bound", "memory-bound"])
     target_profiles: List[str] 
@@ -37,4 +44,4 @@ class AgentState(TypedDict):
     final_candidates: List[str]
 
     # NUOVO: Report statistico sulla stabilità dei nodi candidati
-    stability_report: dict
+    stability_report: StabilityReport   # Codici di stabilità compatti (nodi x metriche), motivazioni on demand
@@ -0,0 +1,125 @@
+import time
+import asyncio
+import statistics
+from langchain_core.messages import AIMessage
+from langgraph.config import get_stream_writer
+
+from src.logger import log
+
+
+def _writer():
+    """Writer dello stream 'custom' del grafo (no-op fuori da un'esecuzione LangGraph)."""
+    try:
+        return get_stream_writer()
+    except RuntimeError:
+        return lambda _: None
+
+
+def _chunk_text(chunk) -> str:
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    # Contenuto a blocchi (es. [{"type": "text", "text": ...}])
+    return "".join(part.get("text", "") if isinstance(part, dict) else str(part) for part in content or [])
+
+
+class StreamStats:
+    """Tempo al primo token (TTFT) e durata totale delle risposte in streaming, per nodo."""
+
+    def __init__(self, max_samples: int = 256):
+        self.max_samples = max_samples
+        self._ttft = {}     # { nodo: [secondi] }
+        self._total = {}
+
+    def record(self, node: str, ttft_s: float | None, total_s: float):
+        for samples, value in ((self._ttft, ttft_s), (self._total, total_s)):
+            if value is None:
+                continue
+            series = samples.setdefault(node, [])
+            series.append(value)
+            del series[:-self.max_samples]
+
+    def stats(self) -> dict:
+        # Tutti i nodi con una durata registrata: senza streaming (o senza token) il TTFT manca ma la durata no
+        result = {}
+        for node, total in self._total.items():
+            ttft = self._ttft.get(node, [])
+            result[node] = {
+                "responses": len(total),
+                "ttft_samples": len(ttft),
+                "ttft_avg_s": statistics.fmean(ttft) if ttft else 0.0,
+                "ttft_p50_s": statistics.median(ttft) if ttft else 0.0,
+                "ttft_max_s": max(ttft) if ttft else 0.0,
+                "total_avg_s": statistics.fmean(total) if total else 0.0,
+            }
+        return result
+
+    def log_stats(self):
+        for node, s in self.stats().items():
+            ttft = (f"TTFT medio {s['ttft_avg_s']:.2f}s (p50 {s['ttft_p50_s']:.2f}s, max {s['ttft_max_s']:.2f}s)"
+                    if s["ttft_samples"] else "TTFT n/d")
+            log.info(f"Streaming {node}: risposte {s['responses']} | {ttft} | durata media {s['total_avg_s']:.2f}s")
+
+
+async def stream_llm(llm, messages, node: str, stats: StreamStats | None = None, enabled: bool = True,
+                     writer=None) -> AIMessage:
+    """
+    Chiama l'LLM in streaming e inoltra ogni token sullo stream 'custom' del grafo
+    come {"node": nodo, "token": testo}, così il loop principale può renderizzare la risposta man mano.
+    `writer` sostituisce lo stream del grafo (es. risposte generate in background, fuori dal grafo).
+    Restituisce il messaggio completo (come llm.ainvoke) e registra il tempo al primo token.
+    """
+    start = time.perf_counter()
+    if not enabled:
+        response = await llm.ainvoke(messages)
+        if stats is not None:
+            stats.record(node, None, time.perf_counter() - start)
+        return response
+
+    write = writer or _writer()
+    parts = []
+    ttft = None
+    async for chunk in llm.astream(messages):
+        text = _chunk_text(chunk)
+        if not text:
+            continue
+        if ttft is None:
+            ttft = time.perf_counter() - start
+            log.info(f"Primo token da {node} dopo {ttft:.2f}s.")
+        parts.append(text)
+        write({"node": node, "token": text})
+
+    total = time.perf_counter() - start
+    if stats is not None:
+        stats.record(node, ttft, total)
+    return AIMessage(content="".join(parts))
+
+
+class BackgroundStream:
+    """
+    Risposta LLM generata in background, fuori dal grafo: chi ha avviato il grafo non la aspetta.
+    I token vengono accodati e possono essere letti in seguito con tokens(); result() restituisce il messaggio.
+    """
+
+    def __init__(self, node: str):
+        self.node = node
+        self.task = None
+        self._queue = asyncio.Queue()
+
+    def start(self, llm, messages, stats: StreamStats | None = None, enabled: bool = True) -> "BackgroundStream":
+        async def run():
+            try:
+                return await stream_llm(llm, messages, self.node, stats, enabled,
+                                        writer=lambda chunk: self._queue.put_nowait(chunk["token"]))
+            finally:
+                self._queue.put_nowait(None)    # Fine dello stream (anche in caso di errore)
+
+        self.task = asyncio.create_task(run())
+        return self
+
+    async def tokens(self):
+        while (token := await self._queue.get()) is not None:
+            yield token
+
+    async def result(self) -> AIMessage:
+        return await self.task
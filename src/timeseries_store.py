@@ -0,0 +1,205 @@
+import math
+import time
+import asyncio
+import numpy as np
+
+from src.logger import log
+
+
+class _Series:
+    """
+    Ring buffer di una singola serie (nodo, metrica) con statistiche incrementali:
+    - media/varianza della finestra con Welford (aggiunta del nuovo campione, rimozione del più vecchio)
+    - media/varianza EWMA per dare più peso ai campioni recenti
+    """
+
+    __slots__ = ("timestamps", "values", "head", "size", "mean", "m2", "ewma", "ewvar")
+
+    def __init__(self, capacity: int):
+        self.timestamps = np.empty(capacity, dtype=np.float64)
+        self.values = np.empty(capacity, dtype=np.float64)
+        self.head = 0       # Posizione del campione più vecchio
+        self.size = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.ewma = None
+        self.ewvar = 0.0
+
+    @property
+    def capacity(self) -> int:
+        return len(self.values)
+
+    @property
+    def oldest_ts(self) -> float:
+        return self.timestamps[self.head]
+
+    @property
+    def newest_ts(self) -> float:
+        return self.timestamps[(self.head + self.size - 1) % self.capacity]
+
+    def _pop_oldest(self):
+        x = self.values[self.head]
+        self.head = (self.head + 1) % self.capacity
+        self.size -= 1
+        if self.size == 0:
+            self.mean, self.m2 = 0.0, 0.0
+            return
+        delta = x - self.mean
+        self.mean -= delta / self.size
+        self.m2 = max(0.0, self.m2 - delta * (x - self.mean))
+
+    def push(self, ts: float, x: float, window_s: float, alpha: float):
+        if self.size == self.capacity:
+            self._pop_oldest()
+        while self.size and ts - self.oldest_ts > window_s:
+            self._pop_oldest()
+
+        tail = (self.head + self.size) % self.capacity
+        self.timestamps[tail] = ts
+        self.values[tail] = x
+        self.size += 1
+
+        delta = x - self.mean
+        self.mean += delta / self.size
+        self.m2 += delta * (x - self.mean)
+
+        if self.ewma is None:
+            self.ewma = x
+        else:
+            ew_delta = x - self.ewma
+            self.ewma += alpha * ew_delta
+            self.ewvar = (1 - alpha) * (self.ewvar + alpha * ew_delta * ew_delta)
+
+
+class RollingStore:
+    """
+    Store locale delle serie temporali (nodo x metrica) alimentato dagli snapshot del Metrics Engine
+    e, opzionalmente, da un campionatore in background.
+    Le statistiche di stabilità sono mantenute in modo incrementale: la lettura è O(1),
+    senza far riscandire a Prometheus 24h di dati ad ogni richiesta di allocazione.
+    """
+
+    def __init__(self, window_s: float = 86400.0, capacity: int = 1440, min_interval_s: float = 15.0,
+                 min_window_s: float = 3600.0, min_samples: int = 30, ewma_alpha: float = 0.1):
+        self.window_s = window_s
+        self.capacity = capacity
+        self.min_interval_s = min_interval_s    # Campioni più ravvicinati (stesso scrape) vengono scartati
+        self.min_window_s = min_window_s        # Copertura minima per considerare affidabile la finestra locale
+        self.min_samples = min_samples
+        self.ewma_alpha = ewma_alpha
+
+        self._series = {}   # { (nodo, metrica): _Series }
+
+    def __len__(self) -> int:
+        return len(self._series)
+
+    def add(self, node: str, metric: str, value: float, ts: float | None = None) -> bool:
+        """Registra un campione. Restituisce False se scartato (NaN o troppo vicino al precedente)."""
+        if value is None or math.isnan(value):
+            return False
+        ts = time.time() if ts is None else ts
+        series = self._series.get((node, metric))
+        if series is None:
+            series = self._series[(node, metric)] = _Series(self.capacity)
+        elif series.size and ts - series.newest_ts < self.min_interval_s:
+            return False
+        series.push(ts, float(value), self.window_s, self.ewma_alpha)
+        return True
+
+    def record(self, snapshot, ts: float | None = None) -> int:
+        """Registra tutti i valori presenti di uno snapshot colonnare. Restituisce i campioni accettati."""
+        ts = time.time() if ts is None else ts
+        rows, cols = np.nonzero(~np.isnan(snapshot.values))
+        accepted = 0
+        for i, j in zip(rows.tolist(), cols.tolist()):
+            accepted += self.add(snapshot.nodes[i], snapshot.metrics[j], snapshot.values[i, j], ts)
+        return accepted
+
+    def seed(self, history) -> int:
+        """
+        Riempie le serie ancora vuote con i campioni di uno storico a finestra (range query),
+        così lo store è utilizzabile subito dopo il primo fetch invece che dopo ore di campionamento.
+        """
+        seeded = 0
+        step_stride = max(1, math.ceil(self.min_interval_s / history.step))
+        times = history.start + history.step * np.arange(history.samples.shape[2])
+        for node, i in history.node_index.items():
+            for metric, j in history.metric_index.items():
+                if (node, metric) in self._series:
+                    continue
+                series_values = history.samples[i, j, ::step_stride]
+                series_times = times[::step_stride]
+                valid = ~np.isnan(series_values)
+                for ts, value in zip(series_times[valid].tolist(), series_values[valid].tolist()):
+                    self.add(node, metric, value, ts)
+                seeded += 1
+        return seeded
+
+    def window_stats(self, node: str, metric: str, now: float | None = None) -> dict | None:
+        """
+        Statistiche della finestra locale, oppure None se la finestra è troppo corta (o ferma)
+        per essere affidabile: in quel caso si ripiega sullo storico PromQL.
+        """
+        series = self._series.get((node, metric))
+        if series is None or series.size < self.min_samples:
+            return None
+        now = time.time() if now is None else now
+        if now - series.newest_ts > self.window_s:
+            return None
+        span = series.newest_ts - series.oldest_ts
+        if span < self.min_window_s:
+            return None
+        return {
+            "mean": series.mean,
+            "std": math.sqrt(series.m2 / series.size),   # Deviazione standard di popolazione
+            "ewma": series.ewma,
+            "ewstd": math.sqrt(series.ewvar),
+            "samples": series.size,
+            "span_s": span,
+            "step_s": span / max(1, series.size - 1),   # Distanza media tra i campioni
+        }
+
+    def covers(self, stats: dict | None, window_s: float) -> bool:
+        """True se le statistiche di window_stats coprono davvero `window_s` (a meno di un passo di campionamento)."""
+        return stats is not None and stats["span_s"] + stats["step_s"] >= window_s
+
+    def clear(self):
+        self._series.clear()
+
+
+class RollingSampler:
+    """Campionatore in background: interroga il cluster ogni `interval_s` secondi e alimenta lo store."""
+
+    def __init__(self, sample, store: RollingStore, interval_s: float):
+        self.sample = sample          # Coroutine factory: sample() -> MetricsSnapshot del cluster
+        self.store = store
+        self.interval_s = interval_s
+        self._task = None
+
+    def start(self):
+        if self.interval_s <= 0 or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        log.info(f"Campionatore serie temporali avviato (ogni {self.interval_s:g}s).")
+
+    async def _run(self):
+        while True:
+            try:
+                snapshot = await self.sample()
+                accepted = self.store.record(snapshot)
+                log.debug(f"Campionatore: {accepted} campioni registrati ({len(self.store)} serie).")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning(f"Campionamento in background fallito: {e}")
+            await asyncio.sleep(self.interval_s)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
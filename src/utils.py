@@ -20,46 +20,6 @@ def clean_tool_output(result) -> str:
     
     return str(result)
 
-def parse_prometheus_output(raw_output: str, metric_name: str) -> dict:
-    parsed_data = {}
-
-    raw_output = clean_tool_output(raw_output)
-    
-    try:
-        # 1. Tentiamo di parsare la stringa come JSON
-        data = json.loads(raw_output)
-        
-        # Verifica se è la struttura standard di Prometheus API
-        if isinstance(data, dict) and "result" in data:
-            results_list = data["result"]
-            
-            for item in results_list:
-                # 2. Estrazione Identificativo Nodo
-                metric_labels = item.get("metric", {})
-                
-                # Nel tuo esempio la chiave è "name", ma spesso è "instance". 
-                # Le cerchiamo entrambe in ordine di priorità.
-                node_name = metric_labels.get("name") or metric_labels.get("instance") or "unknown"
-                
-                # 3. Estrazione Valore
-                # Il formato standard è "value": [timestamp, "valore_stringa"]
-                value_list = item.get("value", [])
-                if len(value_list) >= 2:
-                    try:
-                        val = float(value_list[1])
-                        parsed_data[node_name] = round(val, 3)
-                    except ValueError:
-                        print(f"⚠️ Valore non numerico per {node_name}: {value_list[1]}")
-                        
-        else:
-            print(f"⚠️ Struttura JSON imprevista per {metric_name}")
-
-    except json.JSONDecodeError:
-        # Se fallisce il JSON, significa che l'output era testo grezzo (fallback o errore)
-        print(f"⚠️ Errore decoding JSON per {metric_name}. Output grezzo: {raw_output[:50]}...")
-        
-    return parsed_data
-
 # --- FUNZIONE DI FORMATTAZIONE MARKDOWN ---
 def format_capability_report_markdown(report: CapabilityReport) -> str:
     md_output = []
@@ -221,51 +181,6 @@ def get_physical_threshold(metric_name: str, metric_def: dict, strict_thresholds
     elif unit_type == "rate": return 5.0              
     else: return 1.0
 
-def classify_stability(current, avg, std, delta_threshold):
-    """
-    Calcola Z-Score, Coefficiente di Variazione (CV) e classifica lo stato.
-    Restituisce un dizionario con "status", "reason" e metriche calcolate.
-    """
-    if std is None or avg is None or current is None:
-        return {"status": "UNKNOWN", "reason": "No Data", "metrics": {}}
-    
-    delta = abs(current - avg)
-    
-    if std > 0:
-        z_score = delta / std
-    else:
-        z_score = 0.0 if delta == 0 else 999.9
-    
-    # Coefficiente di Variazione (CV)
-    # Se la media storica è inferiore alla soglia di rilevanza fisica (es. Load < 0.2),
-    # allora le fluttuazioni relative (CV) sono matematicamente enormi ma fisicamente inutili.
-    # In questo caso, sopprimiamo il CV.
-    if avg < delta_threshold:
-        cv = 0.0
-    else:
-        cv = (std / avg) if avg > 0 else 0.0
-
-    # Costanti di sistema
-    Z_THRESHOLD = 2.0
-    CV_CHAOS_THRESHOLD = 0.3
-
-    # LOGICA DI CLASSIFICAZIONE
-    if cv > CV_CHAOS_THRESHOLD:
-        return {"status": "CHAOTIC", 
-                "reason": f"Instabilità cronica: Il CV ({cv:.2f}) è troppo alto, indicando un utilizzo delle risorse erratico e imprevedibile. Rischio elevato di saturazione improvvisa.", 
-                "metrics": {"z": z_score, "cv": cv}}
-
-    if z_score > Z_THRESHOLD:
-        if delta > delta_threshold:
-            return {"status": "SPIKE", 
-                    "reason": f"Picco di carico acuto: Rilevato un aumento improvviso (+{delta:.2f}) che supera la soglia di sicurezza. Nonostante lo storico calmo, il nodo è sotto stress immediato.", 
-                    "metrics": {"z": z_score, "cv": cv}}
-        else:
-            return {"status": "FALSE_ALARM", "reason": "Variazione statistica trascurabile", "metrics": {"z": z_score, "cv": cv}}
-            
-    return {"status": "STABLE", "reason": "Nella norma", "metrics": {"z": z_score, "cv": cv}}
-
-
 
 def json_to_markdown_table(data, key_label="Node", columns=None) -> str:
 
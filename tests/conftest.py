@@ -0,0 +1,5 @@
+import os
+import sys
+
+# I test importano i moduli come "src.<modulo>", come main.py: la root del progetto va nel path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,74 @@
+import pytest
+
+from src.constraint_parser import metric_kind, parse_constraints
+
+
+METRICS = {
+    "cpu_usage_pct": {"query": "x", "unit": "percentage_100", "description": "Utilizzo CPU"},
+    "ram_available_bytes": {"query": "x", "unit": "bytes", "description": "RAM libera"},
+    "disk_free_bytes": {"query": "x", "unit": "bytes", "description": "Spazio libero su disco"},
+    "disk_io_rate": {"query": "x", "unit": "rate", "description": "Operazioni di I/O del disco"},
+    "mem_used_ratio": {"query": "x", "unit": "ratio", "description": "Memoria usata"},
+}
+GB = 1024 ** 3
+
+
+def constraints(text: str) -> list:
+    result = parse_constraints(text, METRICS)
+    return [(c.metric_name, c.operator, c.value) for c in result.extraction.constraints]
+
+
+@pytest.mark.parametrize("name, definition, kind", [
+    ("ram_available_bytes", {"unit": "bytes"}, "bytes"),
+    ("cpu_usage_pct", {}, "percent"),
+    ("load", {"unit": "ratio"}, "percent"),
+    ("disk_io_rate", {}, "rate"),
+    ("temperature", {"unit": "celsius"}, None),
+])
+def test_metric_kind(name, definition, kind):
+    assert metric_kind(name, definition) == kind
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("almeno 8GB di RAM", [("ram_available_bytes", ">=", 8 * GB)]),
+    ("8 GB di RAM libera", [("ram_available_bytes", ">=", 8 * GB)]),
+    ("CPU sotto il 20%", [("cpu_usage_pct", "<", 20.0)]),
+    ("at least 1.5 TB of free disk", [("disk_free_bytes", ">=", 1.5 * 1024 ** 4)]),
+    ("più di 500 iops", [("disk_io_rate", ">", 500.0)]),
+    ("memoria usata al massimo 70%", [("mem_used_ratio", "<=", pytest.approx(0.7))]),
+    ("CPU al 20% o meno", [("cpu_usage_pct", "<=", 20.0)]),
+])
+def test_single_constraints(text, expected):
+    assert constraints(text) == expected
+
+
+def test_multiple_clauses():
+    assert constraints("almeno 16GB di RAM e CPU sotto il 30%, disco libero oltre 100GB") == [
+        ("ram_available_bytes", ">=", 16 * GB),
+        ("cpu_usage_pct", "<", 30.0),
+        ("disk_free_bytes", ">", 100 * GB),
+    ]
+
+
+def test_decimal_comma_is_not_a_clause_separator():
+    assert constraints("almeno 2,5GB di RAM") == [("ram_available_bytes", ">=", 2.5 * GB)]
+
+
+def test_pronoun_io_is_not_a_disk_reference():
+    # Con "io" letto come disco, RAM e disco sarebbero a pari merito e la clausola passerebbe all'LLM
+    assert constraints("io vorrei almeno 8GB di RAM") == [("ram_available_bytes", ">=", 8 * GB)]
+    assert constraints("io vorrei la CPU al massimo al 20%") == [("cpu_usage_pct", "<=", 20.0)]
+
+
+def test_unparsed_numbers_are_left_to_the_llm():
+    result = parse_constraints("mi servono 4 core e almeno 8GB di RAM", METRICS)
+    assert not result.complete
+    assert result.unparsed == ["mi servono 4 core"]
+    assert [c.metric_name for c in result.extraction.constraints] == ["ram_available_bytes"]
+
+
+def test_ambiguous_metric_is_unparsed():
+    # Due metriche in byte e nessun riferimento alla risorsa: decide l'LLM
+    result = parse_constraints("almeno 10GB", METRICS)
+    assert result.extraction.constraints == []
+    assert result.unparsed == ["almeno 10GB"]
@@ -0,0 +1,126 @@
+import math
+import operator
+import random
+
+import pytest
+
+from src.evaluation import CompiledProfiles, evaluate_profiles, normalize_profiles
+from src.snapshot import SnapshotBuilder
+
+
+# --- RIFERIMENTO: valutatore per profilo della versione precedente (single_profile_evaluator_node) ---
+
+OPS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge, "==": operator.eq, "!=": operator.ne}
+
+
+def reference_evaluator(profile: dict, metrics_data: dict, target_filter: str | None = None) -> tuple[list, dict]:
+    requirements = profile.get("required_conditions", [])
+    qualified_nodes, analysis_log = [], {}
+    for node, node_metrics in metrics_data.items():
+        if target_filter and node != target_filter:
+            continue
+        is_qualified, node_logs = True, []
+        for req in requirements:
+            metric_key, op_sym, threshold = req.get("metric"), req.get("operator"), req.get("threshold")
+            val = node_metrics.get(metric_key)
+            if val is None:
+                is_qualified = False
+                node_logs.append(f"{metric_key}: N/A (FAIL)")
+                break
+            op_func = OPS.get(op_sym)
+            if op_func:
+                try:
+                    val_float, thresh_float = float(val), float(threshold)
+                    if op_func(val_float, thresh_float):
+                        node_logs.append(f"{metric_key}: {val_float} {op_sym} {thresh_float} (PASS)")
+                    else:
+                        is_qualified = False
+                        node_logs.append(f"{metric_key}: {val_float} not {op_sym} {thresh_float} (FAIL)")
+                except ValueError:
+                    is_qualified = False
+                    node_logs.append(f"{metric_key}: Type Error (FAIL)")
+        if is_qualified:
+            qualified_nodes.append(node)
+        analysis_log[node] = node_logs
+    return qualified_nodes, analysis_log
+
+
+# --- DATI ---
+
+METRICS = ["cpu", "ram", "disk", "net"]
+
+
+def build_snapshot(metrics_data: dict):
+    builder = SnapshotBuilder(METRICS, decimals=None)
+    for node, values in metrics_data.items():
+        for metric, value in values.items():
+            builder.add(metric, node, value)
+    return builder.build()
+
+
+def random_case(rng: random.Random) -> tuple[dict, list]:
+    metrics_data = {}
+    for k in range(rng.randint(1, 8)):
+        # Valori interi frequenti per esercitare anche i casi di uguaglianza con la soglia
+        metrics_data[f"w{k}"] = {m: float(rng.choice([rng.randint(0, 10), round(rng.uniform(0, 10), 2)]))
+                                 for m in METRICS if rng.random() > 0.15}
+    profiles = []
+    for p in range(rng.randint(1, 5)):
+        conditions = []
+        for _ in range(rng.randint(0, 4)):
+            conditions.append({
+                "metric": rng.choice(METRICS + ["missing"]),
+                "operator": rng.choice(list(OPS) + ["~"]),
+                "threshold": rng.choice([rng.randint(0, 10), round(rng.uniform(0, 10), 2), "5", "abc"]),
+            })
+        profiles.append({"profile_name": f"p{p}", "required_conditions": conditions})
+    return metrics_data, profiles
+
+
+@pytest.mark.parametrize("seed", range(200))
+def test_vectorized_evaluation_matches_per_profile_worker(seed):
+    rng = random.Random(seed)
+    metrics_data, profiles = random_case(rng)
+    target_filter = rng.choice([None, None, "w0", "absent"])
+    # Il riferimento riceveva lo snapshot in JSON: solo i valori presenti
+    evaluation = evaluate_profiles(profiles, build_snapshot(metrics_data), target_filter)
+
+    for profile in profiles:
+        expected_nodes, expected_lines = reference_evaluator(profile, metrics_data, target_filter)
+        name = profile["profile_name"]
+        assert evaluation.qualified_nodes(name) == expected_nodes
+        assert evaluation.analysis_lines(name) == expected_lines
+
+
+def test_missing_metric_fails_even_with_unknown_operator():
+    snapshot = build_snapshot({"w1": {"cpu": 1.0}})
+    profiles = [{"profile_name": "p", "required_conditions": [{"metric": "ram", "operator": "~", "threshold": 1}]}]
+    evaluation = evaluate_profiles(profiles, snapshot)
+
+    assert evaluation.qualified_nodes("p") == []
+    assert evaluation.audit_lines("p", "w1") == ["ram: N/A (FAIL)"]
+
+
+def test_profile_without_conditions_accepts_every_node():
+    evaluation = evaluate_profiles([{"profile_name": "any"}], build_snapshot({"w1": {"ram": 2.0}, "w2": {"cpu": 1.0}}))
+    assert evaluation.qualified_nodes("any") == ["w1", "w2"]
+    assert evaluation.qualified_nodes("unknown") == []
+
+
+def test_compiled_profiles_encode_bad_thresholds():
+    compiled = CompiledProfiles([{"profile_name": "p", "required_conditions": [
+        {"metric": "cpu", "operator": "<", "threshold": "abc"},
+        {"metric": "cpu", "operator": "~", "threshold": "abc"},
+    ]}])
+    assert len(compiled) == 2
+    assert compiled.req_op.tolist() == [-2, -1]
+    assert all(math.isnan(t) for t in compiled.req_threshold)
+
+
+def test_normalize_profiles_from_dict_and_list():
+    assert normalize_profiles({"cpu": {"required_conditions": []}, "bad": None}) == [
+        {"required_conditions": [], "profile_name": "cpu"}
+    ]
+    as_list = [{"profile_name": "x"}]
+    assert normalize_profiles(as_list) is as_list
+    assert normalize_profiles(None) == []
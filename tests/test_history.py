@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from src.history import HistoryBuilder, MetricsHistory
+
+
+def make_history(values: list, step: float = 60.0) -> MetricsHistory:
+    samples = np.array([[values]], dtype=np.float64)
+    return MetricsHistory(["w1"], ["cpu"], start=0.0, step=step, samples=samples)
+
+
+def test_full_window_statistics():
+    values = [1.0, 2.0, np.nan, 4.0, 5.0]
+    history = make_history(values)
+    valid = [v for v in values if not np.isnan(v)]
+
+    assert history.get("w1", "cpu", "current") == 5.0
+    assert history.get("w1", "cpu", "mean") == pytest.approx(np.mean(valid))
+    assert history.get("w1", "cpu", "std") == pytest.approx(np.std(valid))
+    assert history.get("w1", "cpu", "count") == 4.0
+    assert history.get("w1", "missing") is None
+
+
+def test_shorter_windows_are_tail_slices():
+    values = [float(v) for v in range(61)]       # 1h a passo 60s
+    history = make_history(values)
+
+    stats = history.window_stats(600)           # Ultimi 10 minuti = ultimi 11 campioni
+    assert stats["mean"][0, 0] == pytest.approx(np.mean(values[-11:]))
+    assert stats["count"][0, 0] == 11
+    assert history.covers(3600) and not history.covers(7200)
+
+
+def test_long_windows_are_subsampled_from_the_last_sample():
+    values = [float(v) for v in range(101)]
+    history = make_history(values, step=1.0)
+
+    stats = history.window_stats(100, max_points=10)
+    expected = values[::-11][::-1]                  # Stride 11, ancorato all'ultimo campione
+    assert stats["count"][0, 0] == len(expected)
+    assert stats["mean"][0, 0] == pytest.approx(np.mean(expected))
+    assert history.window_step(100, max_points=10) == 11.0
+    assert history.window_stats(100, max_points=10) is stats      # Memoizzata per (finestra, max_points)
+
+
+def test_series_without_samples_is_nan():
+    history = make_history([np.nan, np.nan])
+    assert history.get("w1", "cpu", "mean") is None
+    assert history.get("w1", "cpu", "current") is None
+    assert history.snapshot().to_dict() == {"w1": {}}
+
+
+def test_builder_aligns_series_on_the_grid():
+    builder = HistoryBuilder(["cpu", "ram"], start=100.0, step=10.0, points=4)
+    builder.add_series("cpu", "w1", np.array([100.0, 121.0, 130.0, 500.0]), np.array([1.0, 3.0, 4.0, 9.0]))
+    builder.add_series("ram", "w2", np.array([110.0]), np.array([7.0]))
+    builder.add_series("disk", "w1", np.array([100.0]), np.array([1.0]))
+    history = builder.build()
+
+    assert builder.filled_metrics() == {"cpu", "ram"}
+    np.testing.assert_array_equal(history.samples[0, 0], [1.0, np.nan, 3.0, 4.0])
+    assert history.snapshot().to_dict() == {"w1": {"cpu": 4.0}, "w2": {"ram": 7.0}}
@@ -0,0 +1,62 @@
+import pytest
+
+from src.intent_rules import FastPathStats, classify_intent_rules, match_target
+
+
+TARGETS = ["worker-1", "worker-2", "gpu-node"]
+
+
+@pytest.mark.parametrize("text, intent", [
+    ("Dove posso allocare un job cpu-bound?", "allocation"),
+    ("dove conviene lanciare questo pod?", "allocation"),
+    ("Where should I place this workload?", "allocation"),
+    ("deploy a container with 8GB of RAM", "allocation"),
+    ("Qual è lo stato del cluster?", "status"),
+    ("come sta worker-2?", "status"),
+    ("panoramica delle metriche", "status"),
+])
+def test_clear_intents_take_the_fast_path(text, intent):
+    guess = classify_intent_rules(text, TARGETS)
+    assert guess.intent == intent
+    assert guess.confidence >= 0.75
+
+
+@pytest.mark.parametrize("text", [
+    "quale host è più carico?",             # "host" senza carico di lavoro
+    "esegui un controllo veloce",           # verbo di piazzamento senza job/pod/workload
+    "stato del cluster: dove posso allocare un job?",   # segnali contrastanti
+    "ciao",
+])
+def test_ambiguous_queries_go_to_the_llm(text):
+    guess = classify_intent_rules(text, TARGETS)
+    assert guess.intent is None
+    assert guess.confidence == 0.0
+
+
+def test_target_exact_and_fuzzy_match():
+    assert classify_intent_rules("come sta worker-1?", TARGETS).target_filter == "worker-1"
+    assert classify_intent_rules("come sta worker1?", TARGETS).target_filter == "worker-1"
+
+    fuzzy = classify_intent_rules("come sta gpu-nod?", TARGETS)
+    assert fuzzy.target_filter == "gpu-node"
+    assert fuzzy.confidence < classify_intent_rules("come sta gpu-node?", TARGETS).confidence
+
+
+def test_ambiguous_target_drops_confidence():
+    guess = classify_intent_rules("stato di worker-1 e worker-2", TARGETS)
+    assert guess.target_filter is None
+    assert guess.confidence == 0.0
+
+
+def test_match_target_is_whole_word():
+    # "worker-1" dentro "worker-10" non è un match esatto: al più un candidato per somiglianza
+    assert match_target("stato di worker-10", TARGETS) == ("worker-1", False)
+    assert match_target("stato di worker-1.", TARGETS) == ("worker-1", True)
+    assert match_target("stato del cluster", TARGETS) == (None, True)
+
+
+def test_fast_path_stats():
+    stats = FastPathStats()
+    for fast in (True, True, False):
+        stats.record(fast)
+    assert stats.stats() == {"fast": 2, "llm": 1, "fast_ratio": pytest.approx(2 / 3)}
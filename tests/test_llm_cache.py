@@ -0,0 +1,102 @@
+import asyncio
+import json
+
+from pydantic import BaseModel
+
+from src.llm_cache import LLMResponseCache, context_hash, normalize_input
+
+
+class Intent(BaseModel):
+    intent: str
+
+
+def test_normalize_input():
+    assert normalize_input("  Dove   posso ALLOCARE un job?? ") == "dove posso allocare un job"
+    assert normalize_input(None) == ""
+
+
+def test_keys_ignore_formatting_but_not_context():
+    key = LLMResponseCache.make_key("intent", "Stato del cluster?", context_hash("a"))
+    assert key == LLMResponseCache.make_key("intent", "stato del  cluster", context_hash("a"))
+    assert key != LLMResponseCache.make_key("intent", "stato del cluster", context_hash("b"))
+    assert key != LLMResponseCache.make_key("task", "stato del cluster", context_hash("a"))
+
+
+def test_structured_calls_llm_once_per_key():
+    cache = LLMResponseCache()
+    calls = []
+
+    async def invoke():
+        calls.append(1)
+        return Intent(intent="status")
+
+    async def scenario():
+        first = await cache.structured("intent", "stato?", "ctx", Intent, invoke)
+        second = await cache.structured("intent", "Stato", "ctx", Intent, invoke)
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first == second == Intent(intent="status")
+    assert len(calls) == 1
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_lru_eviction():
+    cache = LLMResponseCache(max_entries=2)
+    for k in range(3):
+        cache.put(f"k{k}", "intent", Intent(intent=str(k)))
+    assert cache.get("k0", Intent) is None
+    assert cache.get("k2", Intent) == Intent(intent="2")
+    assert cache.evictions == 1
+
+
+def test_config_change_invalidates_only_dependent_entries():
+    cache = LLMResponseCache()
+    cache.sync_config("digest-a")
+    cache.put("dep", "task", Intent(intent="x"), depends_on_config=True)
+    cache.put("free", "intent", Intent(intent="y"))
+
+    cache.sync_config("digest-a")
+    assert len(cache) == 2
+    cache.sync_config("digest-b")
+    assert cache.get("dep", Intent) is None
+    assert cache.get("free", Intent) == Intent(intent="y")
+    assert cache.invalidations == 1
+
+
+def test_persistence_round_trip(tmp_path):
+    path = tmp_path / "llm_cache.json"
+    cache = LLMResponseCache(path=str(path))
+    cache.sync_config("digest-a")
+    cache.put("k", "task", Intent(intent="x"), depends_on_config=True)     # Fuori da un event loop: scrittura immediata
+
+    reloaded = LLMResponseCache(path=str(path))
+    assert reloaded.get("k", Intent) == Intent(intent="x")
+    reloaded.sync_config("digest-b")
+    assert reloaded.get("k", Intent) is None
+
+
+def test_writes_are_batched_inside_the_event_loop(tmp_path):
+    path = tmp_path / "llm_cache.json"
+
+    async def scenario():
+        cache = LLMResponseCache(path=str(path), flush_delay=60)
+        for k in range(5):
+            cache.put(f"k{k}", "intent", Intent(intent=str(k)))
+        written_before_flush = path.exists()
+        cache.flush()
+        return written_before_flush
+
+    assert asyncio.run(scenario()) is False
+    assert len(json.loads(path.read_text(encoding="utf-8"))["entries"]) == 5
+
+
+def test_schema_change_drops_entry():
+    cache = LLMResponseCache()
+    cache.put("k", "intent", Intent(intent="x"))
+
+    class Other(BaseModel):
+        profiles: list
+
+    assert cache.get("k", Other) is None
+    assert len(cache) == 0
@@ -0,0 +1,103 @@
+import asyncio
+import contextlib
+
+import anyio
+import pytest
+
+import src.mcp_session as mcp_session_module
+from src.mcp_session import MCPSessionManager, is_transport_error
+
+
+class FakeTool:
+    def __init__(self, name: str, generation: int, broken: bool):
+        self.name = name
+        self.generation = generation
+        self.broken = broken
+
+    async def ainvoke(self, args):
+        await asyncio.sleep(0.01)
+        if self.broken:
+            raise anyio.ClosedResourceError()
+        if args.get("query") == "bad":
+            raise ValueError("parse error")
+        return f"gen{self.generation}:{args.get('query')}"
+
+
+class FakeClient:
+    """Client MCP di prova: ogni sessione aperta è una nuova "generazione"; le prime `broken` sono rotte."""
+
+    def __init__(self, broken: int = 0, tools=("execute_query",)):
+        self.opened = 0
+        self.broken = broken
+        self.tools = tools
+
+    @contextlib.asynccontextmanager
+    async def session(self, server_name):
+        self.opened += 1
+        yield self.opened
+
+
+@pytest.fixture
+def manager(monkeypatch):
+    client = FakeClient()
+
+    async def load_tools(generation):
+        return [FakeTool(name, generation, generation <= client.broken) for name in client.tools]
+
+    monkeypatch.setattr(mcp_session_module, "load_mcp_tools", load_tools)
+    return MCPSessionManager(client, "test"), client
+
+
+def test_is_transport_error():
+    assert is_transport_error(anyio.ClosedResourceError())
+    assert is_transport_error(ConnectionError())
+    assert not is_transport_error(ValueError())
+
+
+def test_session_is_opened_once_and_shared(manager):
+    session, client = manager
+
+    async def scenario():
+        results = await asyncio.gather(*[session.call_tool("execute_query", {"query": q}) for q in "abc"])
+        await session.close()
+        return results
+
+    assert asyncio.run(scenario()) == ["gen1:a", "gen1:b", "gen1:c"]
+    assert client.opened == 1
+
+
+def test_concurrent_transport_failures_reconnect_once(manager):
+    session, client = manager
+    client.broken = 1
+
+    async def scenario():
+        results = await asyncio.gather(*[session.call_tool("execute_query", {"query": str(k)}) for k in range(8)])
+        await session.close()
+        return results
+
+    assert asyncio.run(scenario()) == [f"gen2:{k}" for k in range(8)]
+    assert client.opened == 2
+
+
+def test_application_errors_do_not_reconnect(manager):
+    session, client = manager
+
+    async def scenario():
+        with pytest.raises(ValueError):
+            await session.call_tool("execute_query", {"query": "bad"})
+        await session.close()
+
+    asyncio.run(scenario())
+    assert client.opened == 1
+
+
+def test_missing_tool_raises_lookup_error(manager):
+    session, client = manager
+
+    async def scenario():
+        assert await session.get_tool("execute_range_query") is None
+        with pytest.raises(LookupError):
+            await session.call_tool("execute_range_query", {})
+        await session.close()
+
+    asyncio.run(scenario())
@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from src.prom_decoder import DecodeStats, decode_into, decode_series_into, iter_series
+from src.snapshot import SnapshotBuilder
+
+
+def vector(*series, envelope: bool = True, **extra) -> str:
+    data = {"resultType": "vector", "result": list(series)}
+    return json.dumps({"status": "success", **extra, "data": data} if envelope else {**extra, **data})
+
+
+def sample(name: str, value: str, **labels) -> dict:
+    return {"metric": {"name": name, **labels}, "value": [1700000000, value]}
+
+
+@pytest.mark.parametrize("envelope", [True, False])
+def test_iter_series_decodes_both_response_formats(envelope):
+    text = vector(sample("w1", "1"), sample("w2", "2"), envelope=envelope)
+    assert [labels["name"] for labels, _ in iter_series(text)] == ["w1", "w2"]
+
+
+def test_iter_series_accepts_mcp_content_list_and_dict():
+    text = vector(sample("w1", "1"))
+    assert len(list(iter_series([{"type": "text", "text": text}]))) == 1
+    assert len(list(iter_series(json.loads(text)))) == 1
+
+
+def test_nested_result_key_is_not_mistaken_for_the_result_array():
+    text = vector(sample("w1", "1"), warnings=[{"result": [{"metric": {"name": "bogus"}, "value": [0, "9"]}]}])
+    assert [labels["name"] for labels, _ in iter_series(text)] == ["w1"]
+
+
+def test_result_key_inside_error_message_is_invalid_payload():
+    stats = DecodeStats()
+    text = json.dumps({"status": "error", "error": 'parse error near "result":['})
+    with pytest.raises(ValueError):
+        list(iter_series(text, stats))
+    assert stats.invalid_payloads == 1
+
+
+@pytest.mark.parametrize("payload", ["Error: connection refused", '{"data": {"result": [', "[]"])
+def test_invalid_payloads_are_counted(payload):
+    stats = DecodeStats()
+    assert decode_into(payload, SnapshotBuilder(["cpu"]), metric="cpu", stats=stats) is False
+    assert stats.invalid_payloads == 1
+
+
+def test_decode_into_fills_builder_and_counts_errors():
+    stats = DecodeStats()
+    builder = SnapshotBuilder(["cpu"])
+    text = vector(sample("w1", "12.5"), sample("w2", "NaN"), sample("w3", "abc"), {"metric": {"name": "w4"}})
+
+    assert decode_into(text, builder, metric="cpu", stats=stats)
+    assert builder.build().to_dict() == {"w1": {"cpu": 12.5}}
+    assert (stats.series, stats.non_numeric, stats.missing_value) == (1, 1, 1)
+
+
+def test_decode_into_batch_uses_tag_label():
+    builder = SnapshotBuilder(["cpu", "ram"])
+    text = vector(sample("w1", "1", tag="cpu"), sample("w1", "2", tag="ram"), sample("w1", "3"))
+
+    assert decode_into(text, builder, tag_label="tag")
+    assert builder.build().to_dict() == {"w1": {"cpu": 1.0, "ram": 2.0}}
+
+
+class SeriesCollector:
+    def __init__(self):
+        self.series = {}
+
+    def add_series(self, metric, node, timestamps, values):
+        self.series[(metric, node)] = (timestamps.tolist(), values.tolist())
+
+
+def test_decode_series_into_matrix():
+    text = json.dumps({"status": "success", "data": {"resultType": "matrix", "result": [
+        {"metric": {"name": "w1"}, "values": [[1, "1"], [2, "2.5"]]},
+        {"metric": {"name": "w2"}, "values": []},
+    ]}})
+    collector, stats = SeriesCollector(), DecodeStats()
+
+    assert decode_series_into(text, collector, metric="cpu", stats=stats)
+    assert collector.series == {("cpu", "w1"): ([1.0, 2.0], [1.0, 2.5])}
+    assert stats.missing_value == 1
@@ -0,0 +1,89 @@
+from langchain_core.messages import AIMessage, HumanMessage, SystemMessage
+
+from src.prompt_budget import compress_audit, estimate_tokens, fit_lines, fit_messages, summarize_names, top_rows
+
+
+def msg(kind, tokens: int, tag: str):
+    # CHARS_PER_TOKEN = 4: `tokens` token esatti, con un'etichetta per riconoscere il messaggio
+    return kind(content=tag + "x" * (tokens * 4 - len(tag)))
+
+
+def tags(messages: list) -> list:
+    return [m.content.rstrip("x") for m in messages]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 0
+    assert estimate_tokens(None) == 0
+    assert estimate_tokens("abcde") == 2
+
+
+def test_fit_messages_keeps_everything_within_budget():
+    history = [msg(HumanMessage, 5, "h1"), msg(AIMessage, 5, "a1"), msg(HumanMessage, 5, "h2")]
+    kept, omitted = fit_messages(history, 100)
+    assert tags(kept) == ["h1", "a1", "h2"]
+    assert omitted == 0
+
+
+def test_fit_messages_stops_at_first_overflow_before_last_human():
+    history = [msg(HumanMessage, 2, "h1"), msg(AIMessage, 50, "a1"), msg(HumanMessage, 5, "h2"),
+               msg(AIMessage, 5, "a2"), msg(HumanMessage, 5, "h3")]
+    kept, omitted = fit_messages(history, 20)
+    # "h1" starebbe nel budget, ma dopo il salto di "a1" lo storico non sarebbe contiguo
+    assert tags(kept) == ["h2", "a2", "h3"]
+    assert omitted == 2
+
+
+def test_fit_messages_stops_at_first_overflow_after_last_human():
+    history = [msg(HumanMessage, 5, "h1"), msg(SystemMessage, 50, "s1"), msg(AIMessage, 2, "a1")]
+    kept, omitted = fit_messages(history, 10)
+    # La coda dopo l'ultimo messaggio utente non sta nel budget: resta solo quest'ultimo
+    assert tags(kept) == ["h1"]
+    assert omitted == 2
+
+
+def test_fit_messages_always_keeps_last_human_message():
+    history = [msg(AIMessage, 5, "a1"), msg(HumanMessage, 100, "h1")]
+    kept, _ = fit_messages(history, 10)
+    assert tags(kept) == ["h1"]
+
+
+def test_fit_messages_result_is_a_contiguous_suffix_or_last_human():
+    history = [msg(HumanMessage if k % 3 == 0 else AIMessage, size, f"m{k}")
+               for k, size in enumerate([3, 8, 1, 20, 2, 2, 9, 1, 4, 30, 2])]
+    last_human = max(k for k, m in enumerate(history) if m.type == "human")
+    for budget in range(0, 90, 3):
+        kept, omitted = fit_messages(history, budget)
+        assert kept == history[len(history) - len(kept):] or kept == [history[last_human]]
+        assert history[last_human] in kept
+        assert omitted == len(history) - len(kept)
+
+
+def test_fit_lines_and_top_rows():
+    lines = ["a" * 8, "b" * 8, "c" * 8]
+    assert fit_lines(lines, 6) == (["a" * 8, "b" * 8], 1)
+    assert fit_lines(lines, 100) == (lines, 0)
+
+    rows = list(range(10))
+    render = lambda rs: "row\n" * len(rs)
+    assert top_rows(rows, render, 100) == (rows, 0)
+    assert top_rows(rows, render, 4) == ([0, 1, 2, 3], 6)
+    assert top_rows(rows, render, 0, min_rows=2) == ([0, 1], 8)
+
+
+def test_summarize_names():
+    assert summarize_names(["a", "b"]) == "a, b"
+    assert summarize_names(["a", "b", "c"], max_names=2) == "a, b (+1)"
+
+
+def test_compress_audit_keeps_failures_and_summarizes_passes():
+    audit = [("cpu", [(f"w{k}", True, ["cpu: 1.0 < 5.0 (PASS)"]) for k in range(50)]
+              + [("bad", False, ["cpu: 9.0 not < 5.0 (FAIL)", "ram: 1.0 > 0.0 (PASS)"])])]
+    full = compress_audit(audit, 10_000)
+    assert full.count("\n- ") == 51
+
+    compact = compress_audit(audit, 60)
+    assert compact.startswith("--- Dettagli Profilo: cpu ---")
+    assert "- bad: cpu: 9.0 not < 5.0 (FAIL)" in compact
+    assert "(PASS)" not in compact
+    assert "50 nodi hanno superato tutti i controlli" in compact
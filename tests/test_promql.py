@@ -0,0 +1,87 @@
+import pytest
+
+from src.promql import (BATCH_LABEL, add_label_matcher, build_batches, is_batchable, node_matcher, scope_query,
+                        tag_query)
+
+
+@pytest.mark.parametrize("query", ["scalar(up)", "time()", "42", "-1.5e3", "", "   "])
+def test_scalar_queries_are_not_batchable(query):
+    assert not is_batchable(query)
+
+
+@pytest.mark.parametrize("query", ["up", 'rate(node_cpu_seconds_total{mode="idle"}[5m])', "time() - node_boot_time"])
+def test_vector_queries_are_batchable(query):
+    assert is_batchable(query)
+
+
+def test_tag_query_marks_series_with_metric_name():
+    assert tag_query("up", "cpu") == f'label_replace((up), "{BATCH_LABEL}", "cpu", "", "")'
+
+
+def test_build_batches_merges_vector_queries_and_keeps_scalars_apart():
+    queries = {"cpu": "rate(cpu[5m])", "ram": "mem_free", "uptime": "scalar(up)"}
+    batches, singles = build_batches(queries)
+
+    assert singles == ["uptime"]
+    assert len(batches) == 1
+    query, names = batches[0]
+    assert names == ["cpu", "ram"]
+    assert query == f"{tag_query('rate(cpu[5m])', 'cpu')} or {tag_query('mem_free', 'ram')}"
+
+
+def test_build_batches_splits_on_max_chars():
+    queries = {f"m{k}": f"metric_{k}" for k in range(6)}
+    part_len = len(tag_query("metric_0", "m0")) + 4
+    batches, singles = build_batches(queries, max_chars=part_len * 2)
+
+    assert singles == []
+    assert [names for _, names in batches] == [["m0", "m1"], ["m2", "m3"], ["m4", "m5"]]
+    assert all(len(query) <= part_len * 2 for query, _ in batches)
+
+
+def test_single_metric_batch_falls_back_to_original_query():
+    part_len = len(tag_query("metric_0", "m0")) + 4
+    batches, singles = build_batches({"m0": "metric_0", "m1": "metric_1", "m2": "metric_2"}, max_chars=part_len * 2)
+
+    assert [names for _, names in batches] == [["m0", "m1"]]
+    assert singles == ["m2"]
+
+
+# --- PUSH-DOWN DEL FILTRO NODO ---
+
+MATCHER = 'name="w1"'
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("up", 'up{name="w1"}'),
+    ('up{job="node"}', 'up{job="node", name="w1"}'),
+    ("up{}", 'up{name="w1"}'),
+    ('{__name__=~"node_.*"}', '{__name__=~"node_.*", name="w1"}'),
+    ("rate(node_cpu_seconds_total[5m])", 'rate(node_cpu_seconds_total{name="w1"}[5m])'),
+    ("avg_over_time(cpu[24h:5m])", 'avg_over_time(cpu{name="w1"}[24h:5m])'),
+    ("sum by (name) (rate(x[1m]))", 'sum by (name) (rate(x{name="w1"}[1m]))'),
+    ("sum(x) by (name)", 'sum(x{name="w1"}) by (name)'),
+    ("a / on (name) group_left b", 'a{name="w1"} / on (name) group_left b{name="w1"}'),
+    ("a and b or c unless d", 'a{name="w1"} and b{name="w1"} or c{name="w1"} unless d{name="w1"}'),
+    ("x offset 5m", 'x{name="w1"} offset 5m'),
+    ("x > bool 0.5", 'x{name="w1"} > bool 0.5'),
+    ("100 * (1 - free / total)", '100 * (1 - free{name="w1"} / total{name="w1"})'),
+    ('label_replace(up, "dst", "$1", "src", "(.*)")', 'label_replace(up{name="w1"}, "dst", "$1", "src", "(.*)")'),
+])
+def test_add_label_matcher_injects_into_every_selector(query, expected):
+    assert add_label_matcher(query, MATCHER) == expected
+
+
+def test_add_label_matcher_leaves_strings_untouched():
+    query = 'x{path="/a{b}c", re=~"up|down"}'
+    assert add_label_matcher(query, MATCHER) == 'x{path="/a{b}c", re=~"up|down", name="w1"}'
+
+
+def test_node_matcher_escapes_regex_for_multiple_nodes():
+    assert node_matcher(["w1"]) == 'name="w1"'
+    assert node_matcher(["w.1", "w2"], label="instance") == 'instance=~"w\\\\.1|w2"'
+
+
+def test_scope_query_without_nodes_is_identity():
+    assert scope_query("rate(x[5m])", []) == "rate(x[5m])"
+    assert scope_query("rate(x[5m])", ["w1", "w2"]) == 'rate(x{name=~"w1|w2"}[5m])'
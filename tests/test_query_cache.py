@@ -0,0 +1,119 @@
+import asyncio
+
+import pytest
+
+from src.query_cache import QueryCache, normalize_query
+
+
+class CountingFetch:
+    """Fetch di prova: conta le chiamate e risponde dopo `delay` secondi."""
+
+    def __init__(self, delay: float = 0.02, error: Exception | None = None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+
+    async def __call__(self):
+        self.calls += 1
+        await asyncio.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return f"result-{self.calls}"
+
+
+def test_normalize_query_compacts_spaces_outside_strings():
+    assert normalize_query('  sum ( rate(x{a="b  c"}[5m]) )  ') == 'sum ( rate(x{a="b  c"}[5m]) )'
+
+
+def test_result_is_cached_within_scrape_window():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=3600), CountingFetch(delay=0)
+        first = await cache.get_or_fetch("up", fetch)
+        second = await cache.get_or_fetch("  up ", fetch)
+        return first, second, fetch.calls, cache.stats()
+
+    first, second, calls, stats = asyncio.run(scenario())
+    assert first == second == "result-1"
+    assert calls == 1
+    assert (stats["hits"], stats["misses"]) == (1, 1)
+
+
+def test_disabled_cache_always_fetches():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=0), CountingFetch(delay=0)
+        await cache.get_or_fetch("up", fetch)
+        await cache.get_or_fetch("up", fetch)
+        return fetch.calls
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_lru_eviction():
+    async def scenario():
+        cache = QueryCache(scrape_interval=3600, max_entries=2)
+        for query in ("a", "b", "c"):
+            await cache.get_or_fetch(query, CountingFetch(delay=0))
+        return cache
+
+    cache = asyncio.run(scenario())
+    assert cache.evictions == 1
+    assert list(cache._entries) == ["b", "c"]
+
+
+def test_concurrent_identical_queries_are_coalesced():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=3600), CountingFetch()
+        results = await asyncio.gather(*[cache.get_or_fetch("up", fetch) for _ in range(5)])
+        return results, fetch.calls, cache.coalesced
+
+    results, calls, coalesced = asyncio.run(scenario())
+    assert results == ["result-1"] * 5
+    assert calls == 1
+    assert coalesced == 4
+
+
+def test_errors_reach_every_waiter_and_are_not_cached():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=3600), CountingFetch(error=ValueError("bad query"))
+        results = await asyncio.gather(*[cache.get_or_fetch("up", fetch) for _ in range(3)],
+                                       return_exceptions=True)
+        fetch.error = None
+        retry = await cache.get_or_fetch("up", fetch)
+        return results, retry, fetch.calls
+
+    results, retry, calls = asyncio.run(scenario())
+    assert all(isinstance(r, ValueError) for r in results)
+    assert retry == "result-2"
+    assert calls == 2
+
+
+def test_followers_take_over_when_the_leader_is_cancelled():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=3600), CountingFetch(delay=0.05)
+        leader = asyncio.create_task(cache.get_or_fetch("up", fetch))
+        await asyncio.sleep(0.01)
+        followers = [asyncio.create_task(cache.get_or_fetch("up", fetch)) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        results = await asyncio.gather(leader, *followers, return_exceptions=True)
+        return results, fetch.calls
+
+    results, calls = asyncio.run(scenario())
+    assert isinstance(results[0], asyncio.CancelledError)
+    assert results[1:] == ["result-2"] * 3
+    assert calls == 2
+
+
+def test_cancelled_follower_does_not_affect_the_leader():
+    async def scenario():
+        cache, fetch = QueryCache(scrape_interval=3600), CountingFetch(delay=0.05)
+        leader = asyncio.create_task(cache.get_or_fetch("up", fetch))
+        await asyncio.sleep(0.01)
+        follower = asyncio.create_task(cache.get_or_fetch("up", fetch))
+        await asyncio.sleep(0.01)
+        follower.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await follower
+        return await leader, fetch.calls
+
+    assert asyncio.run(scenario()) == ("result-1", 1)
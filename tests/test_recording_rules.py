@@ -0,0 +1,69 @@
+import time
+
+import yaml
+
+from src.recording_rules import RecordingRules, build_recording_rules, record_name, render_rules_yaml
+
+
+CONFIG = {"metrics": {
+    "cpu_usage_pct": {"query": "100 - avg by (name) (rate(node_cpu_seconds_total{mode='idle'}[5m])) * 100"},
+    "uptime": {"query": "scalar(up)"},
+    "no_query": {},
+}}
+WINDOWS = [3600, 86400]
+
+
+def test_record_names():
+    assert record_name("disk-io.rate") == "qos:disk_io_rate"
+    assert record_name("cpu", "stddev", 604800) == "qos:cpu:stddev_7d"
+
+
+def test_build_recording_rules_skips_scalar_and_empty_queries():
+    rules = build_recording_rules(CONFIG, WINDOWS, interval="30s", stability_interval="1m")
+    metric_group, stability_group = rules["groups"]
+
+    assert metric_group["interval"] == "30s"
+    assert [r["record"] for r in metric_group["rules"]] == ["qos:cpu_usage_pct"]
+    assert [r["record"] for r in stability_group["rules"]] == [
+        "qos:cpu_usage_pct:avg_1h", "qos:cpu_usage_pct:stddev_1h",
+        "qos:cpu_usage_pct:avg_1d", "qos:cpu_usage_pct:stddev_1d",
+    ]
+    assert stability_group["rules"][0]["expr"] == "avg_over_time(qos:cpu_usage_pct[1h])"
+
+
+def load_rules(**options) -> RecordingRules:
+    text = render_rules_yaml(build_recording_rules(CONFIG, WINDOWS))
+    return RecordingRules(yaml.safe_load(text)["groups"], **options)
+
+
+def test_rewrite_and_window_records_round_trip_through_yaml():
+    rules = load_rules()
+    query = CONFIG["metrics"]["cpu_usage_pct"]["query"]
+
+    assert rules.rewrite("  " + query.replace(" ", "   ") + " ") == "qos:cpu_usage_pct"
+    assert rules.rewrite("up") == "up"
+    assert rules.window_record(query, "avg", 86400) == "qos:cpu_usage_pct:avg_1d"
+    assert rules.window_record(query, "avg", 604800) is None
+
+
+def test_unavailable_series_fall_back_then_recover_after_recheck():
+    rules = load_rules(recheck_s=60.0)
+    query = CONFIG["metrics"]["cpu_usage_pct"]["query"]
+
+    rules.mark_unavailable("qos:cpu_usage_pct")
+    rules.mark_unavailable("qos:cpu_usage_pct:avg_1h")
+    assert rules.rewrite(query) == query
+    assert rules.window_record(query, "avg", 3600) is None
+
+    # Scaduto il recheck la serie registrata torna a essere usata
+    for record in list(rules.unavailable):
+        rules.unavailable[record] = time.monotonic() - 61.0
+    assert rules.rewrite(query) == "qos:cpu_usage_pct"
+    assert rules.window_record(query, "avg", 3600) == "qos:cpu_usage_pct:avg_1h"
+    assert rules.unavailable == {}
+
+
+def test_load_missing_file_gives_empty_index(tmp_path):
+    rules = RecordingRules.load(str(tmp_path / "missing.yml"))
+    assert not rules
+    assert rules.rewrite("up") == "up"
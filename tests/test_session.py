@@ -0,0 +1,50 @@
+import time
+
+from src.session import SessionStore
+from src.snapshot import SnapshotBuilder
+
+
+def snapshot_of(metrics: list, fetched_at: float):
+    builder = SnapshotBuilder(metrics)
+    for metric in metrics:
+        builder.add(metric, "w1", 1.0)
+    snapshot = builder.build()
+    snapshot.fetched_at[:] = fetched_at
+    return snapshot
+
+
+def make_session(**ttls) -> SessionStore:
+    session = SessionStore(**ttls)
+    session.record("context", {"sanity_check_ok": True, "active_targets": ["w1"], "qos_config": {"metrics": {}}})
+    return session
+
+
+def test_seed_reuses_fresh_context_and_metrics():
+    session = make_session(metrics_ttl=60)
+    session.record("metrics_engine", {"metrics_report": snapshot_of(["cpu"], time.monotonic()), "metrics_scope": None})
+
+    seeded = session.seed()
+    assert seeded["active_targets"] == ["w1"]
+    assert seeded["metrics_report"].metrics == ["cpu"]
+
+
+def test_merged_stale_columns_expire():
+    session = make_session(metrics_ttl=60)
+    now = time.monotonic()
+    merged = snapshot_of(["cpu"], now - 120).merge(snapshot_of(["ram"], now))
+    session.record("metrics_engine", {"metrics_report": merged})
+
+    # La colonna "cpu" è stata riusata in un turno successivo, ma il suo download resta vecchio
+    assert session.seed()["metrics_report"].metrics == ["ram"]
+
+
+def test_all_stale_metrics_are_not_seeded():
+    session = make_session(metrics_ttl=60)
+    session.record("metrics_engine", {"metrics_report": snapshot_of(["cpu"], time.monotonic() - 120)})
+    assert "metrics_report" not in session.seed()
+
+
+def test_metrics_need_a_fresh_context():
+    session = make_session(targets_ttl=0, metrics_ttl=60)
+    session.record("metrics_engine", {"metrics_report": snapshot_of(["cpu"], time.monotonic())})
+    assert session.seed() == {}
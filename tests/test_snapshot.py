@@ -0,0 +1,77 @@
+import math
+
+import numpy as np
+
+from src.snapshot import MetricsSnapshot, SnapshotBuilder
+
+
+def make_snapshot(data: dict, metrics: list, fetched_at: float | None = None) -> MetricsSnapshot:
+    builder = SnapshotBuilder(metrics, decimals=None)
+    for node, values in data.items():
+        for metric, value in values.items():
+            builder.add(metric, node, value)
+    snapshot = builder.build()
+    if fetched_at is not None:
+        snapshot.fetched_at[:] = fetched_at
+    return snapshot
+
+
+def test_builder_fills_columnar_matrix_and_rounds():
+    builder = SnapshotBuilder(["cpu", "ram"], decimals=1)
+    builder.add("cpu", "w1", 12.345)
+    builder.add("ram", "w2", 2.0)
+    builder.add("disk", "w1", 1.0)      # Metrica non richiesta: ignorata
+    snapshot = builder.build()
+
+    assert snapshot.nodes == ["w1", "w2"]
+    assert snapshot.get("w1", "cpu") == 12.3
+    assert snapshot.get("w1", "ram") is None
+    assert snapshot.to_dict() == {"w1": {"cpu": 12.3}, "w2": {"ram": 2.0}}
+    assert builder.filled_metrics() == {"cpu", "ram"}
+
+
+def test_builder_node_filter():
+    builder = SnapshotBuilder(["cpu"], node_filter="w2")
+    builder.add("cpu", "w1", 1.0)
+    builder.add("cpu", "w2", 2.0)
+    assert builder.build().to_dict() == {"w2": {"cpu": 2.0}}
+
+
+def test_empty_snapshot():
+    snapshot = MetricsSnapshot.empty(["cpu"])
+    assert not snapshot
+    assert snapshot.values.shape == (0, 1)
+    assert snapshot.to_dict() == {}
+
+
+def test_column_of_missing_metric_is_nan():
+    snapshot = make_snapshot({"w1": {"cpu": 1.0}}, ["cpu"])
+    assert math.isnan(snapshot.column("ram")[0])
+
+
+def test_subset_and_select():
+    snapshot = make_snapshot({"w1": {"cpu": 1.0, "ram": 2.0}, "w2": {"cpu": 3.0}}, ["cpu", "ram"])
+
+    assert snapshot.subset(["w2", "missing"]).to_dict() == {"w2": {"cpu": 3.0}}
+    selected = snapshot.select(["ram"])
+    assert selected.metrics == ["ram"]
+    assert selected.to_dict() == {"w1": {"ram": 2.0}, "w2": {}}
+
+
+def test_merge_overwrites_only_present_values():
+    old = make_snapshot({"w1": {"cpu": 1.0, "ram": 2.0}}, ["cpu", "ram"])
+    new = make_snapshot({"w1": {"ram": 5.0}, "w2": {"disk": 7.0}}, ["ram", "disk"])
+    merged = old.merge(new)
+
+    assert merged.metrics == ["cpu", "ram", "disk"]
+    assert merged.to_dict() == {"w1": {"cpu": 1.0, "ram": 5.0}, "w2": {"disk": 7.0}}
+
+
+def test_merge_keeps_per_metric_fetch_times():
+    old = make_snapshot({"w1": {"cpu": 1.0, "ram": 2.0}}, ["cpu", "ram"], fetched_at=100.0)
+    new = make_snapshot({"w1": {"ram": 5.0}}, ["ram"], fetched_at=200.0)
+    merged = old.merge(new)
+
+    np.testing.assert_array_equal(merged.fetched_at, [100.0, 200.0])
+    assert merged.fresh_metrics(ttl=50.0, now=210.0) == ["ram"]
+    assert merged.select(["ram"]).fetched_at.tolist() == [200.0]
@@ -0,0 +1,93 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from src.stability import (ABSENT, CHAOTIC, SPIKE, STABLE, STATUS_NAMES, UNKNOWN, StabilityReport,
+                           classify_stability_matrix)
+
+
+# --- RIFERIMENTO: classificazione scalare della versione precedente (utils.classify_stability) ---
+
+def reference_classify(current, avg, std, delta_threshold) -> dict:
+    if std is None or avg is None or current is None:
+        return {"status": "UNKNOWN", "metrics": {}}
+    delta = abs(current - avg)
+    if std > 0:
+        z_score = delta / std
+    else:
+        z_score = 0.0 if delta == 0 else 999.9
+    if avg < delta_threshold:
+        cv = 0.0
+    else:
+        cv = (std / avg) if avg > 0 else 0.0
+    if cv > 0.3:
+        return {"status": "CHAOTIC", "metrics": {"z": z_score, "cv": cv}}
+    if z_score > 2.0:
+        if delta > delta_threshold:
+            return {"status": "SPIKE", "metrics": {"z": z_score, "cv": cv}}
+        return {"status": "FALSE_ALARM", "metrics": {"z": z_score, "cv": cv}}
+    return {"status": "STABLE", "metrics": {"z": z_score, "cv": cv}}
+
+
+# Griglia con i casi limite: std nulla, media sotto soglia, z e CV esattamente alle soglie
+CURRENTS = [0.0, 1.0, 5.0, 10.0, 14.0, 30.0, 100.0]
+AVGS = [0.0, 0.5, 4.0, 10.0, 20.0, 100.0]
+STDS = [0.0, 0.5, 2.0, 3.0, 6.0, 30.0]
+THRESHOLDS = [0.2, 1.0, 5.0, 50.0]
+
+
+def test_matrix_classification_matches_scalar_reference():
+    cases = list(itertools.product(CURRENTS, AVGS, STDS, THRESHOLDS))
+    current, avg, std, threshold = (np.array(column, dtype=np.float64) for column in zip(*cases))
+    codes, z, cv = classify_stability_matrix(current, avg, std, threshold)
+
+    for k, case in enumerate(cases):
+        expected = reference_classify(*case)
+        assert STATUS_NAMES[int(codes[k])] == expected["status"], case
+        assert z[k] == pytest.approx(expected["metrics"]["z"]), case
+        assert cv[k] == pytest.approx(expected["metrics"]["cv"]), case
+
+
+def test_missing_data_codes():
+    nan = np.nan
+    codes, _, _ = classify_stability_matrix(
+        np.array([1.0, nan, 1.0, 1.0]), np.array([1.0, 1.0, nan, 1.0]), np.array([nan, 1.0, 1.0, 0.0]),
+        np.array([1.0, 1.0, 1.0, 1.0])
+    )
+    assert codes.tolist() == [UNKNOWN, ABSENT, ABSENT, STABLE]
+    # Nel riferimento lo storico mancante era "UNKNOWN": stesso nome esposto dal report
+    assert STATUS_NAMES.get(ABSENT, "UNKNOWN") == reference_classify(None, 1.0, 1.0, 1.0)["status"]
+
+
+def test_report_keeps_worst_window():
+    nodes, metrics = ["w1", "w2"], ["cpu"]
+    current = np.array([[50.0], [10.0]])
+    # Finestra 0: w1 stabile, w2 caotico; finestra 1: w1 in picco, w2 stabile
+    avg = np.array([[[50.0], [10.0]], [[10.0], [10.0]]])
+    std = np.array([[[1.0], [9.0]], [[1.0], [0.5]]])
+    report = StabilityReport.build(nodes, metrics, current, avg, std, np.array([5.0]), windows=["1h", "7d"])
+
+    assert report.status("w1", "cpu") == "SPIKE"
+    assert report.window("w1", "cpu") == "7d"
+    assert report.status("w2", "cpu") == "CHAOTIC"
+    assert report.window("w2", "cpu") == "1h"
+    assert report.risky_count() == 2
+    assert sorted(report.risky_items()) == [("w1", "cpu", "SPIKE"), ("w2", "cpu", "CHAOTIC")]
+    assert report.reason("w1", "cpu").startswith("[7d] Picco di carico acuto")
+
+
+def test_report_single_window_and_unknown_pairs():
+    report = StabilityReport.build(["w1"], ["cpu", "ram"], np.array([[1.0, np.nan]]), np.array([[1.0, 1.0]]),
+                                   np.array([[0.1, 0.1]]), np.array([1.0, 1.0]))
+    assert report.status("w1", "cpu") == "STABLE"
+    assert report.window("w1", "cpu") is None
+    assert report.node_metrics("w1") == ["cpu"]
+    assert report.status("w1", "ram") == "UNKNOWN"
+    assert report.status("missing", "cpu") == "UNKNOWN"
+    assert report.reason("w1", "ram") == "No Data"
+    assert not StabilityReport.empty()
+
+
+def test_codes_are_ordered_by_severity():
+    assert ABSENT < UNKNOWN < STABLE < SPIKE < CHAOTIC